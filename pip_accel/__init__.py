@@ -39,6 +39,21 @@ installed, it will be added to the requirement set and installed together with
 the other requirement(s) in order to enable the usage of distributions
 installed from wheels (their metadata is different).
 
+Converting source distributions to wheels
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+When :attr:`.Config.build_wheels` is enabled source distributions are
+converted to wheels instead of dumb binary distributions. The wheels are cached
+just like dumb binary distributions and installed by :mod:`pip_accel.wheels`.
+
+Caching of downloaded wheels
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Wheel distribution archives downloaded by pip are stored in the cache
+backends (under their original filename) and installed from the cache by
+:mod:`pip_accel.wheels`. This means e.g. the Amazon S3 cache backend serves
+wheels alongside converted source distributions.
+
 .. _wheels: https://pypi.python.org/pypi/wheel
 """
 
@@ -52,7 +67,10 @@ import tempfile
 
 # Modules included in our package.
 from pip_accel.bdist import BinaryDistributionManager
+from pip_accel.downloads import ConcurrentDownloader
+from pip_accel.egg_info import EggInfoCache
 from pip_accel.exceptions import EnvironmentMismatchError, NothingToDoError
+from pip_accel.mirror import SourceMirror
 from pip_accel.req import Requirement
 from pip_accel.utils import (
     is_installed,
@@ -70,7 +88,9 @@ from pip import wheel as pip_wheel_module
 from pip._vendor import pkg_resources
 from pip.commands import install as pip_install_module
 from pip.commands.install import InstallCommand
+from pip.download import path_to_url
 from pip.exceptions import DistributionNotFound
+from pip.req import InstallRequirement, RequirementSet
 
 # Semi-standard module versioning.
 __version__ = '0.34'
@@ -102,6 +122,9 @@ class PipAccelerator(object):
         """
         self.config = config
         self.bdists = BinaryDistributionManager(self.config)
+        self.source_mirror = SourceMirror(self.config, self.bdists.cache)
+        self.downloader = ConcurrentDownloader(self.config)
+        self.egg_info_cache = EggInfoCache(self.config)
         if validate:
             self.validate_environment()
         self.initialize_directories()
@@ -211,7 +234,10 @@ class PipAccelerator(object):
 
         This function is a simple wrapper for :func:`get_requirements()`,
         :func:`install_requirements()` and :func:`cleanup_temporary_directories()`
-        that implements the default behavior of the pip accelerator. If you're
+        that implements the default behavior of the pip accelerator (it also
+        waits for background uploads, see :mod:`pip_accel.uploads`, saves
+        known cache misses, see :class:`~pip_accel.caches.NegativeCache`, and
+        reports cache metrics, see :mod:`pip_accel.metrics`). If you're
         extending or embedding pip-accel you may want to call the underlying
         methods instead.
 
@@ -228,7 +254,7 @@ class PipAccelerator(object):
         """
         try:
             requirements = self.get_requirements(arguments, use_wheels=self.arguments_allow_wheels(arguments))
-            have_wheels = any(req.is_wheel for req in requirements)
+            have_wheels = self.bdists.wheels_enabled or any(req.is_wheel for req in requirements)
             if have_wheels and not self.setuptools_supports_wheels():
                 logger.info("Preparing to upgrade to setuptools >= 0.8 to enable wheel support ..")
                 requirements.extend(self.get_requirements(['setuptools >= 0.8']))
@@ -238,6 +264,9 @@ class PipAccelerator(object):
                 logger.info("Nothing to do! (requirements already installed)")
                 return 0
         finally:
+            self.bdists.cache.wait_for_uploads()
+            self.bdists.cache.save_state()
+            self.bdists.cache.report_metrics()
             self.cleanup_temporary_directories()
 
     def setuptools_supports_wheels(self):
@@ -281,9 +310,16 @@ class PipAccelerator(object):
         # Use a new build directory for each run of get_requirements().
         self.create_build_directory()
         # Check whether -U or --upgrade was given.
-        if any(match_option(a, '-U', '--upgrade') for a in arguments):
+        upgrade = any(match_option(a, '-U', '--upgrade') for a in arguments)
+        # Decide whether pip should only be allowed to look up requirements
+        # that are missing from the local source index. When the source index
+        # is empty everything is missing and downloading the distribution
+        # archives concurrently (see download_source_dists()) is faster.
+        partial_resolution = (self.config.partial_resolution and not upgrade and
+                              bool(os.listdir(self.config.source_index)))
+        if upgrade:
             logger.info("Checking index(es) for new version (-U or --upgrade was given) ..")
-        else:
+        elif not partial_resolution:
             # If -U or --upgrade wasn't given and all requirements can be
             # satisfied using the archives in pip-accel's local source index we
             # don't need pip to connect to PyPI looking for new versions (that
@@ -298,9 +334,13 @@ class PipAccelerator(object):
             max_retries = self.config.max_retries
         # If not all requirements are available locally we use pip to download
         # the missing source distribution archives from PyPI (we retry a couple
-        # of times in case pip reports recoverable errors).
+        # of times in case pip reports recoverable errors). When partial
+        # resolution is enabled only the missing requirements are looked up
+        # on the package index(es), each retry included.
         for i in range(max_retries):
             try:
+                if partial_resolution:
+                    return self.unpack_source_dists(arguments, use_wheels=use_wheels, download_missing=True)
                 return self.download_source_dists(arguments, use_wheels=use_wheels)
             except Exception as e:
                 if i + 1 < max_retries:
@@ -314,7 +354,7 @@ class PipAccelerator(object):
                     raise
             logger.info("Retrying after pip failed (%i/%i) ..", i + 1, max_retries)
 
-    def unpack_source_dists(self, arguments, use_wheels=False):
+    def unpack_source_dists(self, arguments, use_wheels=False, download_missing=False):
         """
         Find and unpack local source distributions and discover their metadata.
 
@@ -323,6 +363,11 @@ class PipAccelerator(object):
         :param use_wheels: Whether pip and pip-accel are allowed to use wheels_
                            (:data:`False` by default for backwards compatibility
                            with callers that use pip-accel as a Python API).
+        :param download_missing: :data:`True` to allow pip to look up
+                                 requirements that can't be found in the local
+                                 source index on the package index(es) and
+                                 download them, :data:`False` (the default) to
+                                 keep pip off the internet.
         :returns: A list of :class:`pip_accel.req.Requirement` objects.
         :raises: Any exceptions raised by pip, for example
                  :exc:`pip.exceptions.DistributionNotFound` when not all
@@ -338,13 +383,30 @@ class PipAccelerator(object):
         - Resolution of possibly conflicting pinned requirements.
         - Unpacking source distributions in multiple formats.
         - Finding the name & version of a given source distribution.
+
+        When :attr:`.Config.source_mirroring` is enabled the archives of
+        requirements that can't be found in the local source index are
+        fetched from the cache backends (see :mod:`pip_accel.mirror`). When
+        `download_missing` is :data:`True` the remaining missing requirements
+        are downloaded from the package index(es), so that only the missing
+        requirements are looked up online and the rest of the resolution
+        happens offline (see :attr:`.Config.partial_resolution`).
         """
         unpack_timer = Timer()
         logger.info("Unpacking distribution(s) ..")
+        available_archives = set(os.listdir(self.config.source_index))
         with PatchedAttribute(pip_install_module, 'PackageFinder', CustomPackageFinder):
-            requirements = self.get_pip_requirement_set(arguments, use_remote_index=False, use_wheels=use_wheels)
-            logger.info("Finished unpacking %s in %s.", pluralize(len(requirements), "distribution"), unpack_timer)
-            return requirements
+            with PatchedAttribute(CustomPackageFinder, 'source_mirror', self.source_mirror):
+                with PatchedAttribute(CustomPackageFinder, 'download_missing', download_missing):
+                    # pip only passes the URLs of the package index(es) to the
+                    # package finder when --no-index isn't given, but the
+                    # package finder only uses them for missing requirements.
+                    requirements = self.get_pip_requirement_set(arguments, use_remote_index=download_missing,
+                                                                use_wheels=use_wheels)
+        logger.info("Finished unpacking %s in %s.", pluralize(len(requirements), "distribution"), unpack_timer)
+        if download_missing:
+            self.source_mirror.upload(requirements, available_archives)
+        return requirements
 
     def download_source_dists(self, arguments, use_wheels=False):
         """
@@ -356,11 +418,38 @@ class PipAccelerator(object):
                            (:data:`False` by default for backwards compatibility
                            with callers that use pip-accel as a Python API).
         :raises: Any exceptions raised by pip.
+
+        Unless :attr:`.Config.download_threads` is zero the distribution
+        archives are downloaded concurrently (see :mod:`pip_accel.downloads`).
+        When :attr:`.Config.source_mirroring` is enabled the downloaded
+        archives are stored in the cache backends (see :mod:`pip_accel.mirror`).
         """
         download_timer = Timer()
         logger.info("Downloading missing distribution(s) ..")
-        requirements = self.get_pip_requirement_set(arguments, use_remote_index=True, use_wheels=use_wheels)
+        available_archives = set(os.listdir(self.config.source_index))
+        if self.downloader.enabled:
+            downloader = self.downloader
+            add_requirement = RequirementSet.add_requirement
+
+            def add_and_download_requirement(requirement_set, install_req, parent_req_name=None):
+                # Start downloading requirements as soon as pip discovers them.
+                requirements = add_requirement(requirement_set, install_req, parent_req_name)
+                for requirement in requirements:
+                    downloader.submit(requirement_set, requirement)
+                return requirements
+
+            with PatchedAttribute(pip_install_module, 'PackageFinder', PrefetchingPackageFinder):
+                with PatchedAttribute(PrefetchingPackageFinder, 'downloader', downloader):
+                    with PatchedAttribute(RequirementSet, 'add_requirement', add_and_download_requirement):
+                        try:
+                            requirements = self.get_pip_requirement_set(arguments, use_remote_index=True,
+                                                                        use_wheels=use_wheels)
+                        finally:
+                            downloader.stop()
+        else:
+            requirements = self.get_pip_requirement_set(arguments, use_remote_index=True, use_wheels=use_wheels)
         logger.info("Finished downloading distribution(s) in %s.", download_timer)
+        self.source_mirror.upload(requirements, available_archives)
         return requirements
 
     def get_pip_requirement_set(self, arguments, use_remote_index, use_wheels=False):
@@ -446,7 +535,17 @@ class PipAccelerator(object):
             # will forcefully disable the option. Refer to the documentation of
             # the AttributeOverrides class for further details.
             opts = AttributeOverrides(opts, ignore_installed=False)
-        requirement_set = command.run(opts, args)
+        # Restore the metadata generated by `setup.py egg_info' from the cache
+        # instead of running setup.py for distribution archives that pip has
+        # unpacked before (see the pip_accel.egg_info module).
+        egg_info_cache = self.egg_info_cache
+        run_egg_info = InstallRequirement.run_egg_info
+
+        def run_egg_info_cached(requirement):
+            egg_info_cache.run_egg_info(requirement, run_egg_info)
+
+        with PatchedAttribute(InstallRequirement, 'run_egg_info', run_egg_info_cached):
+            requirement_set = command.run(opts, args)
         # Make sure the output of pip and pip-accel are not intermingled.
         sys.stdout.flush()
         if requirement_set is None:
@@ -489,7 +588,9 @@ class PipAccelerator(object):
 
         :param requirements: A list of :class:`pip_accel.req.Requirement` objects.
         :param kw: Any keyword arguments are passed on to
-                   :func:`~pip_accel.bdist.BinaryDistributionManager.install_binary_dist()`.
+                   :func:`~pip_accel.bdist.BinaryDistributionManager.install_binary_dist()`
+                   (or :func:`~pip_accel.bdist.BinaryDistributionManager.install_wheel_dist()`
+                   when :attr:`.Config.build_wheels` is enabled).
         :returns: The number of packages that were just installed (an integer).
         """
         install_timer = Timer()
@@ -501,6 +602,8 @@ class PipAccelerator(object):
         logger.info("Installing from %s distributions ..", concatenate(install_types))
         # Track installed files by default (unless the caller specifically opted out).
         kw.setdefault('track_installed_files', True)
+        # Check the availability of all cached distribution archives up front.
+        self.bdists.plan(requirements)
         num_installed = 0
         for requirement in requirements:
             # If we're upgrading over an older version, first remove the
@@ -520,11 +623,18 @@ class PipAccelerator(object):
                 command = InstallCommand()
                 opts, args = command.parse_args(['--no-deps', '--editable', requirement.source_directory])
                 command.run(opts, args)
+            elif requirement.wheel_archive:
+                logger.info("Installing %s wheel distribution ..", requirement)
+                wheel_distribution = self.bdists.get_wheel_dist(requirement)
+                self.bdists.install_wheel_dist(wheel_distribution, **kw)
             elif requirement.is_wheel:
                 logger.info("Installing %s wheel distribution using pip ..", requirement)
                 wheel_version = pip_wheel_module.wheel_version(requirement.source_directory)
                 pip_wheel_module.check_compatibility(wheel_version, requirement.name)
                 requirement.pip_requirement.move_wheel_files(requirement.source_directory)
+            elif self.bdists.wheels_enabled:
+                wheel_distribution = self.bdists.get_wheel_dist(requirement)
+                self.bdists.install_wheel_dist(wheel_distribution, **kw)
             else:
                 binary_distribution = self.bdists.get_binary_dist(requirement)
                 self.bdists.install_binary_dist(binary_distribution, **kw)
@@ -586,17 +696,63 @@ class CustomPackageFinder(pip_index_module.PackageFinder):
     for package indexes registered with the ``--index=`` option in requirements
     files. Judging by pip's documentation the fact that this has to be monkey
     patched seems like a bug / oversight in pip (IMHO).
+
+    When :attr:`source_mirror` is set and a requirement can't be found in the
+    local source index the archives of the requirement are fetched from the
+    mirror (see :mod:`pip_accel.mirror`) before giving up. When
+    :attr:`download_missing` is :data:`True` a requirement that still can't be
+    found is looked up on the package index(es) given to pip (and only that
+    requirement).
     """
 
+    source_mirror = None
+    """The :class:`.SourceMirror` used to fetch missing archives (or :data:`None`)."""
+
+    download_missing = False
+    """:data:`True` if missing requirements may be looked up on the package index(es), :data:`False` otherwise."""
+
+    remote_index_urls = []
+    """The URLs of the package index(es) given to pip (a list of strings)."""
+
+    looking_up_missing = False
+    """:data:`True` while a missing requirement is being looked up on the package index(es)."""
+
+    def find_requirement(self, req, upgrade):
+        """
+        Find a requirement in the local source index (or the source mirror or package index).
+
+        :param req: A :class:`pip.req.InstallRequirement` object.
+        :param upgrade: :data:`True` if the requirement should be upgraded.
+        :returns: A :class:`pip.index.Link` object or :data:`None`.
+        :raises: :exc:`pip.exceptions.DistributionNotFound` when the
+                 requirement can't be found.
+        """
+        try:
+            return super(CustomPackageFinder, self).find_requirement(req, upgrade)
+        except DistributionNotFound:
+            if self.source_mirror and self.source_mirror.fetch(req.name, req):
+                try:
+                    return super(CustomPackageFinder, self).find_requirement(req, upgrade)
+                except DistributionNotFound:
+                    pass
+            if not (self.download_missing and self.remote_index_urls):
+                raise
+        logger.info("Looking up missing requirement on package index: %s", req)
+        self.looking_up_missing = True
+        try:
+            return super(CustomPackageFinder, self).find_requirement(req, upgrade)
+        finally:
+            self.looking_up_missing = False
+
     @property
     def index_urls(self):
-        """Dummy list of index URLs that is always empty."""
-        return []
+        """The package index(es) while looking up a missing requirement, an empty list otherwise."""
+        return self.remote_index_urls if self.looking_up_missing else []
 
     @index_urls.setter
     def index_urls(self, value):
-        """Dummy setter for index URLs that ignores the value set."""
-        pass
+        """Remember the package index(es) for looking up missing requirements."""
+        self.remote_index_urls = value
 
     @property
     def dependency_links(self):
@@ -609,6 +765,41 @@ class CustomPackageFinder(pip_index_module.PackageFinder):
         pass
 
 
+class PrefetchingPackageFinder(pip_index_module.PackageFinder):
+
+    """
+    Custom :class:`pip.index.PackageFinder` that uses concurrently downloaded archives.
+
+    This class cooperates with :class:`~pip_accel.downloads.ConcurrentDownloader`:
+    When pip asks for the distribution archive of a requirement whose archive
+    is being downloaded in the background, the package finder waits for the
+    download to finish and points pip at the downloaded archive.
+    """
+
+    downloader = None
+    """The :class:`.ConcurrentDownloader` that downloads archives in the background (or :data:`None`)."""
+
+    def __init__(self, *args, **kw):
+        """Initialize the package finder and start accepting background downloads."""
+        super(PrefetchingPackageFinder, self).__init__(*args, **kw)
+        if self.downloader:
+            self.downloader.start(self)
+
+    def find_requirement(self, req, upgrade):
+        """
+        Find a requirement (preferring an archive that was downloaded in the background).
+
+        :param req: A :class:`pip.req.InstallRequirement` object.
+        :param upgrade: :data:`True` if the requirement should be upgraded.
+        :returns: A :class:`pip.index.Link` object or :data:`None`.
+        """
+        if self.downloader and req.satisfied_by is None:
+            pathname = self.downloader.wait(req)
+            if pathname:
+                return pip_index_module.Link(path_to_url(pathname))
+        return super(PrefetchingPackageFinder, self).find_requirement(req, upgrade)
+
+
 class PatchedAttribute(object):
 
     """
@@ -13,6 +13,7 @@ easy_install and pip).
 """
 
 # Standard library modules.
+import collections
 import fnmatch
 import logging
 import os
@@ -25,20 +26,66 @@ import subprocess
 import sys
 import tarfile
 import tempfile
-import time
+import threading
 
 # External dependencies.
-from humanfriendly import Spinner, Timer, concatenate
+from cached_property import cached_property
+from humanfriendly import Spinner, Timer, concatenate, format_timespan
 
 # Modules included in our package.
 from pip_accel.caches import CacheManager
 from pip_accel.deps import SystemPackageManager
-from pip_accel.exceptions import BuildFailed, InvalidSourceDistribution, NoBuildOutput
-from pip_accel.utils import compact, makedirs
+from pip_accel.exceptions import BuildFailed, BuildTimeout, InvalidSourceDistribution, NoBuildOutput
+from pip_accel.utils import (
+    FileLock,
+    compact,
+    get_python_version,
+    is_installed,
+    makedirs,
+    synchronize_directories,
+)
+from pip_accel.wheels import install_wheel
+from pip_accel.workers import BuildWorkerPool
 
 # Initialize a logger for this module.
 logger = logging.getLogger(__name__)
 
+BUILD_OUTPUT_LINES = 1000
+"""The maximum number of lines of build output kept for error reporting (an integer)."""
+
+BUILD_TREE_SETUP_SCRIPT = r'''
+# Generated by pip-accel: Runs the setup.py script in the parent directory and
+# removes the extension modules that it no longer declares after every build.
+import os
+import distutils.command.build
+def pip_accel_run_build(self, run_build=distutils.command.build.build.run):
+    run_build(self)
+    build_ext = self.get_finalized_command('build_ext')
+    outputs = set(os.path.abspath(fn) for fn in build_ext.get_outputs())
+    for root, dirs, files in os.walk(build_ext.build_lib):
+        for name in files:
+            pathname = os.path.abspath(os.path.join(root, name))
+            if name.endswith(%r) and pathname not in outputs:
+                os.unlink(pathname)
+distutils.command.build.build.run = pip_accel_run_build
+__file__ = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'setup.py')
+exec(compile(open(__file__).read().replace('\r\n', '\n'), __file__, 'exec'))
+'''
+"""
+The wrapper used to run ``setup.py`` scripts in persistent build trees (a string).
+
+Refer to :class:`BuildTree` for details.
+"""
+
+EXTENSION_MODULE_SUFFIXES = ('.so', '.pyd')
+"""The filename extensions of compiled extension modules (a tuple of strings)."""
+
+SPINNER_INTERVAL = 0.2
+"""The number of seconds between updates of the spinner shown during builds (a number)."""
+
+SUPERVISOR_INTERVAL = 1
+"""The maximum number of seconds that build supervision blocks at a time (a number)."""
+
 
 class BinaryDistributionManager(object):
 
@@ -54,6 +101,7 @@ class BinaryDistributionManager(object):
         self.config = config
         self.cache = CacheManager(config)
         self.system_package_manager = SystemPackageManager(config)
+        self.build_workers = BuildWorkerPool(config)
 
     def get_binary_dist(self, requirement):
         """
@@ -72,7 +120,17 @@ class BinaryDistributionManager(object):
         will use :class:`.SystemPackageManager` to check for and install
         missing system packages and retry the build when missing system
         packages were installed.
+
+        When :attr:`.Config.streaming_installs` is enabled cached binary
+        distributions are extracted while they're being downloaded (see
+        :func:`extract_stream()`).
         """
+        if self.config.streaming_installs:
+            stream = self.cache.get_stream(requirement)
+            if stream is not None:
+                for member, handle in self.extract_stream(stream):
+                    yield member, handle
+                return
         cache_file = self.cache.get(requirement)
         # TODO Invalidating cached file does not work on Appveyor and external storage.
         #if cache_file and requirement.last_modified > os.path.getmtime(cache_file):
@@ -81,14 +139,7 @@ class BinaryDistributionManager(object):
         if not cache_file:
             logger.debug("%s hasn't been cached yet, doing so now.", requirement)
             # Build the binary distribution.
-            try:
-                raw_file = self.build_binary_dist(requirement)
-            except BuildFailed:
-                logger.warning("Build of %s failed, checking for missing dependencies ..", requirement)
-                if self.system_package_manager.install_dependencies(requirement):
-                    raw_file = self.build_binary_dist(requirement)
-                else:
-                    raise
+            raw_file = self.build_with_dependencies(requirement, self.build_binary_dist)
             # Transform the binary distribution archive into a form that we can re-use.
             fd, transformed_file = tempfile.mkstemp(prefix='pip-accel-bdist-', suffix='.tar.gz')
             try:
@@ -115,6 +166,131 @@ class BinaryDistributionManager(object):
             yield member, archive.extractfile(member.name)
         archive.close()
 
+    def extract_stream(self, stream):
+        """
+        Extract a binary distribution archive from a (non-seekable) stream.
+
+        :param stream: A readable file-like object (usually returned by
+                       :func:`.CacheManager.get_stream()`).
+        :returns: An iterable of tuples with two values each: A
+                  :class:`tarfile.TarInfo` object and a file-like object.
+
+        The archive is read in a single pass, so the file-like object of each
+        member has to be consumed before the next member is requested (which
+        is what :func:`install_binary_dist()` does). Afterwards the remainder
+        of the stream is read so that streams returned by cache backends can
+        complete their copy to the local cache.
+        """
+        try:
+            archive = tarfile.open(fileobj=stream, mode='r|gz')
+            for member in archive:
+                yield member, archive.extractfile(member)
+            archive.close()
+            while stream.read(1024 * 64):
+                pass
+        finally:
+            stream.close()
+
+    @cached_property
+    def wheels_enabled(self):
+        """
+        :data:`True` if source distributions are converted to wheels, :data:`False` otherwise.
+
+        This is based on :attr:`.Config.build_wheels` and whether the `wheel`
+        package (which implements ``setup.py bdist_wheel``) is installed.
+        """
+        if self.config.build_wheels:
+            if is_installed('wheel'):
+                return True
+            logger.warning("Building dumb binary distributions because the `wheel' package isn't installed!")
+        return False
+
+    def plan(self, requirements):
+        """
+        Check which of the cached distribution archives for a requirement set are available.
+
+        :param requirements: A list of :class:`.Requirement` objects.
+        :returns: The result of :func:`.CacheManager.plan()`.
+
+        Editable requirements and wheels that are installed using pip are
+        ignored because they don't involve the cache. Distribution archives
+        that are available in remote cache backends are prefetched (see
+        :func:`.CacheManager.prefetch()`).
+        """
+        extension = 'whl' if self.wheels_enabled else 'tar.gz'
+        available = self.cache.plan([self.cache.generate_filename(r, extension) for r in requirements
+                                     if not r.is_editable and (r.wheel_archive or not r.is_wheel)])
+        self.cache.prefetch(available)
+        return available
+
+    def get_wheel_dist(self, requirement):
+        """
+        Get or create a cached wheel distribution archive.
+
+        :param requirement: A :class:`.Requirement` object.
+        :returns: The absolute pathname of the cached wheel distribution
+                  archive (a string).
+
+        This is the counterpart of :func:`get_binary_dist()` that's used when
+        :attr:`wheels_enabled` is :data:`True`. Wheels don't need to be
+        transformed before they're added to the cache.
+
+        Wheel distribution archives downloaded by pip (see
+        :attr:`.Requirement.wheel_archive`) are added to the cache as is.
+        """
+        cache_file = self.cache.get(requirement, extension='whl')
+        if not cache_file:
+            logger.debug("%s hasn't been cached yet, doing so now.", requirement)
+            if requirement.wheel_archive:
+                raw_file = requirement.wheel_archive
+            else:
+                raw_file = self.build_with_dependencies(requirement, self.build_wheel_dist)
+            # Push the wheel distribution archive to all available backends.
+            with open(raw_file, 'rb') as handle:
+                self.cache.put(requirement, handle, extension='whl')
+            # Get the absolute pathname of the file in the local cache.
+            cache_file = self.cache.get(requirement, extension='whl')
+        return cache_file
+
+    def build_with_dependencies(self, requirement, build_function):
+        """
+        Build a distribution archive, installing missing system packages when needed.
+
+        :param requirement: A :class:`.Requirement` object.
+        :param build_function: The function that builds the distribution
+                               archive (:func:`build_binary_dist()` or
+                               :func:`build_wheel_dist()`).
+        :returns: The pathname of the distribution archive (a string).
+
+        If the build fails :class:`.SystemPackageManager` is used to check for
+        and install missing system packages and the build is retried when
+        missing system packages were installed.
+        """
+        try:
+            return build_function(requirement)
+        except BuildFailed:
+            logger.warning("Build of %s failed, checking for missing dependencies ..", requirement)
+            if self.system_package_manager.install_dependencies(requirement):
+                return build_function(requirement)
+            else:
+                raise
+
+    def build_wheel_dist(self, requirement):
+        """
+        Build a wheel distribution archive from an unpacked source distribution.
+
+        :param requirement: A :class:`.Requirement` object.
+        :returns: The pathname of a wheel distribution archive (a string).
+        :raises: :exc:`.BinaryDistributionError` when the build fails.
+
+        This method uses the following command to build wheel distributions:
+
+        .. code-block:: sh
+
+           $ python setup.py bdist_wheel
+        """
+        return self.build_binary_dist_helper(requirement, ['bdist_wheel'])
+
     def build_binary_dist(self, requirement):
         """
         Build a binary distribution archive from an unpacked source distribution.
@@ -185,6 +361,18 @@ class BinaryDistributionManager(object):
         if os.path.isdir(dist_directory):
             logger.debug("Cleaning up previously generated distributions in %s ..", dist_directory)
             shutil.rmtree(dist_directory)
+        # When incremental builds are enabled we build in a persistent build
+        # tree, but the resulting archive is still written to the directory
+        # where pip unpacked the source distribution (which is private to
+        # the current process).
+        build_directory = requirement.source_directory
+        build_tree = None
+        if self.config.incremental_builds:
+            build_tree = BuildTree(self.config, requirement)
+            build_tree.prepare()
+            build_directory = build_tree.directory
+            setup_script = build_tree.setup_script
+            setup_command = list(setup_command) + ['--dist-dir=%s' % dist_directory]
         # Let the user know (approximately) which command is being executed
         # (I don't think it's necessary to show them the nasty details :-).
         logger.debug("Executing external command: %s",
@@ -202,20 +390,38 @@ class BinaryDistributionManager(object):
                 r"exec(compile(open(__file__).read().replace('\r\n', '\n'), __file__, 'exec'))",
             ])
         ] + setup_command
-        # Redirect all output of the build to a temporary file.
-        fd, temporary_file = tempfile.mkstemp()
+        # Start the build using a warm build worker when possible, otherwise
+        # fall back to starting a new Python process. In both cases the output
+        # of the build is captured in a bounded ring buffer.
+        output = None
+        build = None
         try:
-            # Start the build.
-            build = subprocess.Popen(command_line, cwd=requirement.source_directory, stdout=fd, stderr=fd)
+            if self.build_workers.enabled:
+                output = BuildOutput()
+                build = self.build_workers.start_build(setup_script=setup_script,
+                                                       arguments=setup_command,
+                                                       directory=build_directory,
+                                                       output=output.create_fifo())
+                if build is None:
+                    output.close()
+            if build is None:
+                output = BuildOutput()
+                pipe = output.create_pipe()
+                try:
+                    build = subprocess.Popen(command_line, cwd=build_directory, stdout=pipe, stderr=pipe)
+                finally:
+                    os.close(pipe)
             # Wait for the build to finish and provide feedback to the user in the mean time.
-            spinner = Spinner(label=build_text, timer=build_timer)
-            while build.poll() is None:
-                spinner.step()
-                # Don't tax the CPU too much.
-                time.sleep(0.2)
-            spinner.clear()
+            timed_out = not self.supervise_build(build, Spinner(label=build_text, timer=build_timer))
+            output.close()
             # Make sure the build succeeded and produced a binary distribution archive.
             try:
+                # If the build was killed because it was running for too long
+                # we don't bother looking for a binary distribution archive.
+                if timed_out:
+                    raise BuildTimeout("Build of {name} ({version}) was killed after running for {timeout}!",
+                                       name=requirement.name, version=requirement.version,
+                                       timeout=format_timespan(self.config.build_timeout))
                 # If the build reported an error we'll try to provide the user with
                 # some hints about what went wrong.
                 if build.returncode != 0:
@@ -238,8 +444,6 @@ class BinaryDistributionManager(object):
                     """, **variables)
             except Exception as e:
                 # Decorate the exception with the output of the failed build.
-                with open(temporary_file) as handle:
-                    build_output = handle.read()
                 enhanced_message = compact("""
                     {message}
 
@@ -249,17 +453,74 @@ class BinaryDistributionManager(object):
                     Build output:
 
                     {output}
-                """, message=e.args[0], output=build_output.strip())
+                """, message=e.args[0], output=output.text.strip())
                 e.args = (enhanced_message,)
                 raise
             logger.info("Finished building %s in %s.", requirement.name, build_timer)
             return os.path.join(dist_directory, filenames[0])
         finally:
-            # Close file descriptor before removing the temporary file.
-            # Without closing Windows is complaining that the file cannot
-            # be removed because it is used by another process.
-            os.close(fd)
-            os.unlink(temporary_file)
+            # Make sure the build doesn't outlive an unexpected exception (e.g.
+            # KeyboardInterrupt) and that all resources are released.
+            if build is not None and build.returncode is None:
+                build.kill()
+            if output is not None:
+                output.close()
+            if build_tree is not None:
+                build_tree.release()
+
+    def supervise_build(self, build, spinner):
+        """
+        Wait for a build to finish while providing feedback to the user.
+
+        :param build: A :class:`subprocess.Popen` or :class:`.WorkerBuild`
+                      object.
+        :param spinner: A :class:`~humanfriendly.Spinner` object.
+        :returns: :data:`True` if the build finished by itself, :data:`False`
+                  if it was killed because it ran for longer than
+                  :attr:`.Config.build_timeout`.
+
+        Instead of polling the build this method waits for the build to exit in
+        a separate thread, which means the build's exit is noticed immediately.
+        The spinner is driven by a timer thread of its own.
+        """
+        finished = threading.Event()
+
+        def wait_for_build():
+            try:
+                build.wait()
+            finally:
+                finished.set()
+
+        def update_spinner():
+            while not finished.is_set():
+                spinner.step()
+                finished.wait(SPINNER_INTERVAL)
+
+        threads = [threading.Thread(target=wait_for_build), threading.Thread(target=update_spinner)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        try:
+            timer = Timer()
+            timeout = self.config.build_timeout
+            while not finished.is_set():
+                # We wait in bounded intervals because on Python 2 a blocking
+                # wait would prevent KeyboardInterrupt from being delivered.
+                remaining = (timeout - timer.elapsed_time) if timeout else SUPERVISOR_INTERVAL
+                if remaining <= 0:
+                    logger.warning("Killing build because it's been running for more than %s!",
+                                   format_timespan(timeout))
+                    build.kill()
+                    while not finished.is_set():
+                        finished.wait(SUPERVISOR_INTERVAL)
+                    return False
+                finished.wait(min(remaining, SUPERVISOR_INTERVAL))
+            return True
+        finally:
+            finished.wait(SUPERVISOR_INTERVAL)
+            for thread in threads:
+                thread.join(SUPERVISOR_INTERVAL)
+            spinner.clear()
 
     def transform_binary_dist(self, archive_path):
         """
@@ -414,6 +675,24 @@ class BinaryDistributionManager(object):
         if track_installed_files:
             self.update_installed_files(installed_files)
 
+    def install_wheel_dist(self, pathname, virtualenv_compatible=True, prefix=None,
+                           python=None, track_installed_files=True):
+        """
+        Install a wheel distribution into the given prefix.
+
+        :param pathname: The pathname of a wheel distribution archive created
+                         by :func:`get_wheel_dist()` (a string).
+
+        The remaining parameters are the same as for
+        :func:`install_binary_dist()`, except that the installed files are
+        always tracked (in the ``RECORD`` file) regardless of the value of
+        `track_installed_files`. Refer to :mod:`pip_accel.wheels` for details.
+        """
+        install_wheel(pathname=pathname,
+                      prefix=os.path.normpath(prefix or self.config.install_prefix),
+                      python=os.path.normpath(python or self.config.python_executable),
+                      virtualenv_compatible=virtualenv_compatible)
+
     def fix_hashbang(self, contents, python):
         """
         Rewrite hashbangs_ to use the correct Python executable.
@@ -464,3 +743,184 @@ class BinaryDistributionManager(object):
             with open(installed_files_path, 'w') as handle:
                 for pathname in installed_files:
                     handle.write('%s\n' % os.path.relpath(pathname, egg_info_directory))
+
+
+class BuildOutput(object):
+
+    """
+    Capture the output of a build in a bounded ring buffer.
+
+    The output of a build is streamed through a pipe (for builds running in a
+    new Python process) or a named pipe (for builds running in a warm build
+    worker) and a background thread collects the last
+    :data:`BUILD_OUTPUT_LINES` lines so that they can be reported when the
+    build fails.
+    """
+
+    def __init__(self, max_lines=BUILD_OUTPUT_LINES):
+        """
+        Initialize a :class:`BuildOutput` object.
+
+        :param max_lines: The maximum number of lines to keep (an integer).
+        """
+        self.lines = collections.deque(maxlen=max_lines)
+        self.directory = None
+        self.keepalive_fd = None
+        self.reader = None
+
+    def create_pipe(self):
+        """
+        Create an anonymous pipe for a build that runs in a subprocess.
+
+        :returns: The file descriptor of the write end of the pipe (an
+                  integer). The caller is responsible for closing the file
+                  descriptor after the subprocess has been started.
+        """
+        read_fd, write_fd = os.pipe()
+        self.start_reader(read_fd)
+        return write_fd
+
+    def create_fifo(self):
+        """
+        Create a named pipe for a build that runs in a warm build worker.
+
+        :returns: The pathname of the named pipe (a string).
+
+        Until :func:`close()` is called the named pipe is kept open for
+        writing by the current process, this ensures that the reader never
+        sees an end of file before the build has actually started (or when
+        the build never gets around to opening the named pipe).
+        """
+        import fcntl
+        self.directory = tempfile.mkdtemp(prefix='pip-accel-build-output-')
+        pathname = os.path.join(self.directory, 'output')
+        os.mkfifo(pathname)
+        read_fd = os.open(pathname, os.O_RDONLY | os.O_NONBLOCK)
+        self.keepalive_fd = os.open(pathname, os.O_WRONLY)
+        flags = fcntl.fcntl(read_fd, fcntl.F_GETFL)
+        fcntl.fcntl(read_fd, fcntl.F_SETFL, flags & ~os.O_NONBLOCK)
+        self.start_reader(read_fd)
+        return pathname
+
+    def start_reader(self, fd):
+        """
+        Start a background thread that collects the output written to a pipe.
+
+        :param fd: The file descriptor of the read end of the pipe (an integer).
+        """
+        def collect_output():
+            with os.fdopen(fd, 'rb') as handle:
+                for line in iter(handle.readline, b''):
+                    self.lines.append(line)
+        self.reader = threading.Thread(target=collect_output)
+        self.reader.daemon = True
+        self.reader.start()
+
+    @property
+    def text(self):
+        """The captured output (a string)."""
+        data = b''.join(self.lines)
+        return data if isinstance(data, str) else data.decode('utf-8', 'replace')
+
+    def close(self):
+        """Wait for the remaining output to arrive and release all resources."""
+        if self.keepalive_fd is not None:
+            os.close(self.keepalive_fd)
+            self.keepalive_fd = None
+        if self.reader is not None:
+            self.reader.join(SUPERVISOR_INTERVAL)
+            self.reader = None
+        if self.directory is not None:
+            shutil.rmtree(self.directory)
+            self.directory = None
+
+
+class BuildTree(object):
+
+    """
+    Persistent build tree of a package (see :attr:`.Config.incremental_builds`).
+
+    Before every build the persistent build tree is refreshed from the
+    directory where pip unpacked the source distribution. Only files whose
+    contents changed are copied (and so get a new last modified time) while
+    the compiled extension modules in ``build/lib*`` and the object files in
+    ``build/temp*`` are retained, so ``build_ext`` skips extension modules
+    whose sources didn't change.
+
+    To make sure that modules and scripts removed from a package don't end up
+    in a binary distribution all other build products are removed before every
+    build (see :func:`clean_build_products()`). Extension modules can't be
+    removed up front (that would defeat the purpose) so ``setup.py`` is run
+    using a small wrapper (see :data:`BUILD_TREE_SETUP_SCRIPT`) that removes
+    the extension modules which the package no longer declares after the
+    ``build`` command and before the binary distribution is created. A lock
+    file prevents concurrent builds of the same package.
+    """
+
+    def __init__(self, config, requirement):
+        """
+        Initialize a :class:`BuildTree` object.
+
+        :param config: The pip-accel configuration (a :class:`.Config`
+                       object).
+        :param requirement: A :class:`.Requirement` object.
+        """
+        self.requirement = requirement
+        self.directory = os.path.join(config.build_trees, get_python_version(), requirement.name.lower())
+        self.lock = FileLock(self.directory + '.lock')
+
+    @property
+    def setup_script(self):
+        """The pathname of the wrapper around the ``setup.py`` script of the build tree (a string)."""
+        return os.path.join(self.directory, 'build', 'pip-accel-setup.py')
+
+    def prepare(self):
+        """Lock the build tree and refresh it from the unpacked source distribution."""
+        self.lock.acquire()
+        try:
+            reused = os.path.isdir(self.directory)
+            makedirs(self.directory)
+            num_updated = synchronize_directories(self.requirement.source_directory, self.directory,
+                                                  preserve=['build'])
+            self.clean_build_products()
+            makedirs(os.path.dirname(self.setup_script))
+            with open(self.setup_script, 'w') as handle:
+                handle.write(BUILD_TREE_SETUP_SCRIPT % (EXTENSION_MODULE_SUFFIXES,))
+        except Exception:
+            self.release()
+            raise
+        if reused:
+            logger.info("Reusing build tree of %s (%i files changed) ..", self.requirement.name, num_updated)
+        else:
+            logger.debug("Created build tree of %s in %s.", self.requirement.name, self.directory)
+
+    def clean_build_products(self):
+        """
+        Remove the products of previous builds from the ``build/`` directory.
+
+        Everything except the ``build/temp*`` directories (which contain the
+        object files of compiled extension modules) and the extension modules
+        in the ``build/lib*`` directories is removed, so modules and scripts
+        that were dropped or renamed by a new version of the package can't end
+        up in the binary distribution. Modules and scripts are cheap to copy
+        again, compiled extension modules are not.
+        """
+        build_directory = os.path.join(self.directory, 'build')
+        if os.path.isdir(build_directory):
+            for entry in os.listdir(build_directory):
+                pathname = os.path.join(build_directory, entry)
+                if entry.startswith('temp'):
+                    continue
+                elif entry.startswith('lib') and os.path.isdir(pathname) and not os.path.islink(pathname):
+                    for root, dirs, files in os.walk(pathname):
+                        for name in files:
+                            if not name.endswith(EXTENSION_MODULE_SUFFIXES):
+                                os.unlink(os.path.join(root, name))
+                elif os.path.isdir(pathname) and not os.path.islink(pathname):
+                    shutil.rmtree(pathname)
+                else:
+                    os.unlink(pathname)
+
+    def release(self):
+        """Unlock the build tree."""
+        self.lock.release()
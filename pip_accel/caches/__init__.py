@@ -18,15 +18,24 @@ which automatically disables backends that report errors.
 """
 
 # Standard library modules.
+import atexit
+import json
 import logging
+import os.path
+import shutil
+import tempfile
+import threading
+import time
 
 # Modules included in our package.
 from pip_accel.compat import WINDOWS
 from pip_accel.exceptions import CacheBackendDisabledError
-from pip_accel.utils import get_python_version
+from pip_accel.metrics import BackendStatistics, CacheMetrics
+from pip_accel.uploads import UploadQueue
+from pip_accel.utils import AtomicReplace, FileLock, TeeReader, get_python_version, makedirs, run_concurrently
 
 # External dependencies.
-from humanfriendly import concatenate, pluralize
+from humanfriendly import Timer, concatenate, format_timespan, pluralize
 from pkg_resources import get_entry_map
 
 # Initialize a logger for this module.
@@ -35,8 +44,32 @@ logger = logging.getLogger(__name__)
 # Initialize the registry of cache backends.
 registered_backends = set()
 
+# The temporary directory where remote cache backends download files when the
+# local file system cache backend is disabled (see get_download_directory()).
+download_directory = None
+download_directory_lock = threading.Lock()
+
 # On Windows it is not allowed to have colons in filenames so we use a dollar sign instead.
-FILENAME_PATTERN = 'v%i\\%s$%s$%s.tar.gz' if WINDOWS else 'v%i/%s:%s:%s.tar.gz'
+FILENAME_PATTERN = 'v%i\\%s$%s$%s.%s' if WINDOWS else 'v%i/%s:%s:%s.%s'
+
+# Wheel distribution archives downloaded by pip are stored under their original filename.
+WHEEL_FILENAME_PATTERN = 'v%i\\wheels\\%s' if WINDOWS else 'v%i/wheels/%s'
+
+# Mirrored source distribution archives and the manifests that list the
+# mirrored archives of each project (see pip_accel.mirror).
+SOURCE_FILENAME_PATTERN = 'sources\\%s' if WINDOWS else 'sources/%s'
+SOURCE_MANIFEST_PATTERN = 'sources\\index\\%s.json' if WINDOWS else 'sources/index/%s.json'
+SOURCE_MANIFEST_DIRECTORY = os.path.dirname(SOURCE_MANIFEST_PATTERN % 'project')
+
+# The number of seconds to wait before the first retry of a failed cache
+# backend operation (the delay doubles with each retry).
+RETRY_DELAY = 0.5
+
+# The number of seconds that a circuit breaker stays open after the first
+# failure (the duration doubles with each consecutive failure) and the
+# maximum number of seconds that a circuit breaker stays open.
+CIRCUIT_BREAKER_DURATION = 30
+CIRCUIT_BREAKER_MAX_DURATION = 60 * 10
 
 
 class CacheBackendMeta(type):
@@ -44,9 +77,10 @@ class CacheBackendMeta(type):
     """Metaclass to intercept cache backend definitions."""
 
     def __init__(cls, name, bases, dict):
-        """Intercept cache backend definitions."""
+        """Intercept cache backend definitions (except those that disable :attr:`~AbstractCacheBackend.REGISTER`)."""
         type.__init__(cls, name, bases, dict)
-        registered_backends.add(cls)
+        if dict.get('REGISTER', True):
+            registered_backends.add(cls)
 
 
 class AbstractCacheBackend(object):
@@ -73,6 +107,29 @@ class AbstractCacheBackend(object):
 
     PRIORITY = 0
 
+    REGISTER = True
+    """
+    :data:`False` for cache backends that shouldn't be instantiated by
+    :class:`CacheManager` (e.g. test doubles). Unlike the other class
+    attributes this one isn't inherited: It only applies to the class that
+    defines it.
+    """
+
+    REMOTE = False
+    """
+    :data:`True` for cache backends that store distribution archives on
+    another system, :data:`False` otherwise. Uploads to remote cache backends
+    can be performed in the background (see :mod:`pip_accel.uploads`).
+    """
+
+    WRITABLE = True
+    """
+    :data:`True` for cache backends that accept new distribution archives,
+    :data:`False` for read only cache backends. Distribution archives found
+    in a cache backend are copied to the writable cache backends that are
+    consulted before it (see :func:`CacheManager.promote()`).
+    """
+
     def __init__(self, config):
         """
         Initialize a cache backend.
@@ -82,6 +139,19 @@ class AbstractCacheBackend(object):
         """
         self.config = config
 
+    @property
+    def location(self):
+        """
+        The location of the cache (a string or :data:`None`).
+
+        Remote cache backends can be configured to use different locations
+        (e.g. another Amazon S3 bucket), so state that is kept about the
+        contents of a backend (see :class:`NegativeCache`) is keyed on the
+        location in addition to the name of the backend. The default is
+        :data:`None` (the name of the backend identifies the cache).
+        """
+        return None
+
     def get(self, filename):
         """
         Get a previously cached distribution archive from the cache.
@@ -97,6 +167,92 @@ class AbstractCacheBackend(object):
         """
         raise NotImplementedError()
 
+    def get_stream(self, filename):
+        """
+        Get a readable stream for a previously cached distribution archive.
+
+        :param filename: The expected filename of the distribution archive (a
+                         string).
+        :returns: A readable file-like object or :data:`None` when the
+                  distribution archive hasn't been cached.
+
+        The default implementation opens the local file returned by
+        :func:`get()`. Backends for which :func:`get()` involves a download
+        can override this method to return a stream that can be consumed while
+        the download is in progress (see :attr:`.Config.streaming_installs`).
+        """
+        pathname = self.get(filename)
+        if pathname is not None:
+            return open(pathname, 'rb')
+
+    def get_download_pathname(self, filename):
+        """
+        Get the pathname where a remote cache backend should download a file.
+
+        :param filename: The filename of the file in the cache (a string).
+        :returns: The pathname of a file in :attr:`.Config.binary_cache` when
+                  the local file system cache backend is enabled, otherwise
+                  the pathname of a file in the temporary directory returned
+                  by :func:`get_download_directory()` (a string).
+
+        When another local cache backend is selected (see
+        :attr:`.Config.local_cache_backend`) downloads mustn't end up in
+        :attr:`.Config.binary_cache`: :class:`CacheManager` stores them in the
+        local cache backend instead (see :func:`CacheManager.promote()`).
+        The manifests of mirrored source archives are always downloaded to
+        temporary files, because each cache backend has its own version of a
+        manifest (see :mod:`pip_accel.mirror`).
+        """
+        if self.config.local_cache_backend == 'files' and not is_source_manifest(filename):
+            return os.path.join(self.config.binary_cache, filename)
+        return os.path.join(get_download_directory(), repr(self), filename)
+
+    def exists_many(self, filenames):
+        """
+        Check which of the given distribution archives exist in the cache.
+
+        :param filenames: A list of strings with the filenames of distribution
+                          archives.
+        :returns: A set of strings with the filenames of the distribution
+                  archives that exist in the cache or :data:`None` when the
+                  backend doesn't support bulk lookups (the default).
+
+        This method is called by :func:`CacheManager.plan()` before any
+        distribution archives are fetched or built. Backends for which
+        :func:`get()` involves a network round trip can implement this method
+        to answer the question for all distribution archives at once.
+
+        Unlike :func:`get_many()` and :func:`put_many()` this method has no
+        sequential default implementation because the only generic way to
+        check whether a distribution archive exists is to fetch it.
+        """
+        return None
+
+    def get_many(self, filenames):
+        """
+        Get multiple previously cached distribution archives from the cache.
+
+        :param filenames: A list of strings with the expected filenames of
+                          distribution archives.
+        :returns: A dictionary that maps the filenames of the distribution
+                  archives that were found to the absolute pathnames of local
+                  files (distribution archives that haven't been cached are
+                  omitted).
+
+        The default implementation calls :func:`get()` for each of the
+        distribution archives. This method is called by
+        :func:`CacheManager.prefetch()`: Backends that override this method
+        are asked for all of their distribution archives at once, other
+        backends are called concurrently for each distribution archive (see
+        :attr:`.Config.prefetch_threads`).
+        """
+        found = {}
+        for filename in filenames:
+            pathname = self.get(filename)
+            if pathname is not None:
+                found[filename] = pathname
+        return found
+
     def put(self, filename, handle):
         """
         Store a newly built distribution archive in the cache.
@@ -110,6 +266,26 @@ class AbstractCacheBackend(object):
         """
         raise NotImplementedError()
 
+    def put_many(self, archives):
+        """
+        Store multiple distribution archives in the cache.
+
+        :param archives: A list of tuples with two values each: The filename
+                         of a distribution archive (a string) and a file-like
+                         object that provides access to the distribution
+                         archive.
+
+        The default implementation calls :func:`put()` for each of the
+        distribution archives. This method is called by
+        :func:`CacheManager.put_many()`, e.g. to promote prefetched
+        distribution archives (see :func:`CacheManager.promote_many()`) and
+        to mirror source archives (see :mod:`pip_accel.mirror`). Backends that
+        can store multiple distribution archives in a single round trip can
+        override this method.
+        """
+        for filename, handle in archives:
+            self.put(filename, handle)
+
     def __repr__(self):
         """Generate a textual representation of the cache backend."""
         return self.__class__.__name__
@@ -128,8 +304,9 @@ class CacheManager(object):
     """
     Interface to treat multiple cache backends as a single one.
 
-    The cache manager automatically disables cache backends that raise
-    exceptions on ``get()`` and ``put()`` operations.
+    The cache manager automatically disables cache backends that require
+    configuration and temporarily skips cache backends that raise exceptions
+    on ``get()`` and ``put()`` operations (see :func:`call_backend()`).
     """
 
     def __init__(self, config):
@@ -145,6 +322,11 @@ class CacheManager(object):
                        object).
         """
         self.config = config
+        self.lock = threading.Lock()
+        self.circuit_breakers = {}
+        self.metrics = CacheMetrics()
+        self.prefetched = {}
+        self.negative_cache = NegativeCache(config)
         for entry_point in get_entry_map('pip-accel', 'pip_accel.cache_backends').values():
             logger.debug("Importing cache backend: %s", entry_point.module_name)
             __import__(entry_point.module_name)
@@ -152,60 +334,801 @@ class CacheManager(object):
         # priority so that e.g. the local file system is checked before S3).
         self.backends = sorted((b(self.config) for b in registered_backends if b != AbstractCacheBackend),
                                key=lambda b: b.PRIORITY)
+        # Once enough statistics are available the remote backends are
+        # ordered by their measured performance on this host (local backends
+        # are always consulted first).
+        self.statistics = BackendStatistics(self.config)
+        if self.config.adaptive_backend_order:
+            self.backends = self.statistics.order(self.backends)
         logger.debug("Initialized %s: %s",
                      pluralize(len(self.backends), "cache backend"),
                      concatenate(map(repr, self.backends)))
+        self.uploads = UploadQueue(self.config, self.metrics)
+        if self.config.background_uploads:
+            self.uploads.resume([b for b in self.backends if b.REMOTE and b.WRITABLE])
 
-    def get(self, requirement):
+    def get(self, requirement, extension='tar.gz'):
         """
         Get a distribution archive from any of the available caches.
 
         :param requirement: A :class:`.Requirement` object.
+        :param extension: The filename extension of the distribution archive
+                          (a string, defaults to ``tar.gz``).
         :returns: The absolute pathname of a local file or :data:`None` when the
                   distribution archive is missing from all available caches.
         """
-        filename = self.generate_filename(requirement)
+        return self.get_file(self.generate_filename(requirement, extension))
+
+    def get_file(self, filename):
+        """
+        Get a file from any of the available caches.
+
+        :param filename: The filename of the file in the cache (a string).
+        :returns: The absolute pathname of a local file or :data:`None` when the
+                  file is missing from all available caches.
+        """
+        pathname = self.prefetched.get(filename)
+        if pathname and os.path.isfile(pathname):
+            return pathname
+        deadline = self.get_retry_deadline()
+        misses = set()
         for backend in list(self.backends):
-            try:
-                pathname = backend.get(filename)
-                if pathname is not None:
-                    return pathname
-            except CacheBackendDisabledError as e:
-                logger.debug("Disabling %s because it requires configuration: %s", backend, e)
-                self.backends.remove(backend)
-            except Exception as e:
-                logger.exception("Disabling %s because it failed: %s", backend, e)
-                self.backends.remove(backend)
+            if self.negative_cache.contains(backend, filename):
+                self.metrics.record(backend, 'get', 'skip')
+                misses.add(backend)
+                continue
+            timer = Timer()
+            success, pathname = self.call_backend(backend, 'get', lambda: backend.get(filename), deadline)
+            if pathname is not None:
+                self.metrics.record(backend, 'get', 'hit', timer.elapsed_time, os.path.getsize(pathname))
+                self.promote(filename, pathname, backend, misses)
+                return pathname
+            elif success:
+                self.metrics.record(backend, 'get', 'miss', timer.elapsed_time)
+                self.negative_cache.add(backend, filename)
+                misses.add(backend)
+
+    def get_stream(self, requirement, extension='tar.gz'):
+        """
+        Get a readable stream for a distribution archive from any of the available caches.
+
+        :param requirement: A :class:`.Requirement` object.
+        :param extension: The filename extension of the distribution archive
+                          (a string, defaults to ``tar.gz``).
+        :returns: A readable file-like object or :data:`None` when the
+                  distribution archive is missing from all available caches.
+        """
+        return self.get_file_stream(self.generate_filename(requirement, extension))
 
-    def put(self, requirement, handle):
+    def get_file_stream(self, filename):
+        """
+        Get a readable stream for a file from any of the available caches.
+
+        :param filename: The filename of the file in the cache (a string).
+        :returns: A readable file-like object or :data:`None` when the file is
+                  missing from all available caches.
+
+        Refer to :func:`AbstractCacheBackend.get_stream()` for details.
+        Distribution archives streamed from remote cache backends are promoted
+        to faster cache backends (see :func:`promote_stream()`).
+        """
+        pathname = self.prefetched.get(filename)
+        if pathname and os.path.isfile(pathname):
+            return open(pathname, 'rb')
+        deadline = self.get_retry_deadline()
+        misses = set()
+        for backend in list(self.backends):
+            if self.negative_cache.contains(backend, filename):
+                self.metrics.record(backend, 'get', 'skip')
+                misses.add(backend)
+                continue
+            timer = Timer()
+            success, stream = self.call_backend(backend, 'get', lambda: backend.get_stream(filename), deadline)
+            if stream is not None:
+                self.metrics.record(backend, 'get', 'hit', timer.elapsed_time)
+                if backend.REMOTE:
+                    self.promote_stream(filename, stream, backend, misses)
+                return stream
+            elif success:
+                self.metrics.record(backend, 'get', 'miss', timer.elapsed_time)
+                self.negative_cache.add(backend, filename)
+                misses.add(backend)
+
+    def put(self, requirement, handle, extension='tar.gz'):
         """
         Store a distribution archive in all of the available caches.
 
         :param requirement: A :class:`.Requirement` object.
         :param handle: A file-like object that provides access to the
                        distribution archive.
+        :param extension: The filename extension of the distribution archive
+                          (a string, defaults to ``tar.gz``).
         """
-        filename = self.generate_filename(requirement)
-        for backend in list(self.backends):
-            handle.seek(0)
+        self.put_file(self.generate_filename(requirement, extension), handle)
+
+    def put_file(self, filename, handle, backends=None, promotion=False):
+        """
+        Store a file in all of the available caches.
+
+        :param filename: The filename of the file in the cache (a string).
+        :param handle: A file-like object that provides access to the file.
+        :param backends: The cache backends to store the file in (a list of
+                         :class:`AbstractCacheBackend` objects, defaults to
+                         all available cache backends).
+        :param promotion: :data:`True` when the file is stored by
+                          :func:`promote()`, in which case the outcome is
+                          also recorded as a ``promote`` operation in
+                          :attr:`metrics` (defaults to :data:`False`).
+
+        Refer to :func:`put_many()` for details.
+        """
+        self.put_many([(filename, handle)], backends, promotion)
+
+    def put_many(self, archives, backends=None, promotion=False):
+        """
+        Store multiple files in all of the available caches.
+
+        :param archives: A list of tuples with two values each: The filename
+                         of a file in the cache (a string) and a file-like
+                         object that provides access to the file.
+        :param backends: Refer to :func:`put_file()`.
+        :param promotion: Refer to :func:`put_file()`.
+
+        Each cache backend is asked to store all of the files at once (see
+        :func:`AbstractCacheBackend.put_many()`). When
+        :attr:`.Config.background_uploads` is enabled the files are queued for
+        uploading to remote cache backends instead of waiting for the uploads
+        to finish (see :mod:`pip_accel.uploads`).
+        """
+        sizes = []
+        for filename, handle in archives:
+            handle.seek(0, os.SEEK_END)
+            sizes.append(handle.tell())
+        for backend in list(self.backends if backends is None else backends):
+            for filename, handle in archives:
+                self.negative_cache.discard(backend, filename)
+            if backend.REMOTE and self.config.background_uploads:
+                # Read only backends would never consume the spooled files.
+                if backend.WRITABLE:
+                    for filename, handle in archives:
+                        handle.seek(0)
+                        self.uploads.submit(backend, filename, handle, promotion)
+                continue
+            timer = Timer()
+
+            def store_files():
+                for filename, handle in archives:
+                    handle.seek(0)
+                backend.put_many(archives)
+
+            success, result = self.call_backend(backend, 'put', store_files)
+            duration = timer.elapsed_time / len(archives)
+            for size in sizes:
+                if success:
+                    self.metrics.record(backend, 'put', 'ok', duration, size)
+                if promotion:
+                    self.metrics.record(backend, 'promote', 'ok' if success else 'error')
+
+    def promote(self, filename, pathname, source, misses=()):
+        """
+        Copy a distribution archive to faster cache backends (read-through).
+
+        :param filename: The filename of the distribution archive in the
+                         cache (a string).
+        :param pathname: The pathname of the local copy of the distribution
+                         archive (a string).
+        :param source: The cache backend where the distribution archive was
+                       found (an :class:`AbstractCacheBackend` object).
+        :param misses: The cache backends whose ``get()`` operations confirmed
+                       that they don't contain the distribution archive (an
+                       iterable of :class:`AbstractCacheBackend` objects).
+
+        Refer to :func:`promote_many()` for details.
+        """
+        self.promote_many({filename: pathname}, source, misses)
+
+    def promote_many(self, archives, source, misses=()):
+        """
+        Copy distribution archives to faster cache backends (read-through).
+
+        :param archives: A dictionary that maps the filenames of distribution
+                         archives in the cache to the pathnames of their local
+                         copies (strings).
+        :param source: The cache backend where the distribution archives were
+                       found (an :class:`AbstractCacheBackend` object).
+        :param misses: Refer to :func:`promote()`.
+
+        The distribution archives are stored in the writable cache backends
+        that are consulted before `source` (see
+        :attr:`AbstractCacheBackend.WRITABLE`) and don't contain them yet, so
+        that the next lookup is served by the fastest tier. Each of these
+        backends is checked for all of the distribution archives at once (see
+        :func:`AbstractCacheBackend.exists_many()`) and the missing archives
+        are stored in a single call (see :func:`put_many()`). Backends that
+        don't implement bulk lookups are only promoted to when they're in
+        `misses` (otherwise every hit would store the distribution archives
+        again). Uploads to remote cache backends happen in the background
+        when :attr:`.Config.background_uploads` is enabled. The outcome of
+        each promotion is recorded in :attr:`metrics` once it's known.
+        Promotion can be disabled using :attr:`.Config.cache_promotion`.
+        """
+        if not (archives and self.config.cache_promotion and source in self.backends):
+            return
+        filenames = sorted(archives)
+        for backend in self.backends[:self.backends.index(source)]:
+            if not backend.WRITABLE:
+                continue
+            # Skip archives that the backend already has, e.g. because the
+            # source backend downloaded them into the local cache.
+            success, existing = self.call_backend(backend, 'lookup', lambda: backend.exists_many(filenames))
+            if not success:
+                continue
+            if existing is not None:
+                targets = [fn for fn in filenames if fn not in existing]
+            else:
+                targets = filenames if backend in misses else []
+            if targets:
+                logger.info("Promoting %s from %s to %s ..", concatenate(targets), source, backend)
+                handles = []
+                try:
+                    for filename in targets:
+                        handles.append((filename, open(archives[filename], 'rb')))
+                    self.put_many(handles, [backend], promotion=True)
+                finally:
+                    for filename, handle in handles:
+                        handle.close()
+
+    def promote_stream(self, filename, stream, source, misses=()):
+        """
+        Copy a distribution archive streamed from a cache backend to faster cache backends.
+
+        :param filename: The filename of the distribution archive in the
+                         cache (a string).
+        :param stream: The file-like object returned by
+                       :func:`AbstractCacheBackend.get_stream()`.
+        :param source: The cache backend where the distribution archive was
+                       found (an :class:`AbstractCacheBackend` object).
+        :param misses: Refer to :func:`promote()`.
+
+        Streams that copy the distribution archive to a local file (see
+        :class:`~pip_accel.utils.TeeReader`) are promoted once they have been
+        read completely and temporary downloads (see
+        :func:`AbstractCacheBackend.get_download_pathname()`) are removed once
+        they have been promoted. Streams of local files are promoted
+        immediately.
+        """
+        if isinstance(stream, TeeReader):
+            def promote_download(pathname):
+                self.promote(filename, pathname, source, misses)
+                if is_temporary_download(pathname):
+                    os.unlink(pathname)
+            stream.callback = promote_download
+        elif os.path.isfile(getattr(stream, 'name', '')):
+            self.promote(filename, stream.name, source, misses)
+
+    def call_backend(self, backend, operation, function, deadline=None):
+        """
+        Call a method of a cache backend, handling failures.
+
+        :param backend: The cache backend (an :class:`AbstractCacheBackend`
+                        object).
+        :param operation: The name of the operation (a string, used for
+                          :attr:`metrics` and logging).
+        :param function: A callable (without arguments) that calls the method.
+        :param deadline: The time (a number, as returned by :func:`time.time()`)
+                         after which no more retries are attempted (optional,
+                         see :func:`get_retry_deadline()`).
+        :returns: A tuple with two values: :data:`True` when the call
+                  succeeded (:data:`False` otherwise) and the value returned
+                  by the call (:data:`None` when the call failed).
+
+        Backends that raise :exc:`.CacheBackendDisabledError` are disabled for
+        the rest of the process (they require configuration). Other failures
+        are considered transient: The call is retried (see
+        :attr:`.Config.cache_retries` and :attr:`.Config.cache_retry_budget`,
+        lookups that consult several cache backends share a single `deadline`)
+        and when all retries fail the :class:`CircuitBreaker` of the backend
+        opens, so the backend is skipped for a while instead of slowing down
+        every subsequent lookup.
+        """
+        breaker = self.get_circuit_breaker(backend)
+        if not breaker.allow():
+            return False, None
+        if deadline is None:
+            deadline = self.get_retry_deadline()
+        delay = RETRY_DELAY
+        attempt = 0
+        while True:
             try:
-                backend.put(filename, handle)
+                result = function()
             except CacheBackendDisabledError as e:
-                logger.debug("Disabling %s because it requires configuration: %s", backend, e)
-                self.backends.remove(backend)
+                self.disable_backend(backend, e)
+                return False, None
             except Exception as e:
-                logger.exception("Disabling %s because it failed: %s", backend, e)
+                attempt += 1
+                self.metrics.record(backend, operation, 'error')
+                if (attempt <= self.config.cache_retries and not breaker.probing and
+                        time.time() + delay <= deadline):
+                    logger.warning("%s %s operation failed, retrying in %s (%s) ..",
+                                   backend, operation, format_timespan(delay), e)
+                    time.sleep(delay)
+                    delay *= 2
+                    continue
+                duration = breaker.record_failure()
+                self.metrics.record(backend, 'circuit', 'open')
+                logger.exception("Skipping %s for %s because it failed: %s",
+                                 backend, format_timespan(duration), e)
+                return False, None
+            else:
+                breaker.record_success()
+                return True, result
+
+    def get_retry_deadline(self):
+        """
+        Get the deadline for retrying failed cache backend operations.
+
+        :returns: The current time plus :attr:`.Config.cache_retry_budget` (a
+                  number, refer to :func:`call_backend()`).
+        """
+        return time.time() + self.config.cache_retry_budget
+
+    def get_circuit_breaker(self, backend):
+        """
+        Get the circuit breaker of a cache backend.
+
+        :param backend: The cache backend (an :class:`AbstractCacheBackend`
+                        object).
+        :returns: A :class:`CircuitBreaker` object.
+        """
+        with self.lock:
+            if backend not in self.circuit_breakers:
+                self.circuit_breakers[backend] = CircuitBreaker(backend)
+            return self.circuit_breakers[backend]
+
+    def disable_backend(self, backend, exception):
+        """
+        Disable a cache backend that requires configuration.
+
+        :param backend: The cache backend (an :class:`AbstractCacheBackend`
+                        object).
+        :param exception: The :exc:`.CacheBackendDisabledError` raised by
+                          the backend.
+        """
+        with self.lock:
+            if backend in self.backends:
+                logger.debug("Disabling %s because it requires configuration: %s", backend, exception)
+                self.metrics.record(backend, 'disable', 'ok')
                 self.backends.remove(backend)
 
-    def generate_filename(self, requirement):
+    def save_state(self):
+        """Save the persistent state of the cache manager (the :class:`NegativeCache`)."""
+        self.negative_cache.save()
+
+    def report_metrics(self):
+        """
+        Report the metrics collected during this run (see :mod:`pip_accel.metrics`).
+
+        Logs a JSON summary of :attr:`metrics`, writes the metrics to
+        :attr:`.Config.prometheus_textfile` (when set) and updates the
+        persistent :class:`.BackendStatistics` (when
+        :attr:`.Config.adaptive_backend_order` is enabled).
+        """
+        if self.config.adaptive_backend_order:
+            try:
+                self.statistics.update(self.metrics)
+            except EnvironmentError as e:
+                logger.warning("Failed to save cache backend statistics: %s", e)
+        summary = self.metrics.summary()
+        if summary:
+            logger.info("Cache metrics: %s", json.dumps(summary, sort_keys=True))
+        if self.config.prometheus_textfile:
+            self.metrics.write_prometheus(self.config.prometheus_textfile)
+
+    def wait_for_uploads(self):
+        """
+        Wait for background uploads to finish.
+
+        :returns: :data:`True` when all background uploads finished,
+                  :data:`False` when :attr:`.Config.background_upload_timeout`
+                  expired.
+        """
+        return self.uploads.join(self.config.background_upload_timeout)
+
+    def plan(self, filenames):
+        """
+        Check which distribution archives are available in the cache backends.
+
+        :param filenames: A list of strings with the filenames of the
+                          distribution archives that are going to be needed.
+        :returns: A dictionary that maps the filenames of available
+                  distribution archives to the cache backend that has them
+                  (the backend with the highest priority).
+
+        This uses the bulk lookups implemented by the cache backends (see
+        :func:`AbstractCacheBackend.exists_many()`) to check the availability
+        of all distribution archives up front, so that e.g. the Amazon S3 cache
+        backend needs a few requests instead of one request per distribution
+        archive. Backends remember the results of bulk lookups, so subsequent
+        calls to :func:`get()` don't repeat the lookups. Known misses of remote
+        cache backends (see :class:`NegativeCache`) are not looked up again.
+
+        When :attr:`.Config.adaptive_backend_order` is enabled every remote
+        cache backend is asked about all of the distribution archives that are
+        missing from the local cache backends (not only about the misses of
+        the remote backends consulted before it), so that the availability of
+        distribution archives in each remote backend is measured independently
+        of the current order of the backends (see
+        :class:`.BackendStatistics`).
+        """
+        available = {}
+        remaining = list(filenames)
+        remote_lookups = None
+        deadline = self.get_retry_deadline()
+        for backend in list(self.backends):
+            lookups = remaining
+            if backend.REMOTE and self.config.adaptive_backend_order:
+                if remote_lookups is None:
+                    remote_lookups = list(remaining)
+                lookups = remote_lookups
+            if not lookups:
+                continue
+            candidates = [fn for fn in lookups if not self.negative_cache.contains(backend, fn)]
+            if not candidates:
+                continue
+            timer = Timer()
+            success, existing = self.call_backend(backend, 'lookup', lambda: backend.exists_many(candidates), deadline)
+            if existing is not None:
+                self.metrics.record(backend, 'lookup', 'ok', timer.elapsed_time)
+                if backend.REMOTE:
+                    # Known misses count as misses of the lookup.
+                    self.metrics.record_availability(backend, len(lookups),
+                                                     sum(1 for fn in candidates if fn in existing),
+                                                     timer.elapsed_time)
+                for filename in candidates:
+                    if filename in existing:
+                        available.setdefault(filename, backend)
+                    else:
+                        self.negative_cache.add(backend, filename)
+                remaining = [fn for fn in remaining if fn not in available]
+        logger.info("Found %i of %s in cache backends.", len(available),
+                    pluralize(len(filenames), "distribution archive"))
+        return available
+
+    def prefetch(self, available):
+        """
+        Concurrently download distribution archives from remote cache backends.
+
+        :param available: The dictionary returned by :func:`plan()`.
+
+        Distribution archives that are available in a remote cache backend
+        (i.e. they don't exist in :attr:`.Config.binary_cache` yet) are fetched
+        using :attr:`.Config.prefetch_threads` threads, so that the installation
+        can proceed from the local file system instead of interleaving
+        downloads with the installation of distribution archives. Backends
+        that implement batch downloads (see
+        :func:`AbstractCacheBackend.get_many()`) are asked for all of their
+        distribution archives at once. Failures are handled in the same way as
+        by :func:`get_file()`.
+        """
+        pending = sorted(fn for fn, backend in available.items()
+                         if not os.path.isfile(os.path.join(self.config.binary_cache, fn)))
+        # Each task is a backend with the list of distribution archives to
+        # fetch from it in a single call to get_many().
+        tasks = []
+        batches = {}
+        for filename in pending:
+            backend = available[filename]
+            if overrides(backend, 'get_many'):
+                if backend not in batches:
+                    batches[backend] = []
+                    tasks.append((backend, batches[backend]))
+                batches[backend].append(filename)
+            else:
+                tasks.append((backend, [filename]))
+        num_threads = min(self.config.prefetch_threads, len(tasks))
+        if num_threads == 0:
+            return
+        timer = Timer()
+        logger.info("Prefetching %s from cache backends using %s ..",
+                    pluralize(len(pending), "distribution archive"),
+                    pluralize(num_threads, "thread"))
+
+        def fetch_archives(task):
+            backend, filenames = task
+            timer = Timer()
+            success, found = self.call_backend(backend, 'get', lambda: backend.get_many(filenames))
+            if success:
+                duration = timer.elapsed_time / len(filenames)
+                for filename in filenames:
+                    if filename in found:
+                        self.metrics.record(backend, 'get', 'hit', duration, os.path.getsize(found[filename]))
+                    else:
+                        self.metrics.record(backend, 'get', 'miss', duration)
+            return found or {}
+
+        num_prefetched = 0
+        for (backend, filenames), found, exception in run_concurrently(fetch_archives, tasks, num_threads):
+            if found:
+                self.prefetched.update(found)
+                self.promote_many(found, backend)
+                num_prefetched += len(found)
+        logger.info("Prefetched %i of %s in %s.", num_prefetched,
+                    pluralize(len(pending), "distribution archive"), timer)
+
+    def generate_filename(self, requirement, extension='tar.gz'):
         """
         Generate a distribution archive filename for a package.
 
         :param requirement: A :class:`.Requirement` object.
+        :param extension: The filename extension of the distribution archive
+                          (a string, defaults to ``tar.gz``).
         :returns: The filename of the distribution archive (a string)
                   including a single leading directory component to indicate
                   the cache format revision.
+
+        Wheel distribution archives downloaded by pip are stored in a separate
+        directory under their original filename (in this case `extension` is
+        ignored), because the filename of a wheel distribution archive already
+        encodes its compatibility tags.
         """
+        if requirement.wheel_archive:
+            return WHEEL_FILENAME_PATTERN % (self.config.cache_format_revision,
+                                             os.path.basename(requirement.wheel_archive))
         return FILENAME_PATTERN % (self.config.cache_format_revision,
                                    requirement.name, requirement.version,
-                                   get_python_version())
+                                   get_python_version(), extension)
+
+
+def get_download_directory():
+    """
+    Get the temporary directory where remote cache backends download files.
+
+    :returns: The pathname of a directory that is removed when the process
+              exits (a string).
+
+    Refer to :func:`AbstractCacheBackend.get_download_pathname()` for details.
+    """
+    global download_directory
+    with download_directory_lock:
+        if download_directory is None:
+            download_directory = tempfile.mkdtemp(prefix='pip-accel-download-')
+            atexit.register(shutil.rmtree, download_directory, True)
+        return download_directory
+
+
+def is_temporary_download(pathname):
+    """
+    Check whether a file was downloaded to the temporary download directory.
+
+    :param pathname: The pathname of a file (a string).
+    :returns: :data:`True` if the file is located in the directory returned
+              by :func:`get_download_directory()`, :data:`False` otherwise.
+    """
+    return (download_directory is not None and
+            os.path.abspath(pathname).startswith(os.path.join(download_directory, '')))
+
+
+def is_source_manifest(filename):
+    """
+    Check whether a file in the cache is the manifest of mirrored source archives.
+
+    :param filename: The filename of the file in the cache (a string).
+    :returns: :data:`True` if the file is a manifest (see
+              :data:`SOURCE_MANIFEST_PATTERN`), :data:`False` otherwise.
+    """
+    return filename.startswith(SOURCE_MANIFEST_DIRECTORY + os.sep)
+
+
+def overrides(backend, name):
+    """
+    Check whether a cache backend overrides a method of :class:`AbstractCacheBackend`.
+
+    :param backend: The cache backend (an :class:`AbstractCacheBackend`
+                    object).
+    :param name: The name of the method (a string).
+    :returns: :data:`True` if the backend implements the method itself,
+              :data:`False` if it uses the default implementation.
+    """
+    return getattr(type(backend), name) != getattr(AbstractCacheBackend, name)
+
+
+class CircuitBreaker(object):
+
+    """
+    Circuit breaker that temporarily skips a failing cache backend.
+
+    The circuit breaker of a cache backend starts out closed (the backend is
+    used). When an operation fails (after retrying) the circuit breaker opens
+    and the backend is skipped for :data:`CIRCUIT_BREAKER_DURATION` seconds.
+    Afterwards the circuit breaker is half open: A single operation is allowed
+    to probe the backend. If the probe succeeds the circuit breaker closes,
+    otherwise it opens again for twice as long (up to
+    :data:`CIRCUIT_BREAKER_MAX_DURATION` seconds).
+    """
+
+    def __init__(self, backend):
+        """
+        Initialize a :class:`CircuitBreaker` object.
+
+        :param backend: The cache backend (an :class:`AbstractCacheBackend`
+                        object).
+        """
+        self.backend = backend
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.open_until = 0
+        self.probing = False
+
+    def allow(self):
+        """
+        Check whether the backend may be used.
+
+        :returns: :data:`True` when the circuit breaker is closed or when the
+                  caller gets to probe the backend, :data:`False` otherwise.
+        """
+        with self.lock:
+            if self.failures == 0:
+                return True
+            if self.probing or time.time() < self.open_until:
+                return False
+            logger.info("Probing %s after earlier failures ..", self.backend)
+            self.probing = True
+            return True
+
+    def record_success(self):
+        """Close the circuit breaker after a successful operation."""
+        with self.lock:
+            if self.failures > 0:
+                logger.info("%s is working again.", self.backend)
+            self.failures = 0
+            self.probing = False
+
+    def record_failure(self):
+        """
+        Open the circuit breaker after a failed operation.
+
+        :returns: The number of seconds that the circuit breaker stays open
+                  (an integer).
+        """
+        with self.lock:
+            self.failures += 1
+            self.probing = False
+            duration = min(CIRCUIT_BREAKER_DURATION * 2 ** (self.failures - 1), CIRCUIT_BREAKER_MAX_DURATION)
+            self.open_until = time.time() + duration
+            return duration
+
+
+class NegativeCache(object):
+
+    """
+    Persistent record of distribution archives missing from remote cache backends.
+
+    For each remote cache backend (identified by its name and location, see
+    :attr:`AbstractCacheBackend.location`) the filenames of distribution
+    archives that the backend didn't contain are stored together with the time
+    of the lookup in the JSON file :attr:`.Config.negative_cache`. Until
+    :attr:`.Config.negative_cache_ttl` seconds have passed these distribution
+    archives aren't looked up in the backend again, which avoids a round trip
+    per run for distribution archives that are never uploaded. Storing a
+    distribution archive in a backend removes it from the negative cache.
+    Local cache backends are never recorded (lookups are cheap).
+    """
+
+    def __init__(self, config):
+        """
+        Initialize a :class:`NegativeCache` object.
+
+        :param config: The pip-accel configuration (a :class:`.Config`
+                       object).
+        """
+        self.config = config
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.discarded = {}
+        self.modified = False
+        if config.negative_cache_ttl > 0:
+            self.entries = self.load()
+
+    def load(self):
+        """
+        Load the negative cache from :attr:`.Config.negative_cache`.
+
+        :returns: A dictionary with the entries in the file (an empty
+                  dictionary when the file doesn't exist or is invalid).
+        """
+        try:
+            with open(self.config.negative_cache) as handle:
+                entries = json.load(handle)
+            if isinstance(entries, dict):
+                return entries
+        except (EnvironmentError, ValueError):
+            pass
+        return {}
+
+    def get_key(self, backend):
+        """
+        Get the key under which the misses of a cache backend are recorded.
+
+        :param backend: The cache backend (an :class:`AbstractCacheBackend`
+                        object).
+        :returns: The name of the backend followed by its location (a string).
+        """
+        location = backend.location
+        return '%r (%s)' % (backend, location) if location else repr(backend)
+
+    def contains(self, backend, filename):
+        """
+        Check whether a distribution archive is a known miss of a cache backend.
+
+        :param backend: The cache backend (an :class:`AbstractCacheBackend`
+                        object).
+        :param filename: The filename of the distribution archive (a string).
+        :returns: :data:`True` if the backend didn't contain the distribution
+                  archive less than :attr:`.Config.negative_cache_ttl`
+                  seconds ago, :data:`False` otherwise.
+        """
+        with self.lock:
+            timestamp = self.entries.get(self.get_key(backend), {}).get(filename)
+        return timestamp is not None and time.time() - timestamp < self.config.negative_cache_ttl
+
+    def add(self, backend, filename):
+        """
+        Record that a remote cache backend doesn't contain a distribution archive.
+
+        :param backend: The cache backend (an :class:`AbstractCacheBackend`
+                        object).
+        :param filename: The filename of the distribution archive (a string).
+        """
+        if backend.REMOTE and self.config.negative_cache_ttl > 0:
+            with self.lock:
+                self.entries.setdefault(self.get_key(backend), {})[filename] = time.time()
+                self.modified = True
+
+    def discard(self, backend, filename):
+        """
+        Forget that a cache backend didn't contain a distribution archive.
+
+        :param backend: The cache backend (an :class:`AbstractCacheBackend`
+                        object).
+        :param filename: The filename of the distribution archive (a string).
+        """
+        key = self.get_key(backend)
+        with self.lock:
+            if self.entries.get(key, {}).pop(filename, None) is not None:
+                self.discarded.setdefault(key, {})[filename] = time.time()
+                self.modified = True
+
+    def save(self):
+        """
+        Save the negative cache to :attr:`.Config.negative_cache` (expired entries are removed).
+
+        Concurrent pip-accel processes share the file, so it's merged with the
+        entries recorded by this process while holding a lock: The most
+        recent lookup of each distribution archive wins and distribution
+        archives that this process stored (see :func:`discard()`) are removed
+        unless another process recorded a miss after that.
+        """
+        with self.lock:
+            if not self.modified:
+                return
+            logger.debug("Saving negative cache to %s ..", self.config.negative_cache)
+            with FileLock(self.config.negative_cache + '.lock'):
+                now = time.time()
+                entries = {}
+                for source in (self.load(), self.entries):
+                    for name, misses in source.items():
+                        discarded = self.discarded.get(name, {})
+                        merged = entries.setdefault(name, {})
+                        for filename, timestamp in misses.items():
+                            if (now - timestamp < self.config.negative_cache_ttl and
+                                    timestamp > discarded.get(filename, 0) and
+                                    timestamp > merged.get(filename, 0)):
+                                merged[filename] = timestamp
+                entries = dict((name, misses) for name, misses in entries.items() if misses)
+                makedirs(os.path.dirname(self.config.negative_cache))
+                with AtomicReplace(self.config.negative_cache) as temporary_file:
+                    with open(temporary_file, 'w') as handle:
+                        json.dump(entries, handle, indent=2, sort_keys=True)
+            self.entries = entries
+            self.discarded = {}
+            self.modified = False
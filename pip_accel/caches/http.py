@@ -0,0 +1,332 @@
+# Accelerator for pip, the Python package manager.
+#
+# Author: Peter Odding <peter.odding@paylogic.com>
+# Last Change: October 31, 2015
+# URL: https://github.com/paylogic/pip-accel
+#
+# A word of warning: Do *not* use the cached_property decorator here, because
+# it interacts badly with the metaclass magic performed by the base class (see
+# the comment at the top of pip_accel.caches.s3).
+
+"""
+HTTP(S) cache backend.
+
+This module implements a read only cache backend that downloads distribution
+archives from a web server. To enable this backend you need to define the
+configuration option :attr:`~.Config.http_cache_url`. The web server is
+expected to serve the same directory layout as the local binary cache (see
+:attr:`~.Config.binary_cache`), so for example a distribution archive with the
+filename ``v7/example:1.0:py2.7.tar.gz`` is downloaded from the URL
+``$PIP_ACCEL_HTTP_URL/v7/example%3A1.0%3Apy2.7.tar.gz``. Any web server that
+can serve static files (like nginx) will do.
+
+Because the backend is read only, distribution archives are never uploaded to
+the web server. Populating the directory served by the web server is up to
+you, for example by synchronizing the binary cache of a build server.
+
+Connection pooling
+------------------
+
+The backend uses the copy of Requests_ that is bundled with pip, so HTTP
+keep-alive connections are reused between requests. The connection pool is
+sized to :attr:`~.Config.prefetch_threads` so that the distribution archives
+prefetched by :func:`~pip_accel.caches.CacheManager.prefetch()` are downloaded
+concurrently without opening a new connection for every download. The
+existence checks performed by :func:`~HTTPCacheBackend.exists_many()` (using
+``HEAD`` requests) are concurrent as well.
+
+Conditional requests
+--------------------
+
+The ``ETag`` and ``Last-Modified`` headers of downloaded distribution archives
+are recorded in :attr:`~.Config.http_cache_metadata`. When the backend is asked
+for a distribution archive that already exists in the local binary cache it
+sends a conditional request and the web server can respond with ``304 Not
+Modified`` instead of sending the distribution archive again. When the local
+binary cache is stored in SQLite (see :attr:`~.Config.local_cache_backend`)
+distribution archives are downloaded to temporary files instead, which
+:class:`~pip_accel.caches.CacheManager` stores in SQLite.
+
+.. _Requests: http://python-requests.org/
+"""
+
+# Standard library modules.
+import json
+import logging
+import os
+import threading
+
+# External dependencies.
+from humanfriendly import Timer, pluralize
+
+# Modules included in our package.
+from pip_accel.caches import AbstractCacheBackend
+from pip_accel.compat import quote
+from pip_accel.exceptions import CacheBackendDisabledError
+from pip_accel.utils import AtomicReplace, TeeReader, makedirs, run_concurrently
+
+# Initialize a logger for this module.
+logger = logging.getLogger(__name__)
+
+# The number of bytes read from the web server at a time.
+CHUNK_SIZE = 1024 * 64
+
+# HTTP status codes that indicate a distribution archive is not available.
+MISSING_STATUS_CODES = (403, 404, 410)
+
+
+class HTTPCacheBackend(AbstractCacheBackend):
+
+    """The HTTP cache backend downloads distribution archives from a web server."""
+
+    PRIORITY = 30
+
+    REMOTE = True
+
+    WRITABLE = False
+
+    def __init__(self, config):
+        """
+        Initialize the HTTP cache backend.
+
+        :param config: The pip-accel configuration (a :class:`.Config`
+                       object).
+        """
+        super(HTTPCacheBackend, self).__init__(config)
+        self.known_urls = {}
+        self.lock = threading.Lock()
+        self.metadata = None
+        self.session_object = None
+
+    @property
+    def location(self):
+        """The URL of the web server (:attr:`.Config.http_cache_url`)."""
+        return self.config.http_cache_url
+
+    @property
+    def session(self):
+        """
+        A :class:`requests.Session` object with a pool of keep-alive connections.
+
+        The session is shared between threads (the connection pool of
+        Requests is thread safe).
+        """
+        with self.lock:
+            if self.session_object is None:
+                from pip._vendor import requests
+                from pip._vendor.requests.adapters import HTTPAdapter
+                session = requests.Session()
+                pool_size = max(1, self.config.prefetch_threads)
+                for prefix in ('http://', 'https://'):
+                    session.mount(prefix, HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+                self.session_object = session
+            return self.session_object
+
+    def exists_many(self, filenames):
+        """
+        Check which of the given distribution archives exist on the web server.
+
+        :param filenames: A list of strings with the filenames of distribution
+                          archives.
+        :returns: A set of strings with the filenames of the distribution
+                  archives that exist on the web server.
+        :raises: Any exceptions raised by Requests.
+
+        The ``HEAD`` requests are performed concurrently (using
+        :attr:`.Config.prefetch_threads` threads). The results are remembered
+        so that :func:`get()` doesn't download missing distribution archives.
+        """
+        timer = Timer()
+        self.check_prerequisites()
+        logger.info("Checking if %s are available on web server ..",
+                    pluralize(len(filenames), "distribution archive"))
+        existing = set()
+        results = run_concurrently(self.check_exists, filenames, max(1, self.config.prefetch_threads))
+        for filename, exists, exception in results:
+            if exception is not None:
+                raise exception
+            self.known_urls[filename] = exists
+            if exists:
+                existing.add(filename)
+        logger.debug("Found %i of %s on web server in %s.", len(existing),
+                     pluralize(len(filenames), "distribution archive"), timer)
+        return existing
+
+    def check_exists(self, filename):
+        """
+        Check whether a distribution archive exists on the web server.
+
+        :param filename: The filename of the distribution archive (a string).
+        :returns: :data:`True` if the distribution archive exists,
+                  :data:`False` otherwise.
+        :raises: Any exceptions raised by Requests.
+        """
+        response = self.session.head(self.get_url(filename), timeout=self.config.http_cache_timeout)
+        if response.status_code in MISSING_STATUS_CODES:
+            return False
+        response.raise_for_status()
+        return True
+
+    def get(self, filename):
+        """
+        Download a distribution archive from the web server.
+
+        :param filename: The filename of the distribution archive (a string).
+        :returns: The pathname of a distribution archive on the local file
+                  system or :data:`None`.
+        :raises: Any exceptions raised by Requests.
+        """
+        timer = Timer()
+        response = self.request(filename)
+        if response is None:
+            return None
+        file_in_cache = self.get_download_pathname(filename)
+        if response.status_code == 304:
+            logger.debug("Distribution archive in local cache is up to date.")
+            response.close()
+            return file_in_cache
+        logger.info("Downloading distribution archive from web server ..")
+        makedirs(os.path.dirname(file_in_cache))
+        try:
+            with AtomicReplace(file_in_cache) as temporary_file:
+                with open(temporary_file, 'wb') as handle:
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        handle.write(chunk)
+        finally:
+            response.close()
+        self.save_validators(filename, response)
+        logger.debug("Finished downloading distribution archive from web server in %s.", timer)
+        return file_in_cache
+
+    def get_stream(self, filename):
+        """
+        Stream a distribution archive from the web server.
+
+        :param filename: The filename of the distribution archive (a string).
+        :returns: A :class:`~pip_accel.utils.TeeReader` object that reads
+                  from the HTTP response and copies the distribution archive
+                  into the local cache, or :data:`None` when the distribution
+                  archive is not available.
+        :raises: Any exceptions raised by Requests.
+        """
+        response = self.request(filename)
+        if response is None:
+            return None
+        file_in_cache = self.get_download_pathname(filename)
+        if response.status_code == 304:
+            logger.debug("Distribution archive in local cache is up to date.")
+            response.close()
+            return open(file_in_cache, 'rb')
+        logger.info("Streaming distribution archive from web server ..")
+        self.save_validators(filename, response)
+        return TeeReader(response.raw, file_in_cache)
+
+    def request(self, filename):
+        """
+        Request a distribution archive from the web server.
+
+        :param filename: The filename of the distribution archive (a string).
+        :returns: A :class:`requests.Response` object (whose body hasn't been
+                  read yet) or :data:`None` when the distribution archive is
+                  not available.
+        :raises: Any exceptions raised by Requests.
+
+        When the distribution archive has already been downloaded (see
+        :func:`~pip_accel.caches.AbstractCacheBackend.get_download_pathname()`)
+        the request is made conditional using the validators recorded by
+        :func:`save_validators()`. The request asks the web server not to
+        compress the response, because :func:`get_stream()` reads the raw
+        response body (which wouldn't be decoded).
+        """
+        self.check_prerequisites()
+        if self.known_urls.get(filename) is False:
+            logger.debug("Distribution archive is not available on web server.")
+            return None
+        url = self.get_url(filename)
+        headers = {'Accept-Encoding': 'identity'}
+        if os.path.isfile(self.get_download_pathname(filename)):
+            validators = self.load_validators().get(filename, {})
+            if validators.get('etag'):
+                headers['If-None-Match'] = validators['etag']
+            if validators.get('last_modified'):
+                headers['If-Modified-Since'] = validators['last_modified']
+        logger.debug("Requesting distribution archive from web server: %s", url)
+        response = self.session.get(url, headers=headers, stream=True, timeout=self.config.http_cache_timeout)
+        if response.status_code in MISSING_STATUS_CODES:
+            logger.debug("Distribution archive is not available on web server.")
+            self.known_urls[filename] = False
+            response.close()
+            return None
+        if response.status_code != 304:
+            response.raise_for_status()
+        return response
+
+    def load_validators(self):
+        """
+        Load the validators of previously downloaded distribution archives.
+
+        :returns: A dictionary with filenames as keys and dictionaries with
+                  the keys ``etag`` and ``last_modified`` as values.
+        """
+        with self.lock:
+            if self.metadata is None:
+                try:
+                    with open(self.config.http_cache_metadata) as handle:
+                        self.metadata = json.load(handle)
+                except (EnvironmentError, ValueError):
+                    self.metadata = {}
+            return self.metadata
+
+    def save_validators(self, filename, response):
+        """
+        Record the validators of a downloaded distribution archive.
+
+        :param filename: The filename of the distribution archive (a string).
+        :param response: The :class:`requests.Response` object.
+        """
+        validators = dict(etag=response.headers.get('ETag'),
+                          last_modified=response.headers.get('Last-Modified'))
+        metadata = self.load_validators()
+        with self.lock:
+            if any(validators.values()):
+                metadata[filename] = validators
+            elif metadata.pop(filename, None) is None:
+                return
+            makedirs(os.path.dirname(self.config.http_cache_metadata))
+            with AtomicReplace(self.config.http_cache_metadata) as temporary_file:
+                with open(temporary_file, 'w') as handle:
+                    json.dump(metadata, handle, indent=2, sort_keys=True)
+
+    def put(self, filename, handle):
+        """
+        Ignore a newly built distribution archive (the web server is read only).
+
+        :param filename: The filename of the distribution archive (a string).
+        :param handle: A file-like object that provides access to the
+                       distribution archive.
+        """
+        self.check_prerequisites()
+        logger.debug("Not uploading distribution archive to web server (read only).")
+
+    def get_url(self, filename):
+        """
+        Get the URL of a distribution archive on the web server.
+
+        :param filename: The filename of the distribution archive (a string).
+        :returns: The URL of the distribution archive (a string).
+        """
+        return '%s/%s' % (self.config.http_cache_url.rstrip('/'), quote(filename.replace(os.sep, '/')))
+
+    def check_prerequisites(self):
+        """
+        Validate the prerequisites required to use the HTTP cache backend.
+
+        :raises: :exc:`.CacheBackendDisabledError` when
+                 :attr:`.Config.http_cache_url` isn't defined.
+        """
+        if not self.config.http_cache_url:
+            raise CacheBackendDisabledError("""
+                To use a web server as a cache you have to set the environment
+                variable $PIP_ACCEL_HTTP_URL (see the documentation for
+                details).
+            """)
@@ -13,23 +13,116 @@ does is create directories and write local files. The only trick here is that
 new binary distribution archives are written to temporary files which are
 then moved into place atomically using :func:`os.rename()` to avoid partial
 reads caused by running multiple invocations of pip-accel at the same time
-(which happened in `issue 25`_).
+(which happened in `issue 25`_). This cache backend is disabled when the
+configuration option :attr:`~.Config.local_cache_backend` selects the SQLite
+cache backend (see :mod:`pip_accel.caches.sqlite`).
+
+Shared read only caches
+-----------------------
+
+The configuration option :attr:`~.Config.shared_binary_caches` defines a list
+of read only directories with the same layout as the local cache that are
+consulted before the local cache (for example a warm cache shared by all users
+of a build host). Distribution archives found in a shared cache are used in
+place, newly built distribution archives are only stored in the (per user)
+local cache and shared caches are never modified (not even by eviction).
+
+Eviction of unused archives
+---------------------------
+
+By default the local cache grows without bounds. The configuration options
+:attr:`~.Config.binary_cache_max_size` and
+:attr:`~.Config.binary_cache_max_age` enable the eviction of the least
+recently used distribution archives:
+
+- The size and last access time of each distribution archive are recorded in
+  a small SQLite database in the local cache (see :class:`ArchiveIndex`), so
+  the distribution archives themselves are never modified (their last
+  modified time stays meaningful, e.g. for the ``ETag`` and ``Last-Modified``
+  headers sent by ``pip-accel serve-cache``). The index is created from the
+  contents of the local cache the first time it's needed.
+
+- Eviction is amortized: Nothing happens until the cache exceeds its budget
+  (which :func:`~LocalCacheBackend.put()` checks with a single query), then
+  the least recently used archives are removed until the cache is back under
+  :data:`EVICTION_LOW_WATERMARK` of the budget. Concurrent pip-accel
+  processes serialize eviction using a lock file.
+
+- Distribution archives that are in use by a running pip-accel process are
+  never evicted: :func:`~LocalCacheBackend.get()` records a lease on the
+  archive which is released when the process exits (leases of processes that
+  are no longer running are ignored).
+
+- The manifests of mirrored source archives (see :mod:`pip_accel.mirror`) are
+  never evicted (they're tiny and they describe the mirrored archives).
 
 .. _issue 25: https://github.com/paylogic/pip-accel/issues/25
 """
 
 # Standard library modules.
+import atexit
+import errno
 import logging
 import os
 import shutil
+import sqlite3
+import threading
+import time
 
 # Modules included in our package.
-from pip_accel.caches import AbstractCacheBackend
-from pip_accel.utils import AtomicReplace, makedirs
+from pip_accel.caches import AbstractCacheBackend, is_source_manifest
+from pip_accel.compat import WINDOWS
+from pip_accel.exceptions import CacheBackendDisabledError
+from pip_accel.utils import AtomicReplace, FileLock, makedirs
+
+# External dependencies.
+from humanfriendly import format_size, pluralize
 
 # Initialize a logger for this module.
 logger = logging.getLogger(__name__)
 
+EVICTION_INDEX_FILE = 'eviction.sqlite'
+"""The name of the SQLite database (in :attr:`.Config.binary_cache`) used by :class:`ArchiveIndex` (a string)."""
+
+EVICTION_LOCK_FILE = 'eviction.lock'
+"""The name of the lock file (in :attr:`.Config.binary_cache`) used to serialize eviction (a string)."""
+
+EVICTION_LOW_WATERMARK = 0.9
+"""The fraction of :attr:`.Config.binary_cache_max_size` that eviction reduces the local cache to (a float)."""
+
+MAX_LEASE_AGE = 60 * 60 * 24
+"""The number of seconds after which a lease is ignored even if its process seems to be running (an integer)."""
+
+BUSY_TIMEOUT = 60
+"""The number of seconds to wait for a concurrent writer to the index to finish (an integer)."""
+
+INDEX_SCHEMA = (
+    '''create table if not exists archives (
+           filename text primary key,
+           size integer not null,
+           last_used real not null
+       )''',
+    '''create index if not exists archives_by_last_used on archives (last_used)''',
+    '''create table if not exists totals (
+           id integer primary key check (id = 0),
+           size integer not null
+       )''',
+    '''insert or ignore into totals (id, size) values (0, 0)''',
+    '''create trigger if not exists archive_added after insert on archives
+       begin update totals set size = size + new.size; end''',
+    '''create trigger if not exists archive_removed after delete on archives
+       begin update totals set size = size - old.size; end''',
+    '''create trigger if not exists archive_resized after update of size on archives
+       begin update totals set size = size - old.size + new.size; end''',
+    '''create table if not exists leases (
+           filename text not null,
+           pid integer not null,
+           created real not null,
+           primary key (filename, pid)
+       )''',
+)
+"""The SQL statements that create the tables of the :class:`ArchiveIndex` (a tuple of strings)."""
+
 
 class LocalCacheBackend(AbstractCacheBackend):
 
@@ -37,6 +130,21 @@ class LocalCacheBackend(AbstractCacheBackend):
 
     PRIORITY = 10
 
+    def __init__(self, config):
+        """
+        Initialize the local cache backend.
+
+        :param config: The pip-accel configuration (a :class:`.Config`
+                       object).
+        """
+        super(LocalCacheBackend, self).__init__(config)
+        self.index = ArchiveIndex(config)
+
+    @property
+    def eviction_enabled(self):
+        """:data:`True` when :attr:`.Config.binary_cache_max_size` or :attr:`.Config.binary_cache_max_age` is set."""
+        return bool(self.config.binary_cache_max_size or self.config.binary_cache_max_age)
+
     def get(self, filename):
         """
         Check if a distribution archive exists in the local cache.
@@ -44,15 +152,56 @@ class LocalCacheBackend(AbstractCacheBackend):
         :param filename: The filename of the distribution archive (a string).
         :returns: The pathname of a distribution archive on the local file
                   system or :data:`None`.
+
+        The shared caches (see :attr:`.Config.shared_binary_caches`) are
+        checked before the local cache. When eviction is enabled the archive
+        is marked as recently used and in use by the current process (see
+        :func:`ArchiveIndex.use()`).
         """
+        self.check_prerequisites()
+        for directory in self.config.shared_binary_caches:
+            pathname = os.path.join(directory, filename)
+            if os.path.isfile(pathname):
+                logger.debug("Distribution archive exists in shared cache (%s).", pathname)
+                return pathname
         pathname = os.path.join(self.config.binary_cache, filename)
         if os.path.isfile(pathname):
             logger.debug("Distribution archive exists in local cache (%s).", pathname)
+            if self.eviction_enabled and is_evictable(filename):
+                self.index.use(filename, os.path.getsize(pathname))
             return pathname
         else:
             logger.debug("Distribution archive doesn't exist in local cache (%s).", pathname)
             return None
 
+    def exists_many(self, filenames):
+        """
+        Check which of the given distribution archives exist in the local cache.
+
+        :param filenames: A list of strings with the filenames of distribution
+                          archives.
+        :returns: A set of strings with the filenames of the distribution
+                  archives that exist in the local cache (or in one of the
+                  shared caches).
+
+        When eviction is enabled, distribution archives that were written to
+        the local cache by other cache backends (e.g. downloads from Amazon
+        S3) are added to the index.
+        """
+        self.check_prerequisites()
+        existing = set()
+        unindexed = []
+        for filename in filenames:
+            if any(os.path.isfile(os.path.join(d, filename)) for d in self.config.shared_binary_caches):
+                existing.add(filename)
+            elif os.path.isfile(os.path.join(self.config.binary_cache, filename)):
+                existing.add(filename)
+                if is_evictable(filename):
+                    unindexed.append(filename)
+        if unindexed and self.eviction_enabled:
+            self.index.register(unindexed)
+        return existing
+
     def put(self, filename, handle):
         """
         Store a distribution archive in the local cache.
@@ -61,6 +210,7 @@ class LocalCacheBackend(AbstractCacheBackend):
         :param handle: A file-like object that provides access to the
                        distribution archive.
         """
+        self.check_prerequisites()
         file_in_cache = os.path.join(self.config.binary_cache, filename)
         logger.debug("Storing distribution archive in local cache: %s", file_in_cache)
         makedirs(os.path.dirname(file_in_cache))
@@ -71,3 +221,293 @@ class LocalCacheBackend(AbstractCacheBackend):
             with open(temporary_file, 'wb') as temporary_file_handle:
                 shutil.copyfileobj(handle, temporary_file_handle)
         logger.debug("Finished caching distribution archive in local cache.")
+        if self.eviction_enabled and is_evictable(filename):
+            # The caller is about to use the distribution archive.
+            self.index.use(filename, os.path.getsize(file_in_cache))
+            self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used distribution archives from the local cache.
+
+        :returns: The number of distribution archives that were removed (an
+                  integer).
+
+        When the local cache is larger than :attr:`.Config.binary_cache_max_size`
+        archives are removed (least recently used first) until the local
+        cache is back under :data:`EVICTION_LOW_WATERMARK` of the budget.
+        Archives that haven't been used for :attr:`.Config.binary_cache_max_age`
+        days are removed as well. Archives that are in use by a running
+        pip-accel process are never removed.
+        """
+        max_size = self.config.binary_cache_max_size
+        max_age = self.config.binary_cache_max_age * 60 * 60 * 24
+        if not (max_size or max_age):
+            return 0
+        now = time.time()
+        cutoff = now - max_age if max_age else 0
+        # These checks are cheap (they don't depend on the number of cached
+        # archives) so that the common case of a cache that fits in its budget
+        # doesn't slow down every put().
+        if not ((max_size and self.index.get_total_size() > max_size) or
+                (max_age and self.index.get_oldest() < cutoff)):
+            return 0
+        with FileLock(os.path.join(self.config.binary_cache, EVICTION_LOCK_FILE)):
+            leased = self.index.get_leased()
+            total_size = self.index.get_total_size()
+            target_size = max_size * EVICTION_LOW_WATERMARK
+            victims = []
+            for filename, size, last_used in self.index.iterate():
+                if not ((max_size and total_size > target_size) or (max_age and last_used < cutoff)):
+                    break
+                if filename not in leased:
+                    victims.append((filename, size))
+                    total_size -= size
+            removed = []
+            freed_space = 0
+            for filename, size in victims:
+                pathname = os.path.join(self.config.binary_cache, filename)
+                logger.debug("Evicting least recently used distribution archive: %s", pathname)
+                try:
+                    os.unlink(pathname)
+                except EnvironmentError as e:
+                    if e.errno != errno.ENOENT:
+                        logger.warning("Failed to evict distribution archive %s: %s", pathname, e)
+                        continue
+                else:
+                    freed_space += size
+                removed.append(filename)
+            self.index.remove(removed)
+            if freed_space > 0:
+                logger.info("Evicted %s from local cache (freed %s).",
+                            pluralize(len(removed), "distribution archive"),
+                            format_size(freed_space))
+            return len(removed)
+
+    def check_prerequisites(self):
+        """
+        Make sure the local cache backend is enabled.
+
+        :raises: :exc:`.CacheBackendDisabledError` when
+                 :attr:`.Config.local_cache_backend` isn't ``files``.
+        """
+        if self.config.local_cache_backend != 'files':
+            raise CacheBackendDisabledError("The %s cache backend is selected." % self.config.local_cache_backend)
+
+
+class ArchiveIndex(object):
+
+    """
+    Index of the distribution archives in the local cache (used for eviction).
+
+    The index is a SQLite database (:data:`EVICTION_INDEX_FILE`) that records
+    the size and last access time of each distribution archive, the total
+    size of the local cache (maintained by triggers) and leases on the
+    distribution archives that are in use by running pip-accel processes.
+    Each thread uses its own database connection.
+    """
+
+    def __init__(self, config):
+        """
+        Initialize an :class:`ArchiveIndex` object.
+
+        :param config: The pip-accel configuration (a :class:`.Config`
+                       object).
+        """
+        self.config = config
+        self.lock = threading.Lock()
+        self.thread_local = threading.local()
+        self.initialized = False
+        self.leasing = False
+
+    @property
+    def connection(self):
+        """The database connection of the current thread (a :class:`sqlite3.Connection` object)."""
+        if not hasattr(self.thread_local, 'connection'):
+            makedirs(self.config.binary_cache)
+            connection = sqlite3.connect(os.path.join(self.config.binary_cache, EVICTION_INDEX_FILE),
+                                         timeout=BUSY_TIMEOUT)
+            connection.execute('pragma journal_mode = wal')
+            connection.execute('pragma synchronous = normal')
+            with self.lock:
+                if not self.initialized:
+                    self.initialize(connection)
+                    self.initialized = True
+            self.thread_local.connection = connection
+        return self.thread_local.connection
+
+    def initialize(self, connection):
+        """
+        Create the index (the first time it's used, based on the contents of the local cache).
+
+        :param connection: A :class:`sqlite3.Connection` object.
+        """
+        with FileLock(os.path.join(self.config.binary_cache, EVICTION_LOCK_FILE)):
+            query = "select count(*) from sqlite_master where type = 'table' and name = 'archives'"
+            exists = connection.execute(query).fetchone()[0] > 0
+            with connection:
+                for statement in INDEX_SCHEMA:
+                    connection.execute(statement)
+            if not exists:
+                rows = []
+                logger.info("Indexing local cache (%s) for eviction ..", self.config.binary_cache)
+                for root, dirs, files in os.walk(self.config.binary_cache):
+                    # Skip the bookkeeping files in the top level directory and
+                    # temporary files created by AtomicReplace and TeeReader.
+                    if os.path.normpath(root) == os.path.normpath(self.config.binary_cache):
+                        continue
+                    for name in files:
+                        pathname = os.path.join(root, name)
+                        filename = os.path.relpath(pathname, self.config.binary_cache)
+                        if '.tmp-' not in name and is_evictable(filename):
+                            try:
+                                metadata = os.stat(pathname)
+                            except EnvironmentError:
+                                continue
+                            rows.append((filename, metadata.st_size, metadata.st_mtime))
+                with connection:
+                    connection.executemany('insert or ignore into archives (filename, size, last_used) '
+                                           'values (?, ?, ?)', rows)
+                logger.debug("Indexed %s in local cache.", pluralize(len(rows), "distribution archive"))
+
+    def use(self, filename, size):
+        """
+        Mark a distribution archive as recently used and in use by the current process.
+
+        :param filename: The filename of the distribution archive (a string).
+        :param size: The size of the distribution archive in bytes (an integer).
+
+        The lease on the distribution archive is released when the process
+        exits (see :func:`release()`).
+        """
+        now = time.time()
+        with self.lock:
+            if not self.leasing:
+                atexit.register(self.release)
+                self.leasing = True
+        with self.connection as connection:
+            cursor = connection.execute('update archives set size = ?, last_used = ? where filename = ?',
+                                        (size, now, filename))
+            if cursor.rowcount == 0:
+                connection.execute('insert into archives (filename, size, last_used) values (?, ?, ?)',
+                                   (filename, size, now))
+            connection.execute('insert or replace into leases (filename, pid, created) values (?, ?, ?)',
+                               (filename, os.getpid(), now))
+
+    def register(self, filenames):
+        """
+        Add distribution archives to the index (unless they're already indexed).
+
+        :param filenames: A list of strings with the filenames of distribution
+                          archives in the local cache.
+        """
+        rows = []
+        for filename in filenames:
+            try:
+                metadata = os.stat(os.path.join(self.config.binary_cache, filename))
+            except EnvironmentError:
+                continue
+            rows.append((filename, metadata.st_size, metadata.st_mtime))
+        with self.connection as connection:
+            connection.executemany('insert or ignore into archives (filename, size, last_used) '
+                                   'values (?, ?, ?)', rows)
+
+    def remove(self, filenames):
+        """
+        Remove distribution archives from the index.
+
+        :param filenames: A list of strings with the filenames of distribution
+                          archives.
+        """
+        with self.connection as connection:
+            connection.executemany('delete from archives where filename = ?', [(fn,) for fn in filenames])
+
+    def release(self):
+        """Release the leases of the current process."""
+        try:
+            with self.connection as connection:
+                connection.execute('delete from leases where pid = ?', (os.getpid(),))
+        except sqlite3.Error as e:
+            logger.debug("Failed to release leases on local cache: %s", e)
+
+    def get_total_size(self):
+        """
+        Get the total size of the indexed distribution archives.
+
+        :returns: The total size in bytes (an integer).
+        """
+        return self.connection.execute('select size from totals where id = 0').fetchone()[0]
+
+    def get_oldest(self):
+        """
+        Get the last access time of the least recently used distribution archive.
+
+        :returns: A UNIX timestamp (a number) or infinity when the index is empty.
+        """
+        oldest = self.connection.execute('select min(last_used) from archives').fetchone()[0]
+        return float('inf') if oldest is None else oldest
+
+    def get_leased(self):
+        """
+        Get the distribution archives that are in use by running pip-accel processes.
+
+        :returns: A set of strings with filenames of distribution archives.
+
+        Leases of processes that are no longer running (and leases older than
+        :data:`MAX_LEASE_AGE`) are removed.
+        """
+        leased = set()
+        stale = []
+        now = time.time()
+        for filename, pid, created in self.connection.execute('select filename, pid, created from leases'):
+            if now - created < MAX_LEASE_AGE and (pid == os.getpid() or is_process_alive(pid)):
+                leased.add(filename)
+            else:
+                stale.append((filename, pid))
+        if stale:
+            with self.connection as connection:
+                connection.executemany('delete from leases where filename = ? and pid = ?', stale)
+        return leased
+
+    def iterate(self):
+        """
+        Iterate over the indexed distribution archives (least recently used first).
+
+        :returns: A generator of tuples with three values each: The filename of
+                  a distribution archive, its size in bytes and its last access
+                  time (a UNIX timestamp).
+        """
+        cursor = self.connection.execute('select filename, size, last_used from archives order by last_used')
+        try:
+            for row in cursor:
+                yield row
+        finally:
+            cursor.close()
+
+
+def is_evictable(filename):
+    """
+    Check whether a file in the local cache may be evicted.
+
+    :param filename: The filename of the file in the cache (a string).
+    :returns: :data:`False` for the manifests of mirrored source archives,
+              :data:`True` otherwise.
+    """
+    return not is_source_manifest(filename)
+
+
+def is_process_alive(pid):
+    """
+    Check whether a process is running.
+
+    :param pid: The process id (an integer).
+    :returns: :data:`True` when the process is running (or when this can't be
+              checked, as on Windows), :data:`False` otherwise.
+    """
+    if WINDOWS:
+        return True
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
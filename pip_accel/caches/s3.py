@@ -81,7 +81,11 @@ cache on the local file system.
 
 Optionally if you are using read only credentials you can disable
 :class:`~S3CacheBackend.put()` operations by setting the configuration
-option :attr:`~.Config.s3_cache_readonly`.
+option :attr:`~.Config.s3_cache_readonly`. When an upload is denied access
+(HTTP status 403) this option is enabled automatically. Other upload
+failures (e.g. timeouts) are handled like the failures of
+:class:`~pip_accel.caches.AbstractCacheBackend.get()` operations: The upload
+is retried and when it keeps failing the backend is skipped for a while.
 
 ----
 
@@ -90,17 +94,19 @@ option :attr:`~.Config.s3_cache_readonly`.
 """
 
 # Standard library modules.
+import io
 import logging
 import os
+import threading
 
 # External dependencies.
-from humanfriendly import coerce_boolean, Timer
+from humanfriendly import coerce_boolean, format_size, pluralize, Timer
 
 # Modules included in our package.
 from pip_accel.caches import AbstractCacheBackend
 from pip_accel.compat import urlparse
 from pip_accel.exceptions import CacheBackendDisabledError, CacheBackendError
-from pip_accel.utils import AtomicReplace, makedirs
+from pip_accel.utils import AtomicReplace, TeeReader, makedirs, run_concurrently
 
 # Initialize a logger for this module.
 logger = logging.getLogger(__name__)
@@ -115,6 +121,10 @@ BOTO_CONFIG_NUM_RETRIES_OPTION = 'num_retries'
 # The name of the boto.config option that controls the HTTP socket timeout.
 BOTO_CONFIG_SOCKET_TIMEOUT_OPTION = 'http_socket_timeout'
 
+# The maximum number of keys returned by a single request to list the keys in
+# an Amazon S3 bucket (the listing is paginated).
+LIST_PAGE_SIZE = 1000
+
 # The `coloredlogs' package installs a logging handler on the root logger which
 # means all loggers automatically write their log messages to the standard
 # error stream. In the case of Boto this is a bit confusing because Boto logs
@@ -139,6 +149,111 @@ class S3CacheBackend(AbstractCacheBackend):
 
     PRIORITY = 20
 
+    REMOTE = True
+
+    @property
+    def WRITABLE(self):
+        """:data:`False` when :attr:`~.Config.s3_cache_readonly` is enabled, :data:`True` otherwise."""
+        return not self.config.s3_cache_readonly
+
+    @property
+    def location(self):
+        """The Amazon S3 API endpoint, bucket name and prefix (a string)."""
+        return '/'.join(filter(None, [(self.config.s3_cache_url or '').rstrip('/'),
+                                      self.config.s3_cache_bucket,
+                                      self.config.s3_cache_prefix]))
+
+    def __init__(self, config):
+        """
+        Initialize the Amazon S3 cache backend.
+
+        :param config: The pip-accel configuration (a :class:`.Config`
+                       object).
+        """
+        super(S3CacheBackend, self).__init__(config)
+        self.known_keys = {}
+        # Boto connections aren't thread safe so each thread that uses the
+        # backend (see CacheManager.prefetch()) gets its own connection.
+        self.thread_local = threading.local()
+
+    def exists_many(self, filenames):
+        """
+        Check which of the given distribution archives exist in the configured Amazon S3 bucket.
+
+        :param filenames: A list of strings with the filenames of distribution
+                          archives.
+        :returns: A set of strings with the filenames of the distribution
+                  archives that exist in the Amazon S3 bucket.
+        :raises: :exc:`.CacheBackendError` when any underlying method fails.
+
+        Instead of checking the existence of each distribution archive
+        separately the cache keys are grouped by their directory and for each
+        group the keys below the longest common prefix of the group are
+        listed, which takes one request per thousand keys (see
+        :data:`LIST_PAGE_SIZE`). When a listing turns out to take more
+        requests than checking the remaining keys of the group one by one the
+        listing is abandoned in favor of ``HEAD`` requests. The results
+        (including the sizes of the distribution archives) are remembered so
+        that :func:`get()` doesn't need to check the existence of the
+        distribution archives again.
+        """
+        timer = Timer()
+        self.check_prerequisites()
+        cache_keys = dict((self.get_cache_key(fn), fn) for fn in filenames)
+        groups = {}
+        for raw_key in cache_keys:
+            groups.setdefault(raw_key.rpartition('/')[0], []).append(raw_key)
+        sizes = {}
+        for directory, raw_keys in sorted(groups.items()):
+            for raw_key, size in self.find_keys(raw_keys):
+                sizes[cache_keys[raw_key]] = size
+        existing = set(sizes)
+        for filename in filenames:
+            self.known_keys[filename] = sizes.get(filename, False)
+        logger.debug("Found %i of %s in S3 bucket in %s.", len(existing),
+                     pluralize(len(filenames), "distribution archive"), timer)
+        return existing
+
+    def find_keys(self, raw_keys):
+        """
+        Find the keys of a group of distribution archives in the same directory of the Amazon S3 bucket.
+
+        :param raw_keys: A list of cache keys (strings) that share the same
+                         directory.
+        :returns: A list of tuples with two values each: The cache key of a
+                  distribution archive that exists and its size in bytes.
+        """
+        remaining = sorted(raw_keys)
+        prefix = os.path.commonprefix(remaining)
+        # Listing more keys than this takes more requests than checking the
+        # existence of each of the keys separately.
+        budget = LIST_PAGE_SIZE * len(remaining)
+        logger.info("Listing distribution archives in S3 bucket (prefix %r) ..", prefix)
+        found = []
+        num_listed = 0
+        # The delimiter keeps the listing from descending into subdirectories
+        # (e.g. the wheels directory below the cache format revision).
+        for key in self.s3_bucket.list(prefix=prefix, delimiter='/'):
+            # The listing is sorted, so keys that sort before the current key
+            # and weren't listed don't exist.
+            while remaining and remaining[0] <= key.name:
+                if remaining.pop(0) == key.name:
+                    found.append((key.name, key.size))
+            num_listed += 1
+            if not remaining or num_listed >= budget:
+                break
+        else:
+            # The listing was exhausted, the remaining keys don't exist.
+            remaining = []
+        if remaining:
+            logger.debug("Listing S3 bucket is too expensive, checking %s separately ..",
+                         pluralize(len(remaining), "distribution archive"))
+            for raw_key in remaining:
+                key = self.s3_bucket.get_key(raw_key)
+                if key is not None:
+                    found.append((raw_key, key.size))
+        return found
+
     def get(self, filename):
         """
         Download a distribution archive from the configured Amazon S3 bucket.
@@ -152,22 +267,90 @@ class S3CacheBackend(AbstractCacheBackend):
         self.check_prerequisites()
         # Check if the distribution archive is available.
         raw_key = self.get_cache_key(filename)
-        logger.info("Checking if distribution archive is available in S3 bucket: %s", raw_key)
-        key = self.s3_bucket.get_key(raw_key)
+        key = self.find_key(filename)
         if key is None:
             logger.debug("Distribution archive is not available in S3 bucket.")
         else:
-            # Download the distribution archive to the local binary index.
-            # TODO Shouldn't this use LocalCacheBackend.put() instead of
-            #      implementing the same steps manually?!
+            # Download the distribution archive to the local binary index
+            # (or to a temporary file that CacheManager stores in the
+            # selected local cache backend).
             logger.info("Downloading distribution archive from S3 bucket ..")
-            file_in_cache = os.path.join(self.config.binary_cache, filename)
+            file_in_cache = self.get_download_pathname(filename)
             makedirs(os.path.dirname(file_in_cache))
-            with AtomicReplace(file_in_cache) as temporary_file:
-                key.get_contents_to_filename(temporary_file)
+            from boto.exception import S3ResponseError
+            try:
+                with AtomicReplace(file_in_cache) as temporary_file:
+                    if key.size and key.size > self.config.s3_cache_multipart_threshold:
+                        self.download_parts(raw_key, key.size, temporary_file)
+                    else:
+                        key.get_contents_to_filename(temporary_file)
+            except S3ResponseError as e:
+                # The key may have been removed after a bulk lookup.
+                if e.status == 404:
+                    logger.debug("Distribution archive disappeared from S3 bucket.")
+                    self.known_keys[filename] = False
+                    return None
+                raise
             logger.debug("Finished downloading distribution archive from S3 bucket in %s.", timer)
             return file_in_cache
 
+    def get_stream(self, filename):
+        """
+        Stream a distribution archive from the configured Amazon S3 bucket.
+
+        :param filename: The filename of the distribution archive (a string).
+        :returns: A :class:`~pip_accel.utils.TeeReader` object that reads
+                  from the HTTP response and copies the distribution archive
+                  into the local cache, or :data:`None` when the distribution
+                  archive is not available.
+        :raises: :exc:`.CacheBackendError` when any underlying method fails.
+
+        Distribution archives larger than
+        :attr:`.Config.s3_cache_multipart_threshold` are downloaded using
+        :func:`get()` instead (because ranged downloads are faster).
+        """
+        self.check_prerequisites()
+        key = self.find_key(filename)
+        if key is None:
+            logger.debug("Distribution archive is not available in S3 bucket.")
+            return None
+        if key.size and key.size > self.config.s3_cache_multipart_threshold:
+            return super(S3CacheBackend, self).get_stream(filename)
+        from boto.exception import S3ResponseError
+        try:
+            key.open_read()
+        except S3ResponseError as e:
+            # The key may have been removed after a bulk lookup.
+            if e.status == 404:
+                logger.debug("Distribution archive disappeared from S3 bucket.")
+                self.known_keys[filename] = False
+                return None
+            raise
+        logger.info("Streaming distribution archive from S3 bucket ..")
+        return TeeReader(key, self.get_download_pathname(filename))
+
+    def find_key(self, filename):
+        """
+        Find the key of a distribution archive in the configured Amazon S3 bucket.
+
+        :param filename: The filename of the distribution archive (a string).
+        :returns: A :class:`boto.s3.key.Key` object or :data:`None` when the
+                  distribution archive is not available.
+
+        The results of bulk lookups by :func:`exists_many()` are reused, in
+        that case no request is made.
+        """
+        raw_key = self.get_cache_key(filename)
+        if self.known_keys.get(filename) is False:
+            return None
+        elif self.known_keys.get(filename):
+            key = self.s3_bucket.new_key(raw_key)
+            key.size = self.known_keys[filename]
+            return key
+        else:
+            logger.info("Checking if distribution archive is available in S3 bucket: %s", raw_key)
+            return self.s3_bucket.get_key(raw_key)
+
     def put(self, filename, handle):
         """
         Upload a distribution archive to the configured Amazon S3 bucket.
@@ -179,24 +362,142 @@ class S3CacheBackend(AbstractCacheBackend):
         :param handle: A file-like object that provides access to the
                        distribution archive.
         :raises: :exc:`.CacheBackendError` when any underlying method fails.
+                 Any exceptions raised by Boto (so that
+                 :class:`.CacheManager` can retry the upload and skip the
+                 backend for a while), except when the upload is denied
+                 access: In that case the backend switches to read only mode
+                 (for the rest of the process).
         """
         if self.config.s3_cache_readonly:
             logger.info('Skipping upload to S3 bucket (using S3 in read only mode).')
         else:
             timer = Timer()
             self.check_prerequisites()
+            from boto.exception import S3ResponseError
             from boto.s3.key import Key
             raw_key = self.get_cache_key(filename)
             logger.info("Uploading distribution archive to S3 bucket: %s", raw_key)
-            key = Key(self.s3_bucket)
-            key.key = raw_key
+            handle.seek(0, os.SEEK_END)
+            size = handle.tell()
+            handle.seek(0)
             try:
-                key.set_contents_from_file(handle)
-            except Exception as e:
-                logger.info("Encountered error writing to S3 bucket, falling back to read only mode (exception: %s)", e)
+                if size > self.config.s3_cache_multipart_threshold:
+                    self.upload_parts(raw_key, size, handle)
+                else:
+                    key = Key(self.s3_bucket)
+                    key.key = raw_key
+                    key.set_contents_from_file(handle)
+            except S3ResponseError as e:
+                if e.status != 403:
+                    raise
+                logger.info("Access denied writing to S3 bucket, falling back to read only mode (exception: %s)", e)
                 self.config.s3_cache_readonly = True
             else:
                 logger.info("Finished uploading distribution archive to S3 bucket in %s.", timer)
+                self.known_keys[filename] = size or True
+
+    def upload_parts(self, raw_key, size, handle):
+        """
+        Upload a large distribution archive using a multipart upload.
+
+        :param raw_key: The cache key of the distribution archive (a string).
+        :param size: The size of the distribution archive in bytes (an integer).
+        :param handle: A file-like object that provides access to the
+                       distribution archive.
+        :raises: The exception that caused a part to fail (after retrying the
+                 part :attr:`.Config.s3_cache_retries` times). In this case the
+                 multipart upload is cancelled.
+
+        The parts (see :attr:`.Config.s3_cache_part_size`) are uploaded
+        using :attr:`.Config.s3_cache_part_threads` parallel connections. The
+        parts are read from the given file handle one at a time (the handle is
+        shared between threads) so memory usage is limited to one part per
+        thread.
+        """
+        from boto.s3.multipart import MultiPartUpload
+        parts = split_parts(size, self.config.s3_cache_part_size)
+        logger.debug("Uploading distribution archive (%s) in %s ..",
+                     format_size(size), pluralize(len(parts), "part"))
+        multipart_upload = self.s3_bucket.initiate_multipart_upload(raw_key)
+        lock = threading.Lock()
+
+        def upload_part(part):
+            part_number, offset, length = part
+            with lock:
+                handle.seek(offset)
+                contents = handle.read(length)
+            # Each thread uses its own connection (see s3_bucket).
+            upload = MultiPartUpload(self.s3_bucket)
+            upload.key_name = multipart_upload.key_name
+            upload.id = multipart_upload.id
+            self.retry_part(lambda: upload.upload_part_from_file(io.BytesIO(contents), part_number))
+
+        try:
+            for part, result, exception in run_concurrently(upload_part, parts, self.config.s3_cache_part_threads):
+                if exception is not None:
+                    raise exception
+            multipart_upload.complete_upload()
+        except Exception:
+            multipart_upload.cancel_upload()
+            raise
+
+    def download_parts(self, raw_key, size, pathname):
+        """
+        Download a large distribution archive using parallel ranged requests.
+
+        :param raw_key: The cache key of the distribution archive (a string).
+        :param size: The size of the distribution archive in bytes (an integer).
+        :param pathname: The pathname of the local file to create (a string).
+        :raises: The exception that caused a part to fail (after retrying the
+                 part :attr:`.Config.s3_cache_retries` times).
+
+        The parts (see :attr:`.Config.s3_cache_part_size`) are downloaded
+        using :attr:`.Config.s3_cache_part_threads` parallel connections and
+        each thread writes its parts directly to the right offset in the
+        local file.
+        """
+        parts = split_parts(size, self.config.s3_cache_part_size)
+        logger.debug("Downloading distribution archive (%s) in %s ..",
+                     format_size(size), pluralize(len(parts), "part"))
+        with open(pathname, 'wb') as handle:
+            handle.truncate(size)
+
+        def download_part(part):
+            part_number, offset, length = part
+            headers = {'Range': 'bytes=%i-%i' % (offset, offset + length - 1)}
+
+            def attempt():
+                with open(pathname, 'r+b') as handle:
+                    handle.seek(offset)
+                    # Each thread uses its own connection (see s3_bucket).
+                    self.s3_bucket.new_key(raw_key).get_file(handle, headers=headers)
+                    if handle.tell() != offset + length:
+                        raise CacheBackendError("Incomplete download of part {number}!", number=part_number)
+
+            self.retry_part(attempt)
+
+        for part, result, exception in run_concurrently(download_part, parts, self.config.s3_cache_part_threads):
+            if exception is not None:
+                raise exception
+
+    def retry_part(self, function):
+        """
+        Call a function that transfers a single part, retrying when it fails.
+
+        :param function: The function to call (a callable without arguments).
+        :raises: The exception raised by the last attempt when all of the
+                 :attr:`.Config.s3_cache_retries` retries failed.
+        """
+        attempt = 0
+        while True:
+            try:
+                return function()
+            except Exception as e:
+                attempt += 1
+                if attempt > self.config.s3_cache_retries:
+                    raise
+                logger.warning("Transfer of part failed, retrying (%i/%i): %s",
+                               attempt, self.config.s3_cache_retries, e)
 
     @property
     def s3_bucket(self):
@@ -204,7 +505,8 @@ class S3CacheBackend(AbstractCacheBackend):
         Connect to the user defined Amazon S3 bucket.
 
         Called on demand by :func:`get()` and :func:`put()`. Caches its
-        return value so that only a single connection is created.
+        return value so that only a single connection is created (per
+        thread).
 
         :returns: A :class:`boto.s3.bucket.Bucket` object.
         :raises: :exc:`.CacheBackendDisabledError` when the user hasn't
@@ -212,7 +514,7 @@ class S3CacheBackend(AbstractCacheBackend):
         :raises: :exc:`.CacheBackendError` when the connection to the Amazon
                  S3 bucket fails.
         """
-        if not hasattr(self, 'cached_bucket'):
+        if not hasattr(self.thread_local, 'bucket'):
             from boto.exception import BotoClientError, BotoServerError, S3ResponseError
             # The following try/except block translates unexpected exceptions
             # raised by Boto into a CacheBackendError exception.
@@ -221,13 +523,13 @@ class S3CacheBackend(AbstractCacheBackend):
                 # raised by Boto when an Amazon S3 bucket does not exist.
                 try:
                     logger.debug("Connecting to Amazon S3 bucket: %s", self.config.s3_cache_bucket)
-                    self.cached_bucket = self.s3_connection.get_bucket(self.config.s3_cache_bucket)
+                    self.thread_local.bucket = self.s3_connection.get_bucket(self.config.s3_cache_bucket)
                 except S3ResponseError as e:
                     if e.status == 404 and self.config.s3_cache_create_bucket:
                         logger.info("Amazon S3 bucket doesn't exist yet, creating it now: %s",
                                     self.config.s3_cache_bucket)
                         self.s3_connection.create_bucket(self.config.s3_cache_bucket)
-                        self.cached_bucket = self.s3_connection.get_bucket(self.config.s3_cache_bucket)
+                        self.thread_local.bucket = self.s3_connection.get_bucket(self.config.s3_cache_bucket)
                     else:
                         # Don't swallow exceptions we can't handle.
                         raise
@@ -238,7 +540,7 @@ class S3CacheBackend(AbstractCacheBackend):
                     using the provided credentials? The Amazon S3 cache backend
                     will be disabled for now.
                 """, bucket=repr(self.config.s3_cache_bucket))
-        return self.cached_bucket
+        return self.thread_local.bucket
 
     @property
     def s3_connection(self):
@@ -248,13 +550,14 @@ class S3CacheBackend(AbstractCacheBackend):
         If the connection attempt fails because Boto can't find credentials the
         attempt is retried once with an anonymous connection.
 
-        Called on demand by :attr:`s3_bucket`.
+        Called on demand by :attr:`s3_bucket`. Caches its return value so
+        that only a single connection is created (per thread).
 
         :returns: A :class:`boto.s3.connection.S3Connection` object.
         :raises: :exc:`.CacheBackendError` when the connection to the Amazon
                  S3 API fails.
         """
-        if not hasattr(self, 'cached_connection'):
+        if not hasattr(self.thread_local, 'connection'):
             import boto
             from boto.exception import BotoClientError, BotoServerError, NoAuthHandlerFound
             from boto.s3.connection import S3Connection, SubdomainCallingFormat, OrdinaryCallingFormat
@@ -277,24 +580,24 @@ class S3CacheBackend(AbstractCacheBackend):
                 calling_format = (SubdomainCallingFormat() if host == S3Connection.DefaultHost
                                   else OrdinaryCallingFormat())
                 try:
-                    self.cached_connection = S3Connection(host=host,
-                                                          port=int(port) if port else None,
-                                                          is_secure=is_secure,
-                                                          calling_format=calling_format)
+                    self.thread_local.connection = S3Connection(host=host,
+                                                                port=int(port) if port else None,
+                                                                is_secure=is_secure,
+                                                                calling_format=calling_format)
                 except NoAuthHandlerFound:
                     logger.debug("Amazon S3 API credentials missing, retrying with anonymous connection ..")
-                    self.cached_connection = S3Connection(host=host,
-                                                          port=int(port) if port else None,
-                                                          is_secure=is_secure,
-                                                          calling_format=calling_format,
-                                                          anon=True)
+                    self.thread_local.connection = S3Connection(host=host,
+                                                                port=int(port) if port else None,
+                                                                is_secure=is_secure,
+                                                                calling_format=calling_format,
+                                                                anon=True)
             except (BotoClientError, BotoServerError):
                 raise CacheBackendError("""
                     Failed to connect to the Amazon S3 API! Most likely your
                     credentials are not correctly configured. The Amazon S3
                     cache backend will be disabled for now.
                 """)
-        return self.cached_connection
+        return self.thread_local.connection
 
     def get_cache_key(self, filename):
         """
@@ -330,3 +633,16 @@ class S3CacheBackend(AbstractCacheBackend):
                 pip-accel using the command `pip install pip-accel[s3]'. The
                 Amazon S3 cache backend will be disabled for now.
             """)
+
+
+def split_parts(size, part_size):
+    """
+    Split a file into parts for a multipart transfer.
+
+    :param size: The size of the file in bytes (an integer).
+    :param part_size: The size of each part in bytes (an integer).
+    :returns: A list of tuples with three integers each: The part number
+              (starting from one), the offset and the length of the part.
+    """
+    return [(i + 1, offset, min(part_size, size - offset))
+            for i, offset in enumerate(range(0, size, part_size))]
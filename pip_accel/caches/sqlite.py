@@ -0,0 +1,247 @@
+# Accelerator for pip, the Python package manager.
+#
+# Author: Peter Odding <peter.odding@paylogic.com>
+# Last Change: October 31, 2015
+# URL: https://github.com/paylogic/pip-accel
+#
+# A word of warning: Do *not* use the cached_property decorator here, because
+# it interacts badly with the metaclass magic performed by the base class (see
+# the comment at the top of pip_accel.caches.s3).
+
+"""
+SQLite cache backend.
+
+This module implements an alternative to the local file system cache backend
+(see :mod:`pip_accel.caches.local`) which stores all distribution archives as
+blobs in a single SQLite_ database (see :attr:`~.Config.sqlite_cache`). To
+enable this backend set the configuration option
+:attr:`~.Config.local_cache_backend` to ``sqlite`` (this disables the local file
+system cache backend).
+
+On file systems where metadata operations are expensive (e.g. overlay file
+systems in containers or home directories on NFS) the file per archive layout
+of the local file system cache backend is slow and it fragments badly when
+many small archives are cached. The SQLite cache backend needs a single file
+and a single indexed query per lookup.
+
+Concurrency
+-----------
+
+The database uses SQLite's write-ahead log (WAL), so any number of pip-accel
+processes can read from the database while another process writes to it.
+Writers are serialized by SQLite: A process that wants to write while another
+process is writing waits for up to :data:`BUSY_TIMEOUT` seconds. Each thread
+uses its own database connection (see :func:`~pip_accel.caches.CacheManager.prefetch()`).
+
+Distribution archives are extracted from the database into a temporary
+directory when :func:`~SQLiteCacheBackend.get()` is called (pip-accel needs a
+local file to unpack) and the temporary directory is removed when the process
+exits. When :attr:`~.Config.streaming_installs` is enabled distribution
+archives are read from memory instead (see
+:func:`~SQLiteCacheBackend.get_stream()`).
+
+Note that :attr:`~.Config.binary_cache_max_size` and
+:attr:`~.Config.binary_cache_max_age` only apply to the local file system cache
+backend and ``pip-accel serve-cache`` (see :mod:`pip_accel.server`) only
+serves the local file system cache.
+
+.. _SQLite: https://www.sqlite.org/
+"""
+
+# Standard library modules.
+import atexit
+import io
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+# Modules included in our package.
+from pip_accel.caches import AbstractCacheBackend
+from pip_accel.exceptions import CacheBackendDisabledError
+from pip_accel.utils import makedirs
+
+# External dependencies.
+from humanfriendly import format_size, pluralize
+
+# Initialize a logger for this module.
+logger = logging.getLogger(__name__)
+
+BUSY_TIMEOUT = 60
+"""The number of seconds to wait for a concurrent writer to finish (an integer)."""
+
+MAX_VARIABLES = 500
+"""The maximum number of filenames looked up in a single query (an integer)."""
+
+SCHEMA = """
+    create table if not exists archives (
+        filename text primary key,
+        contents blob not null,
+        size integer not null,
+        created real not null
+    )
+"""
+"""The SQL statement that creates the table of distribution archives (a string)."""
+
+
+class SQLiteCacheBackend(AbstractCacheBackend):
+
+    """The SQLite cache backend stores distribution archives in a single SQLite database."""
+
+    PRIORITY = 10
+
+    def __init__(self, config):
+        """
+        Initialize the SQLite cache backend.
+
+        :param config: The pip-accel configuration (a :class:`.Config`
+                       object).
+        """
+        super(SQLiteCacheBackend, self).__init__(config)
+        self.lock = threading.Lock()
+        self.thread_local = threading.local()
+        self.extract_directory = None
+
+    @property
+    def connection(self):
+        """The database connection of the current thread (a :class:`sqlite3.Connection` object)."""
+        if not hasattr(self.thread_local, 'connection'):
+            self.check_prerequisites()
+            makedirs(os.path.dirname(self.config.sqlite_cache))
+            logger.debug("Connecting to SQLite cache: %s", self.config.sqlite_cache)
+            connection = sqlite3.connect(self.config.sqlite_cache, timeout=BUSY_TIMEOUT)
+            connection.execute('pragma journal_mode = wal')
+            connection.execute('pragma synchronous = normal')
+            with connection:
+                connection.execute(SCHEMA)
+            self.thread_local.connection = connection
+        return self.thread_local.connection
+
+    def exists_many(self, filenames):
+        """
+        Check which of the given distribution archives exist in the database.
+
+        :param filenames: A list of strings with the filenames of distribution
+                          archives.
+        :returns: A set of strings with the filenames of the distribution
+                  archives that exist in the database.
+        """
+        existing = set()
+        for chunk in split_list(filenames, MAX_VARIABLES):
+            query = 'select filename from archives where filename in (%s)' % ', '.join('?' * len(chunk))
+            existing.update(row[0] for row in self.connection.execute(query, chunk))
+        return existing
+
+    def get(self, filename):
+        """
+        Extract a distribution archive from the database.
+
+        :param filename: The filename of the distribution archive (a string).
+        :returns: The pathname of a temporary file with the distribution
+                  archive or :data:`None`.
+        """
+        return self.get_many([filename]).get(filename)
+
+    def get_many(self, filenames):
+        """
+        Extract multiple distribution archives from the database.
+
+        :param filenames: A list of strings with the filenames of distribution
+                          archives.
+        :returns: A dictionary that maps the filenames of the distribution
+                  archives that were found to the pathnames of temporary files.
+        """
+        found = {}
+        for chunk in split_list(filenames, MAX_VARIABLES):
+            query = 'select filename, contents from archives where filename in (%s)' % ', '.join('?' * len(chunk))
+            for filename, contents in self.connection.execute(query, chunk):
+                pathname = os.path.join(self.get_extract_directory(), filename)
+                makedirs(os.path.dirname(pathname))
+                with open(pathname, 'wb') as handle:
+                    handle.write(bytes(contents))
+                found[filename] = pathname
+        logger.debug("Found %i of %s in SQLite cache.", len(found),
+                     pluralize(len(filenames), "distribution archive"))
+        return found
+
+    def get_stream(self, filename):
+        """
+        Read a distribution archive from the database into memory.
+
+        :param filename: The filename of the distribution archive (a string).
+        :returns: An :class:`io.BytesIO` object or :data:`None`.
+        """
+        row = self.connection.execute('select contents from archives where filename = ?', (filename,)).fetchone()
+        if row is not None:
+            return io.BytesIO(bytes(row[0]))
+
+    def put(self, filename, handle):
+        """
+        Store a distribution archive in the database.
+
+        :param filename: The filename of the distribution archive (a string).
+        :param handle: A file-like object that provides access to the
+                       distribution archive.
+        """
+        self.put_many([(filename, handle)])
+
+    def put_many(self, archives):
+        """
+        Store multiple distribution archives in the database (in a single transaction).
+
+        :param archives: A list of tuples with two values each: The filename
+                         of a distribution archive (a string) and a file-like
+                         object that provides access to the distribution
+                         archive.
+        """
+        rows = []
+        for filename, handle in archives:
+            contents = handle.read()
+            logger.debug("Storing distribution archive in SQLite cache: %s (%s)",
+                         filename, format_size(len(contents)))
+            rows.append((filename, sqlite3.Binary(contents), len(contents), time.time()))
+        with self.connection:
+            self.connection.executemany('insert or replace into archives (filename, contents, size, created) '
+                                        'values (?, ?, ?, ?)', rows)
+
+    def get_extract_directory(self):
+        """
+        Get the temporary directory where distribution archives are extracted.
+
+        :returns: The pathname of a directory that is removed when the
+                  process exits (a string).
+        """
+        with self.lock:
+            if self.extract_directory is None:
+                self.extract_directory = tempfile.mkdtemp(prefix='pip-accel-sqlite-')
+                atexit.register(shutil.rmtree, self.extract_directory, True)
+            return self.extract_directory
+
+    def check_prerequisites(self):
+        """
+        Make sure the SQLite cache backend is enabled.
+
+        :raises: :exc:`.CacheBackendDisabledError` when
+                 :attr:`.Config.local_cache_backend` isn't ``sqlite``.
+        """
+        if self.config.local_cache_backend != 'sqlite':
+            raise CacheBackendDisabledError("""
+                To use the SQLite cache backend you have to set the environment
+                variable $PIP_ACCEL_LOCAL_CACHE_BACKEND to 'sqlite' (see the
+                documentation for details).
+            """)
+
+
+def split_list(items, size):
+    """
+    Split a list into chunks.
+
+    :param items: The list to split.
+    :param size: The maximum number of items per chunk (an integer).
+    :returns: A list of lists.
+    """
+    items = list(items)
+    return [items[i:i + size] for i in range(0, len(items), size)]
@@ -7,6 +7,7 @@
 """Command line interface for the ``pip-accel`` program."""
 
 # Standard library modules.
+import getopt
 import logging
 import os
 import sys
@@ -16,6 +17,7 @@ import textwrap
 from pip_accel import PipAccelerator
 from pip_accel.config import Config
 from pip_accel.exceptions import NothingToDoError
+from pip_accel.server import DEFAULT_PORT, serve_cache
 from pip_accel.utils import match_option
 
 # External dependencies.
@@ -32,6 +34,10 @@ def main():
     if not arguments:
         usage()
         sys.exit(0)
+    # The serve-cache subcommand is implemented by pip-accel itself.
+    if arguments[0] == 'serve-cache':
+        serve_cache_command(arguments[1:])
+        sys.exit(0)
     # If no install subcommand is given we pass the command line straight
     # to pip without any changes and exit immediately afterwards.
     if 'install' not in arguments:
@@ -62,10 +68,45 @@ def main():
         sys.exit(1)
 
 
+def serve_cache_command(arguments):
+    """
+    Implementation of the ``pip-accel serve-cache`` subcommand.
+
+    :param arguments: The command line arguments following the subcommand (a
+                      list of strings).
+    """
+    coloredlogs.install()
+    address, port, include_sources = '', DEFAULT_PORT, False
+    try:
+        options, arguments = getopt.getopt(arguments, 'b:p:svq', ['bind=', 'port=', 'sources', 'verbose', 'quiet'])
+        for option, value in options:
+            if option in ('-b', '--bind'):
+                address = value
+            elif option in ('-p', '--port'):
+                port = int(value)
+            elif option in ('-s', '--sources'):
+                include_sources = True
+            elif option in ('-v', '--verbose'):
+                coloredlogs.increase_verbosity()
+            elif option in ('-q', '--quiet'):
+                coloredlogs.decrease_verbosity()
+        if arguments:
+            raise getopt.GetoptError("Unexpected positional arguments! (%s)" % ' '.join(arguments))
+    except (getopt.GetoptError, ValueError) as e:
+        logger.error("Failed to parse command line arguments: %s", e)
+        sys.exit(1)
+    try:
+        serve_cache(Config(), (address, port), include_sources)
+    except Exception:
+        logger.exception("Caught unhandled exception!")
+        sys.exit(1)
+
+
 def usage():
     """Print a usage message to the terminal."""
     print(textwrap.dedent("""
         Usage: pip-accel [PIP_ARGS]
+               pip-accel serve-cache [--bind=ADDRESS] [--port=PORT] [--sources]
 
         The pip-accel program is a wrapper for pip, the Python package manager. It
         accelerates the usage of pip to initialize Python virtual environments given
@@ -73,6 +114,10 @@ def usage():
         and options supported by pip, however the only added value is in the "pip
         install" subcommand.
 
+        The "serve-cache" subcommand serves the local binary cache over HTTP (on
+        port %i by default) so that other hosts can use it by setting
+        $PIP_ACCEL_HTTP_URL. The --sources option also serves the source index.
+
         For more information please refer to the GitHub project page
         at https://github.com/paylogic/pip-accel
-    """).strip())
+    """).strip() % DEFAULT_PORT)
@@ -12,9 +12,14 @@ import sys
 # Inform static code analysis tools about our intention to expose the
 # following variables. This avoids 'imported but unused' warnings.
 __all__ = (
+    'BaseHTTPRequestHandler',
+    'HTTPServer',
+    'ThreadingMixIn',
     'WINDOWS',
     'StringIO',
     'configparser',
+    'quote',
+    'unquote',
     'urlparse',
 )
 
@@ -24,11 +29,16 @@ WINDOWS = sys.platform.startswith('win')
 # Compatibility between Python 2 and 3.
 try:
     # Python 2.
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
     from StringIO import StringIO
+    from urllib import quote, unquote
     from urlparse import urlparse
     import ConfigParser as configparser
 except ImportError:
     # Python 3.
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
     from io import StringIO
-    from urllib.parse import urlparse
+    from urllib.parse import quote, unquote, urlparse
     import configparser
@@ -20,6 +20,7 @@ passed down like this:
    CacheManager -> LocalCacheBackend
    CacheManager -> S3CacheBackend
    BinaryDistributionManager -> SystemPackageManager
+   BinaryDistributionManager -> BuildWorkerPool
 
 The :class:`.PipAccelerator` class receives its configuration object from
 its caller. Usually this will be :func:`.main()` but when pip-accel is used
@@ -80,7 +81,7 @@ from pip_accel.utils import is_root, expand_path
 
 # External dependencies.
 from cached_property import cached_property
-from humanfriendly import coerce_boolean, parse_path
+from humanfriendly import coerce_boolean, parse_path, parse_size
 
 # Initialize a logger for this module.
 logger = logging.getLogger(__name__)
@@ -209,6 +210,108 @@ class Config(object):
         return self.get(property_name='binary_cache',
                         default=os.path.join(self.data_directory, 'binaries'))
 
+    @cached_property
+    def shared_binary_caches(self):
+        """
+        The absolute pathnames of read only binary cache directories shared between users (a list of strings).
+
+        Distribution archives are looked up in these directories before they
+        are looked up in :attr:`binary_cache`, but newly built distribution
+        archives are only stored in :attr:`binary_cache`. This enables e.g.
+        build hosts where pip-accel runs as many different users to share a
+        single warm binary cache (like ``/srv/pip-accel/binaries``) instead of
+        filling the binary cache of every user with the same archives. The
+        directories are expected to have the same layout as
+        :attr:`binary_cache` (for example because they are the binary cache
+        of another user).
+
+        - Environment variable: ``$PIP_ACCEL_SHARED_BINARY_CACHES``
+        - Configuration option: ``shared-binary-caches``
+        - Default: an empty list (directories are separated by
+          :data:`os.pathsep`, i.e. a colon on UNIX)
+        """
+        value = self.get(property_name='shared_binary_caches',
+                         environment_variable='PIP_ACCEL_SHARED_BINARY_CACHES',
+                         configuration_option='shared-binary-caches')
+        return [expand_path(d.strip()) for d in (value or '').split(os.pathsep) if d.strip()]
+
+    @cached_property
+    def sqlite_cache(self):
+        """
+        The absolute pathname of the SQLite database used as binary cache (a string).
+
+        This is the file ``binaries.sqlite3`` in :data:`data_directory`.
+        Refer to :attr:`local_cache_backend` for details.
+        """
+        return self.get(property_name='sqlite_cache',
+                        default=os.path.join(self.data_directory, 'binaries.sqlite3'))
+
+    @cached_property
+    def backend_statistics(self):
+        """
+        The absolute pathname of the file with cache backend statistics (a string).
+
+        This is the file ``backend-statistics.json`` in :data:`data_directory`.
+        Refer to :attr:`adaptive_backend_order` for details.
+        """
+        return self.get(property_name='backend_statistics',
+                        default=os.path.join(self.data_directory, 'backend-statistics.json'))
+
+    @cached_property
+    def http_cache_metadata(self):
+        """
+        The absolute pathname of the file with HTTP cache validators (a string).
+
+        This is the file ``http-cache-metadata.json`` in :data:`data_directory`.
+        Refer to :mod:`pip_accel.caches.http` for details.
+        """
+        return self.get(property_name='http_cache_metadata',
+                        default=os.path.join(self.data_directory, 'http-cache-metadata.json'))
+
+    @cached_property
+    def negative_cache(self):
+        """
+        The absolute pathname of the file with known cache misses (a string).
+
+        This is the file ``negative-cache.json`` in :data:`data_directory`.
+        Refer to :attr:`negative_cache_ttl` for details.
+        """
+        return self.get(property_name='negative_cache',
+                        default=os.path.join(self.data_directory, 'negative-cache.json'))
+
+    @cached_property
+    def build_trees(self):
+        """
+        The absolute pathname of pip-accel's persistent build tree directory (a string).
+
+        This is the ``build-trees`` subdirectory of :data:`data_directory`.
+        Refer to :attr:`incremental_builds` for details.
+        """
+        return self.get(property_name='build_trees',
+                        default=os.path.join(self.data_directory, 'build-trees'))
+
+    @cached_property
+    def egg_info_cache(self):
+        """
+        The absolute pathname of pip-accel's ``egg_info`` metadata cache directory (a string).
+
+        This is the ``egg-info`` subdirectory of :data:`data_directory`.
+        Refer to :attr:`egg_info_caching` for details.
+        """
+        return self.get(property_name='egg_info_cache',
+                        default=os.path.join(self.data_directory, 'egg-info'))
+
+    @cached_property
+    def upload_spool(self):
+        """
+        The absolute pathname of pip-accel's upload spool directory (a string).
+
+        This is the ``upload-spool`` subdirectory of :data:`data_directory`.
+        Refer to :attr:`background_uploads` for details.
+        """
+        return self.get(property_name='upload_spool',
+                        default=os.path.join(self.data_directory, 'upload-spool'))
+
     @cached_property
     def data_directory(self):
         """
@@ -297,6 +400,520 @@ class Config(object):
         except:
             return 3
 
+    @cached_property
+    def egg_info_caching(self):
+        """
+        :data:`True` if the metadata generated by ``setup.py egg_info`` is cached, :data:`False` otherwise.
+
+        To discover the dependencies of a source distribution pip runs
+        ``setup.py egg_info`` for every requirement it unpacks, which makes up
+        most of the time spent resolving a requirement set on a host where all
+        distribution archives are available locally. When this option is
+        enabled the generated metadata is stored in :attr:`egg_info_cache`
+        (keyed by the SHA-256 hash of the source distribution archive and the
+        Python version and platform) and ``setup.py`` isn't executed again for
+        the same archive (see :mod:`pip_accel.egg_info`).
+
+        - Environment variable: ``$PIP_ACCEL_EGG_INFO_CACHING``
+        - Configuration option: ``egg-info-caching``
+        - Default: :data:`True`
+        """
+        return coerce_boolean(self.get(property_name='egg_info_caching',
+                                       environment_variable='PIP_ACCEL_EGG_INFO_CACHING',
+                                       configuration_option='egg-info-caching',
+                                       default=True))
+
+    @cached_property
+    def partial_resolution(self):
+        """
+        :data:`True` if only missing requirements are looked up online, :data:`False` otherwise.
+
+        When the local source index can't satisfy all requirements pip-accel
+        used to run pip's resolution again with access to the package
+        index(es), which means every requirement is looked up online (even the
+        ones that are available locally) and this is repeated for each retry
+        (see :attr:`max_retries`). When this option is enabled only the
+        requirements that are missing from the local source index are looked
+        up on the package index(es) and downloaded, the rest of the resolution
+        happens offline. This doesn't apply when ``--upgrade`` is given or the
+        source index is empty (in that case everything is downloaded, see
+        :attr:`download_threads`).
+
+        - Environment variable: ``$PIP_ACCEL_PARTIAL_RESOLUTION``
+        - Configuration option: ``partial-resolution``
+        - Default: :data:`True`
+        """
+        return coerce_boolean(self.get(property_name='partial_resolution',
+                                       environment_variable='PIP_ACCEL_PARTIAL_RESOLUTION',
+                                       configuration_option='partial-resolution',
+                                       default=True))
+
+    @cached_property
+    def source_mirroring(self):
+        """
+        :data:`True` if source archives are mirrored into the cache backends, :data:`False` otherwise.
+
+        When this is enabled the source distribution archives downloaded from
+        PyPI are stored in the cache backends (below the ``sources/``
+        directory) and hosts whose source index is missing archives fetch them
+        from the cache backends before falling back to PyPI (see
+        :mod:`pip_accel.mirror`).
+
+        - Environment variable: ``$PIP_ACCEL_SOURCE_MIRRORING``
+        - Configuration option: ``source-mirroring``
+        - Default: :data:`False`
+        """
+        return coerce_boolean(self.get(property_name='source_mirroring',
+                                       environment_variable='PIP_ACCEL_SOURCE_MIRRORING',
+                                       configuration_option='source-mirroring',
+                                       default=False))
+
+    @cached_property
+    def build_workers(self):
+        """
+        The number of warm build worker processes to use (an integer).
+
+        When this is greater than zero binary distributions are built by
+        long running worker processes that have already imported setuptools
+        (see :mod:`pip_accel.workers`). This avoids the startup of a new
+        Python interpreter for every build. Warm build workers are not
+        available on Windows.
+
+        - Environment variable: ``$PIP_ACCEL_BUILD_WORKERS``
+        - Configuration option: ``build-workers``
+        - Default: ``0`` (warm build workers are disabled)
+        """
+        value = self.get(property_name='build_workers',
+                         environment_variable='PIP_ACCEL_BUILD_WORKERS',
+                         configuration_option='build-workers')
+        try:
+            n = int(value)
+            if n >= 0:
+                return n
+        except:
+            pass
+        return 0
+
+    @cached_property
+    def build_timeout(self):
+        """
+        The maximum number of seconds a binary distribution build may take (an integer).
+
+        Builds that run for longer than this are killed and reported using
+        :exc:`.BuildTimeout`.
+
+        - Environment variable: ``$PIP_ACCEL_BUILD_TIMEOUT``
+        - Configuration option: ``build-timeout``
+        - Default: ``0`` (builds never time out)
+        """
+        value = self.get(property_name='build_timeout',
+                         environment_variable='PIP_ACCEL_BUILD_TIMEOUT',
+                         configuration_option='build-timeout')
+        try:
+            n = int(value)
+            if n >= 0:
+                return n
+        except:
+            pass
+        return 0
+
+    @cached_property
+    def incremental_builds(self):
+        """
+        Whether binary distributions are built in persistent build trees (a boolean).
+
+        By default every source distribution is built in the temporary
+        directory where pip unpacked it, so every build starts from scratch.
+        When this option is enabled each package gets a persistent build tree
+        under :attr:`build_trees` which is refreshed from the new source
+        distribution before every build (only changed files are touched)
+        while the compiled extension modules in ``build/lib*`` and the object
+        files in ``build/temp*`` are retained. This enables ``build_ext`` to
+        skip the compilation of extension modules whose sources didn't
+        change, even across versions. All other build products (e.g. Python
+        modules and scripts) are removed before every build and extension
+        modules that a package no longer declares are removed after it's been
+        built (see :class:`~pip_accel.bdist.BuildTree`).
+
+        - Environment variable: ``$PIP_ACCEL_INCREMENTAL_BUILDS`` (refer to
+          :func:`~humanfriendly.coerce_boolean()` for details on how the
+          value of the environment variable is interpreted)
+        - Configuration option: ``incremental-builds`` (also parsed using
+          :func:`~humanfriendly.coerce_boolean()`)
+        - Default: :data:`False`
+        """
+        return coerce_boolean(self.get(property_name='incremental_builds',
+                                       environment_variable='PIP_ACCEL_INCREMENTAL_BUILDS',
+                                       configuration_option='incremental-builds',
+                                       default=False))
+
+    @cached_property
+    def build_wheels(self):
+        """
+        Whether source distributions are converted to wheels (a boolean).
+
+        By default pip-accel converts source distributions to "dumb binary
+        distributions" (using ``setup.py bdist_dumb``). When this option is
+        enabled source distributions are converted to wheels (using ``setup.py
+        bdist_wheel``) instead. The wheels are stored in the cache backends and
+        installed by :mod:`pip_accel.wheels`, which means installed packages
+        get an exact file manifest (the ``RECORD`` file). This requires the
+        `wheel` package to be installed.
+
+        - Environment variable: ``$PIP_ACCEL_BUILD_WHEELS`` (refer to
+          :func:`~humanfriendly.coerce_boolean()` for details on how the
+          value of the environment variable is interpreted)
+        - Configuration option: ``build-wheels`` (also parsed using
+          :func:`~humanfriendly.coerce_boolean()`)
+        - Default: :data:`False`
+        """
+        return coerce_boolean(self.get(property_name='build_wheels',
+                                       environment_variable='PIP_ACCEL_BUILD_WHEELS',
+                                       configuration_option='build-wheels',
+                                       default=False))
+
+    @cached_property
+    def prefetch_threads(self):
+        """
+        The number of threads used to prefetch cached distribution archives (an integer).
+
+        Before installation starts pip-accel knows which distribution archives
+        are available in remote cache backends (like Amazon S3). These are
+        downloaded to the local cache concurrently using this number of
+        threads, so that the installation itself can proceed from the local
+        file system. Set this option to ``0`` to disable prefetching.
+
+        - Environment variable: ``$PIP_ACCEL_PREFETCH_THREADS``
+        - Configuration option: ``prefetch-threads``
+        - Default: ``4``
+        """
+        value = self.get(property_name='prefetch_threads',
+                         environment_variable='PIP_ACCEL_PREFETCH_THREADS',
+                         configuration_option='prefetch-threads')
+        try:
+            n = int(value)
+            if n >= 0:
+                return n
+        except:
+            pass
+        return 4
+
+    @cached_property
+    def download_threads(self):
+        """
+        The number of threads used to download missing source distribution archives (an integer).
+
+        When the local source index can't satisfy the requirements pip-accel
+        downloads the distribution archives of the requirements discovered by
+        pip concurrently using this number of threads, instead of letting pip
+        download them one at a time (see :mod:`pip_accel.downloads`). Set this
+        option to ``0`` to leave downloading to pip.
+
+        - Environment variable: ``$PIP_ACCEL_DOWNLOAD_THREADS``
+        - Configuration option: ``download-threads``
+        - Default: ``4``
+        """
+        value = self.get(property_name='download_threads',
+                         environment_variable='PIP_ACCEL_DOWNLOAD_THREADS',
+                         configuration_option='download-threads')
+        try:
+            n = int(value)
+            if n >= 0:
+                return n
+        except:
+            pass
+        return 4
+
+    @cached_property
+    def streaming_installs(self):
+        """
+        Whether cached binary distributions are installed while they're being downloaded (a boolean).
+
+        By default a cached binary distribution archive is downloaded from a
+        remote cache backend (like Amazon S3) to the local cache before it's
+        installed. When this option is enabled the archive is decompressed and
+        installed while it is being downloaded (and copied into the local
+        cache at the same time), which overlaps network and disk I/O. This
+        applies to the dumb binary distributions that pip-accel builds by
+        default (wheels need random access). If the download fails halfway
+        the installation of the package fails as well, which is why this
+        option is not enabled by default.
+
+        - Environment variable: ``$PIP_ACCEL_STREAMING_INSTALLS`` (refer to
+          :func:`~humanfriendly.coerce_boolean()` for details on how the
+          value of the environment variable is interpreted)
+        - Configuration option: ``streaming-installs`` (also parsed using
+          :func:`~humanfriendly.coerce_boolean()`)
+        - Default: :data:`False`
+        """
+        return coerce_boolean(self.get(property_name='streaming_installs',
+                                       environment_variable='PIP_ACCEL_STREAMING_INSTALLS',
+                                       configuration_option='streaming-installs',
+                                       default=False))
+
+    @cached_property
+    def background_uploads(self):
+        """
+        Whether distribution archives are uploaded to remote cache backends in the background (a boolean).
+
+        By default the installation waits until a newly built distribution
+        archive has been stored in all cache backends. When this option is
+        enabled uploads to remote cache backends (like Amazon S3) are copied
+        to :attr:`upload_spool` and performed by a background thread while
+        the installation continues. Before pip-accel exits it waits for the
+        remaining uploads (see :attr:`background_upload_timeout`); uploads
+        that didn't finish are resumed by the next run of pip-accel.
+
+        - Environment variable: ``$PIP_ACCEL_BACKGROUND_UPLOADS`` (refer to
+          :func:`~humanfriendly.coerce_boolean()` for details on how the
+          value of the environment variable is interpreted)
+        - Configuration option: ``background-uploads`` (also parsed using
+          :func:`~humanfriendly.coerce_boolean()`)
+        - Default: :data:`False`
+        """
+        return coerce_boolean(self.get(property_name='background_uploads',
+                                       environment_variable='PIP_ACCEL_BACKGROUND_UPLOADS',
+                                       configuration_option='background-uploads',
+                                       default=False))
+
+    @cached_property
+    def background_upload_timeout(self):
+        """
+        The maximum number of seconds to wait for background uploads before exiting (an integer).
+
+        - Environment variable: ``$PIP_ACCEL_BACKGROUND_UPLOAD_TIMEOUT``
+        - Configuration option: ``background-upload-timeout``
+        - Default: ``300``
+        """
+        value = self.get(property_name='background_upload_timeout',
+                         environment_variable='PIP_ACCEL_BACKGROUND_UPLOAD_TIMEOUT',
+                         configuration_option='background-upload-timeout')
+        try:
+            n = int(value)
+            if n >= 0:
+                return n
+        except:
+            pass
+        return 300
+
+    @cached_property
+    def local_cache_backend(self):
+        """
+        The storage used for the local binary cache (a string).
+
+        The value ``files`` selects :mod:`pip_accel.caches.local` which stores
+        each distribution archive as a separate file in :attr:`binary_cache`.
+        The value ``sqlite`` selects :mod:`pip_accel.caches.sqlite` which
+        stores all distribution archives in the single SQLite database
+        :attr:`sqlite_cache` (this avoids the metadata operations of the file
+        per archive layout, which can be slow on e.g. overlay or network file
+        systems).
+
+        - Environment variable: ``$PIP_ACCEL_LOCAL_CACHE_BACKEND``
+        - Configuration option: ``local-cache-backend``
+        - Default: ``files``
+        """
+        value = self.get(property_name='local_cache_backend',
+                         environment_variable='PIP_ACCEL_LOCAL_CACHE_BACKEND',
+                         configuration_option='local-cache-backend')
+        if value and value.strip().lower() == 'sqlite':
+            return 'sqlite'
+        return 'files'
+
+    @cached_property
+    def binary_cache_max_size(self):
+        """
+        The maximum size of the local binary cache in bytes (an integer).
+
+        When the distribution archives in :attr:`binary_cache` take up more
+        than this number of bytes the least recently used archives are
+        removed (see :mod:`pip_accel.caches.local`).
+
+        - Environment variable: ``$PIP_ACCEL_BINARY_CACHE_MAX_SIZE``
+        - Configuration option: ``binary-cache-max-size``
+        - Default: ``0`` (the size of the local binary cache is unlimited;
+          the value is parsed using :func:`~humanfriendly.parse_size()`)
+        """
+        value = self.get(property_name='binary_cache_max_size',
+                         environment_variable='PIP_ACCEL_BINARY_CACHE_MAX_SIZE',
+                         configuration_option='binary-cache-max-size')
+        try:
+            return parse_size(str(value))
+        except:
+            return 0
+
+    @cached_property
+    def binary_cache_max_age(self):
+        """
+        The maximum number of days that unused archives are kept in the local binary cache (an integer).
+
+        Distribution archives in :attr:`binary_cache` that haven't been used
+        for more than this number of days are removed (see
+        :mod:`pip_accel.caches.local`).
+
+        - Environment variable: ``$PIP_ACCEL_BINARY_CACHE_MAX_AGE``
+        - Configuration option: ``binary-cache-max-age``
+        - Default: ``0`` (archives are never removed because of their age)
+        """
+        value = self.get(property_name='binary_cache_max_age',
+                         environment_variable='PIP_ACCEL_BINARY_CACHE_MAX_AGE',
+                         configuration_option='binary-cache-max-age')
+        try:
+            n = int(value)
+            if n >= 0:
+                return n
+        except:
+            pass
+        return 0
+
+    @cached_property
+    def cache_retries(self):
+        """
+        The number of times a failed cache backend operation is retried (an integer).
+
+        Failing operations are retried with exponentially increasing delays
+        (see :func:`.CacheManager.call_backend()`). When all retries fail the
+        cache backend is skipped for a while (its circuit breaker opens).
+
+        - Environment variable: ``$PIP_ACCEL_CACHE_RETRIES``
+        - Configuration option: ``cache-retries``
+        - Default: ``2``
+        """
+        value = self.get(property_name='cache_retries',
+                         environment_variable='PIP_ACCEL_CACHE_RETRIES',
+                         configuration_option='cache-retries')
+        try:
+            n = int(value)
+            if n >= 0:
+                return n
+        except:
+            pass
+        return 2
+
+    @cached_property
+    def cache_retry_budget(self):
+        """
+        The maximum number of seconds spent retrying cache backend operations per lookup (a number).
+
+        Retries that would exceed this time budget are not attempted, so that
+        misbehaving cache backends can't slow down a lookup indefinitely. The
+        budget is shared by all of the cache backends consulted during a
+        lookup (e.g. fetching a single distribution archive or checking the
+        availability of all distribution archives up front), so several flaky
+        remote cache backends together don't get more time than one.
+
+        - Environment variable: ``$PIP_ACCEL_CACHE_RETRY_BUDGET``
+        - Configuration option: ``cache-retry-budget``
+        - Default: ``10``
+        """
+        value = self.get(property_name='cache_retry_budget',
+                         environment_variable='PIP_ACCEL_CACHE_RETRY_BUDGET',
+                         configuration_option='cache-retry-budget')
+        try:
+            n = float(value)
+            if n >= 0:
+                return n
+        except:
+            pass
+        return 10
+
+    @cached_property
+    def cache_promotion(self):
+        """
+        :data:`True` if cache hits are copied to faster cache backends, :data:`False` otherwise.
+
+        When a distribution archive is found in a cache backend it's also
+        stored in the writable cache backends that are consulted before that
+        backend, so that the next lookup is served by the fastest cache
+        backend (see :func:`.CacheManager.promote()`).
+
+        - Environment variable: ``$PIP_ACCEL_CACHE_PROMOTION``
+        - Configuration option: ``cache-promotion``
+        - Default: :data:`True`
+        """
+        return coerce_boolean(self.get(property_name='cache_promotion',
+                                       environment_variable='PIP_ACCEL_CACHE_PROMOTION',
+                                       configuration_option='cache-promotion',
+                                       default=True))
+
+    @cached_property
+    def negative_cache_ttl(self):
+        """
+        The number of seconds that misses of remote cache backends are remembered (an integer).
+
+        When a remote cache backend (like Amazon S3) doesn't contain a
+        distribution archive this is recorded in :attr:`negative_cache`.
+        Subsequent runs of pip-accel skip the lookup of the distribution
+        archive in that backend until this number of seconds has passed, so
+        that e.g. internal packages that are never uploaded (because
+        :attr:`s3_cache_readonly` is set) don't cost a round trip to the
+        remote cache backend on every run. Set this option to ``0`` to
+        disable the negative cache.
+
+        - Environment variable: ``$PIP_ACCEL_NEGATIVE_CACHE_TTL``
+        - Configuration option: ``negative-cache-ttl``
+        - Default: ``3600`` (one hour)
+        """
+        value = self.get(property_name='negative_cache_ttl',
+                         environment_variable='PIP_ACCEL_NEGATIVE_CACHE_TTL',
+                         configuration_option='negative-cache-ttl')
+        try:
+            n = int(value)
+            if n >= 0:
+                return n
+        except:
+            pass
+        return 60 * 60
+
+    @cached_property
+    def adaptive_backend_order(self):
+        """
+        Whether cache backends are ordered by their measured performance (a boolean).
+
+        By default the cache backends are consulted in the order of their
+        static priority (the local cache before Amazon S3). When this option
+        is enabled pip-accel keeps track of the average lookup time, transfer
+        rate and availability of distribution archives of each cache backend
+        across runs (in :attr:`backend_statistics`) and once enough
+        statistics are available the remote backend with the lowest expected
+        cost per distribution archive is consulted first (see
+        :class:`~pip_accel.metrics.BackendStatistics`). To measure the
+        availability every remote backend is asked about all distribution
+        archives missing from the local cache (see
+        :func:`~pip_accel.caches.CacheManager.plan()`). Local backends are
+        always consulted before remote backends.
+
+        - Environment variable: ``$PIP_ACCEL_ADAPTIVE_BACKEND_ORDER`` (refer
+          to :func:`~humanfriendly.coerce_boolean()` for details on how the
+          value of the environment variable is interpreted)
+        - Configuration option: ``adaptive-backend-order`` (also parsed using
+          :func:`~humanfriendly.coerce_boolean()`)
+        - Default: :data:`True`
+        """
+        return coerce_boolean(self.get(property_name='adaptive_backend_order',
+                                       environment_variable='PIP_ACCEL_ADAPTIVE_BACKEND_ORDER',
+                                       configuration_option='adaptive-backend-order',
+                                       default=True))
+
+    @cached_property
+    def prometheus_textfile(self):
+        """
+        The pathname of a file to write cache metrics to (a string or :data:`None`).
+
+        When this option is set the cache metrics of each run (see
+        :mod:`pip_accel.metrics`) are written to the given file in the format
+        expected by the textfile collector of the Prometheus node exporter
+        (the filename should end in ``.prom``).
+
+        - Environment variable: ``$PIP_ACCEL_PROMETHEUS_TEXTFILE``
+        - Configuration option: ``prometheus-textfile``
+        - Default: :data:`None`
+        """
+        value = self.get(property_name='prometheus_textfile',
+                         environment_variable='PIP_ACCEL_PROMETHEUS_TEXTFILE',
+                         configuration_option='prometheus-textfile')
+        return parse_path(value) if value else None
+
     @cached_property
     def s3_cache_url(self):
         """
@@ -432,3 +1049,107 @@ class Config(object):
                 return n
         except:
             return 5
+
+    @cached_property
+    def s3_cache_multipart_threshold(self):
+        """
+        The size above which distribution archives are transferred in parts (an integer).
+
+        Distribution archives larger than this number of bytes are uploaded
+        to Amazon S3 using a multipart upload and downloaded using ranged
+        requests, in both cases using :attr:`s3_cache_part_threads` parallel
+        connections. Failed parts are retried individually (up to
+        :attr:`s3_cache_retries` times) instead of restarting the transfer.
+
+        - Environment variable: ``$PIP_ACCEL_S3_MULTIPART_THRESHOLD``
+        - Configuration option: ``s3-multipart-threshold``
+        - Default: ``50 MB`` (the value is parsed using
+          :func:`~humanfriendly.parse_size()`)
+        """
+        value = self.get(property_name='s3_cache_multipart_threshold',
+                         environment_variable='PIP_ACCEL_S3_MULTIPART_THRESHOLD',
+                         configuration_option='s3-multipart-threshold')
+        try:
+            return parse_size(str(value))
+        except:
+            return parse_size('50 MB')
+
+    @cached_property
+    def s3_cache_part_size(self):
+        """
+        The size of the parts used for multipart transfers (an integer).
+
+        Amazon S3 requires all parts but the last one of a multipart upload to
+        be at least 5 MB, so smaller values are raised to 5 MB.
+
+        - Environment variable: ``$PIP_ACCEL_S3_PART_SIZE``
+        - Configuration option: ``s3-part-size``
+        - Default: ``16 MB`` (the value is parsed using
+          :func:`~humanfriendly.parse_size()`)
+        """
+        value = self.get(property_name='s3_cache_part_size',
+                         environment_variable='PIP_ACCEL_S3_PART_SIZE',
+                         configuration_option='s3-part-size')
+        try:
+            return max(parse_size(str(value)), parse_size('5 MB'))
+        except:
+            return parse_size('16 MB')
+
+    @cached_property
+    def s3_cache_part_threads(self):
+        """
+        The number of parts of a multipart transfer that are transferred in parallel (an integer).
+
+        - Environment variable: ``$PIP_ACCEL_S3_PART_THREADS``
+        - Configuration option: ``s3-part-threads``
+        - Default: ``4``
+        """
+        value = self.get(property_name='s3_cache_part_threads',
+                         environment_variable='PIP_ACCEL_S3_PART_THREADS',
+                         configuration_option='s3-part-threads')
+        try:
+            n = int(value)
+            if n >= 1:
+                return n
+        except:
+            pass
+        return 4
+
+    @cached_property
+    def http_cache_url(self):
+        """
+        The base URL of a web server that serves distribution archives (a string or :data:`None`).
+
+        The web server is expected to serve the same directory layout as
+        :attr:`binary_cache` (for example ``https://example.com/pip-accel/``
+        when the web server exposes a copy of the local binary cache).
+
+        - Environment variable: ``$PIP_ACCEL_HTTP_URL``
+        - Configuration option: ``http-url``
+        - Default: :data:`None`
+
+        For details please refer to the :mod:`pip_accel.caches.http` module.
+        """
+        return self.get(property_name='http_cache_url',
+                        environment_variable='PIP_ACCEL_HTTP_URL',
+                        configuration_option='http-url')
+
+    @cached_property
+    def http_cache_timeout(self):
+        """
+        The socket timeout in seconds for connections to :attr:`http_cache_url` (an integer).
+
+        - Environment variable: ``$PIP_ACCEL_HTTP_TIMEOUT``
+        - Configuration option: ``http-timeout``
+        - Default: ``60``
+        """
+        value = self.get(property_name='http_cache_timeout',
+                         environment_variable='PIP_ACCEL_HTTP_TIMEOUT',
+                         configuration_option='http-timeout')
+        try:
+            n = int(value)
+            if n > 0:
+                return n
+        except:
+            pass
+        return 60
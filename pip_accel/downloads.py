@@ -0,0 +1,226 @@
+# Accelerator for pip, the Python package manager.
+#
+# Author: Peter Odding <peter.odding@paylogic.com>
+# Last Change: October 31, 2015
+# URL: https://github.com/paylogic/pip-accel
+
+"""
+Concurrent downloading of missing source distribution archives.
+
+When the local source index can't satisfy the requirements pip-accel runs
+``pip install --download`` (see :func:`~pip_accel.PipAccelerator.download_source_dists()`)
+and pip downloads the missing distribution archives one at a time. The
+:class:`ConcurrentDownloader` defined in this module speeds this up:
+
+1. Every time pip adds a requirement to its requirement set (the requirements
+   given by the user as well as the dependencies that pip discovers while
+   unpacking distribution archives) the downloader starts a background thread
+   that looks up the distribution archive of the requirement on the package
+   index and downloads it into the source index (see
+   :attr:`~.Config.source_index`).
+
+2. When pip gets around to the requirement it waits for the background
+   download and uses the local distribution archive instead of downloading
+   it again (see :class:`~pip_accel.PrefetchingPackageFinder`).
+
+The downloads share pip's HTTP session (so keep-alive connections are pooled
+and pip's index and certificate options are respected) and the number of
+concurrent downloads is limited by :attr:`~.Config.download_threads`. When a
+background download fails pip simply downloads the distribution archive
+itself (and reports the error if it fails again).
+"""
+
+# Standard library modules.
+import hashlib
+import logging
+import os
+import threading
+
+# Modules included in our package.
+from pip_accel.utils import AtomicReplace
+
+# External dependencies.
+from humanfriendly import Timer, format_size, pluralize
+from pip import index as pip_index_module
+from pip._vendor.pkg_resources import VersionConflict, WorkingSet
+from pip.exceptions import BestVersionAlreadyInstalled, DistributionNotFound
+from pip.utils.logging import _log_state as pip_log_state
+
+# Initialize a logger for this module.
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 64
+"""The number of bytes read from the package index at a time (an integer)."""
+
+
+class ConcurrentDownloader(object):
+
+    """Download the distribution archives of requirements into the source index using a pool of threads."""
+
+    def __init__(self, config):
+        """
+        Initialize a :class:`ConcurrentDownloader` object.
+
+        :param config: The pip-accel configuration (a :class:`.Config`
+                       object).
+        """
+        self.config = config
+        self.downloaded = []
+        self.finder = None
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.semaphore = None
+        self.timer = None
+
+    @property
+    def enabled(self):
+        """:data:`True` if :attr:`.Config.download_threads` is greater than zero, :data:`False` otherwise."""
+        return self.config.download_threads > 0
+
+    def start(self, finder):
+        """
+        Start accepting requirements to download.
+
+        :param finder: The :class:`pip.index.PackageFinder` object created by
+                       pip (its HTTP session and package index configuration
+                       are used to look up and download distribution
+                       archives).
+        """
+        self.finder = finder
+        self.pending = {}
+        self.semaphore = threading.BoundedSemaphore(max(1, self.config.download_threads))
+        self.timer = Timer()
+
+    def submit(self, requirement_set, requirement):
+        """
+        Start downloading the distribution archive of a requirement in the background.
+
+        :param requirement_set: The :class:`pip.req.RequirementSet` object to
+                                which the requirement was added.
+        :param requirement: A :class:`pip.req.InstallRequirement` object.
+
+        Requirements that refer to an URL or a local path, editable
+        requirements and requirements that pip won't download (because they're
+        already installed) are ignored.
+        """
+        if not (self.enabled and self.finder):
+            return
+        if requirement.editable or requirement.link or requirement.constraint or not requirement.name:
+            return
+        if not (requirement_set.ignore_installed or requirement_set.upgrade) and is_satisfied(requirement):
+            return
+        with self.lock:
+            if requirement in self.pending:
+                return
+            thread = threading.Thread(target=self.download, args=(requirement, requirement_set.upgrade))
+            thread.daemon = True
+            thread.pathname = None
+            self.pending[requirement] = thread
+        thread.start()
+
+    def wait(self, requirement):
+        """
+        Wait for the background download of a requirement to finish.
+
+        :param requirement: A :class:`pip.req.InstallRequirement` object.
+        :returns: The pathname of the downloaded distribution archive (a
+                  string) or :data:`None` when the requirement wasn't
+                  submitted or the download failed.
+        """
+        with self.lock:
+            thread = self.pending.get(requirement)
+        if thread is None:
+            return None
+        thread.join()
+        return thread.pathname
+
+    def stop(self):
+        """Wait for the remaining background downloads and stop accepting requirements."""
+        with self.lock:
+            threads = list(self.pending.values())
+        for thread in threads:
+            thread.join()
+        if threads:
+            num_downloaded = sum(1 for t in threads if t.pathname)
+            logger.info("Downloaded %s concurrently in %s.",
+                        pluralize(num_downloaded, "distribution archive"), self.timer)
+        self.finder = None
+
+    def download(self, requirement, upgrade):
+        """
+        Look up and download the distribution archive of a requirement (runs in a background thread).
+
+        :param requirement: A :class:`pip.req.InstallRequirement` object.
+        :param upgrade: :data:`True` if pip was asked to upgrade requirements,
+                        :data:`False` otherwise.
+        """
+        thread = threading.current_thread()
+        # pip's log indentation is thread local and only initialized for the
+        # main thread, but pip's package finder depends on it.
+        pip_log_state.indentation = 0
+        with self.semaphore:
+            try:
+                # Bypass PrefetchingPackageFinder.find_requirement() because it
+                # would wait for the thread that we're running in.
+                link = pip_index_module.PackageFinder.find_requirement(self.finder, requirement, upgrade)
+                if link is None or link.url.startswith('file:'):
+                    # The best distribution archive is already available locally.
+                    return
+                thread.pathname = self.download_link(link)
+                with self.lock:
+                    self.downloaded.append(thread.pathname)
+            except (BestVersionAlreadyInstalled, DistributionNotFound):
+                # pip will report these situations itself.
+                pass
+            except Exception as e:
+                logger.warning("Failed to download %s in the background, leaving it to pip! (%s)", requirement, e)
+
+    def download_link(self, link):
+        """
+        Download a distribution archive into the source index.
+
+        :param link: A :class:`pip.index.Link` object.
+        :returns: The pathname of the downloaded distribution archive (a string).
+        :raises: :exc:`~exceptions.ValueError` when the hash embedded in the
+                 link doesn't match the downloaded distribution archive, any
+                 exceptions raised by the HTTP session.
+        """
+        timer = Timer()
+        pathname = os.path.join(self.config.source_index, link.filename)
+        logger.debug("Downloading %s ..", link.url_without_fragment)
+        response = self.finder.session.get(link.url_without_fragment, headers={'Accept-Encoding': 'identity'},
+                                           stream=True)
+        hasher = hashlib.new(link.hash_name) if link.hash_name else None
+        num_bytes = 0
+        atomic_replace = AtomicReplace(pathname)
+        try:
+            response.raise_for_status()
+            with atomic_replace as temporary_file:
+                with open(temporary_file, 'wb') as handle:
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        handle.write(chunk)
+                        num_bytes += len(chunk)
+                        if hasher:
+                            hasher.update(chunk)
+                if hasher and hasher.hexdigest() != link.hash:
+                    raise ValueError("Hash of %s doesn't match the package index!" % link.filename)
+        finally:
+            response.close()
+            if os.path.exists(atomic_replace.temporary_file):
+                os.unlink(atomic_replace.temporary_file)
+        logger.info("Downloaded %s (%s) in %s.", link.filename, format_size(num_bytes), timer)
+        return pathname
+
+
+def is_satisfied(requirement):
+    """
+    Check whether a requirement is satisfied by an installed distribution.
+
+    :param requirement: A :class:`pip.req.InstallRequirement` object.
+    :returns: :data:`True` if an installed distribution satisfies the
+              requirement, :data:`False` otherwise.
+    """
+    try:
+        return WorkingSet().find(requirement.req) is not None
+    except VersionConflict:
+        return False
@@ -0,0 +1,153 @@
+# Accelerator for pip, the Python package manager.
+#
+# Author: Peter Odding <peter.odding@paylogic.com>
+# Last Change: October 31, 2015
+# URL: https://github.com/paylogic/pip-accel
+
+"""
+Caching of the metadata generated by ``setup.py egg_info``.
+
+To discover the name, version and dependencies of a source distribution pip
+unpacks the distribution archive and runs ``setup.py egg_info`` (which
+generates ``PKG-INFO``, ``requires.txt`` and a few other files). On a host
+where all distribution archives are available locally this makes up the bulk
+of the time spent resolving a requirement set, even though the distribution
+archives haven't changed since the previous run.
+
+When the configuration option :attr:`~.Config.egg_info_caching` is enabled
+the :class:`EggInfoCache` defined in this module stores the generated
+metadata in :attr:`~.Config.egg_info_cache` and restores it instead of running
+``setup.py egg_info`` when the same distribution archive is unpacked again.
+Because ``setup.py`` scripts can generate different metadata depending on the
+Python version and platform (e.g. conditional dependencies) the metadata is
+keyed by the SHA-256 hash of the distribution archive as well as the Python
+version and platform. Editable requirements and requirements that don't refer
+to a distribution archive (e.g. a local directory) are never cached.
+"""
+
+# Standard library modules.
+import hashlib
+import logging
+import os
+import shutil
+import sys
+
+# Modules included in our package.
+from pip_accel.utils import get_python_version, makedirs, synchronize_directories
+
+# External dependencies.
+from pip.download import url_to_path
+
+# Initialize a logger for this module.
+logger = logging.getLogger(__name__)
+
+# The number of bytes read from a distribution archive at a time while hashing it.
+CHUNK_SIZE = 1024 * 64
+
+
+class EggInfoCache(object):
+
+    """Persistent cache of the metadata generated by ``setup.py egg_info``."""
+
+    def __init__(self, config):
+        """
+        Initialize an :class:`EggInfoCache` object.
+
+        :param config: The pip-accel configuration (a :class:`.Config`
+                       object).
+        """
+        self.config = config
+
+    @property
+    def enabled(self):
+        """:data:`True` if :attr:`.Config.egg_info_caching` is enabled, :data:`False` otherwise."""
+        return self.config.egg_info_caching
+
+    def run_egg_info(self, requirement, run_egg_info):
+        """
+        Restore the ``egg_info`` metadata of a requirement from the cache or generate it.
+
+        :param requirement: A :class:`pip.req.InstallRequirement` object
+                            whose distribution archive has been unpacked.
+        :param run_egg_info: The original implementation of
+                             :func:`pip.req.InstallRequirement.run_egg_info()`
+                             (a callable that takes the requirement as its
+                             only argument).
+        """
+        archive = self.find_archive(requirement) if self.enabled else None
+        if not archive:
+            run_egg_info(requirement)
+            return
+        cache_directory = self.get_cache_directory(archive)
+        egg_info_directory = os.path.join(requirement.source_dir, 'pip-egg-info')
+        if os.path.isdir(cache_directory):
+            logger.debug("Restoring cached egg_info metadata of %s (skipping setup.py) ..", requirement.name)
+            makedirs(egg_info_directory)
+            synchronize_directories(cache_directory, egg_info_directory)
+            return
+        run_egg_info(requirement)
+        self.store(egg_info_directory, cache_directory)
+
+    def find_archive(self, requirement):
+        """
+        Find the distribution archive that a requirement was unpacked from.
+
+        :param requirement: A :class:`pip.req.InstallRequirement` object.
+        :returns: The pathname of the distribution archive (a string) or
+                  :data:`None` when the metadata of the requirement shouldn't
+                  be cached.
+        """
+        if requirement.editable or not requirement.req or not requirement.link:
+            return None
+        if requirement.editable_options and 'subdirectory' in requirement.editable_options:
+            return None
+        link = requirement.link
+        if link.url.startswith('file:'):
+            pathname = url_to_path(link.url_without_fragment)
+        else:
+            # pip saves downloaded archives in the source index (because
+            # pip-accel runs `pip install --download').
+            pathname = os.path.join(self.config.source_index, link.filename)
+        return pathname if os.path.isfile(pathname) else None
+
+    def get_cache_directory(self, archive):
+        """
+        Get the cache directory of a distribution archive.
+
+        :param archive: The pathname of a distribution archive (a string).
+        :returns: The pathname of the directory that contains (or will
+                  contain) the cached metadata (a string).
+        """
+        context = hashlib.sha256()
+        with open(archive, 'rb') as handle:
+            for chunk in iter(lambda: handle.read(CHUNK_SIZE), b''):
+                context.update(chunk)
+        return os.path.join(self.config.egg_info_cache,
+                            '%s-%s' % (get_python_version(), sys.platform),
+                            context.hexdigest())
+
+    def store(self, egg_info_directory, cache_directory):
+        """
+        Store the metadata generated by ``setup.py egg_info`` in the cache.
+
+        :param egg_info_directory: The pathname of the ``pip-egg-info``
+                                   directory created by pip (a string).
+        :param cache_directory: The pathname of the cache directory (a string).
+
+        The metadata is copied to a temporary directory which is then renamed,
+        so concurrent runs of pip-accel never see partially copied metadata.
+        """
+        if not os.path.isdir(egg_info_directory):
+            return
+        makedirs(os.path.dirname(cache_directory))
+        temporary_directory = '%s.tmp-%i' % (cache_directory, os.getpid())
+        try:
+            shutil.copytree(egg_info_directory, temporary_directory)
+            os.rename(temporary_directory, cache_directory)
+            logger.debug("Stored egg_info metadata in %s.", cache_directory)
+        except EnvironmentError as e:
+            # Another process may have stored the same metadata concurrently.
+            logger.debug("Failed to store egg_info metadata in %s! (%s)", cache_directory, e)
+        finally:
+            if os.path.isdir(temporary_directory):
+                shutil.rmtree(temporary_directory, ignore_errors=True)
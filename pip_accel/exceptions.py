@@ -26,7 +26,8 @@ If you're interested in implementing structured handling of exceptions reported
 by pip-accel the following diagram may help by visualizing the hierarchy:
 
 .. inheritance-diagram:: EnvironmentMismatchError UnknownDistributionFormat InvalidSourceDistribution \
-                         BuildFailed NoBuildOutput CacheBackendError CacheBackendDisabledError \
+                         BuildFailed BuildTimeout NoBuildOutput InvalidWheelDistribution \
+                         CacheBackendError CacheBackendDisabledError \
                          DependencyInstallationRefused DependencyInstallationFailed
    :parts: 1
 
@@ -106,6 +107,17 @@ class BuildFailed(BinaryDistributionError):
     """
 
 
+class BuildTimeout(BinaryDistributionError):
+
+    """
+    Custom exception raised when a binary distribution build takes too long.
+
+    Raised by :func:`~pip_accel.bdist.BinaryDistributionManager.build_binary_dist()`
+    when a build was killed because it ran for longer than
+    :attr:`~.Config.build_timeout`.
+    """
+
+
 class NoBuildOutput(BinaryDistributionError):
 
     """
@@ -117,6 +129,17 @@ class NoBuildOutput(BinaryDistributionError):
     """
 
 
+class InvalidWheelDistribution(PipAcceleratorError):
+
+    """
+    Custom exception raised when a wheel distribution archive can't be installed.
+
+    Raised by :func:`~pip_accel.wheels.install_wheel()` when the archive
+    doesn't have the expected structure or uses an unsupported version of the
+    wheel format.
+    """
+
+
 class CacheBackendError(PipAcceleratorError):
 
     """Custom exception raised by cache backends when they fail in a controlled manner."""
@@ -0,0 +1,425 @@
+# Accelerator for pip, the Python package manager.
+#
+# Author: Peter Odding <peter.odding@paylogic.com>
+# Last Change: October 31, 2015
+# URL: https://github.com/paylogic/pip-accel
+
+"""
+Instrumentation of the cache backends.
+
+The :class:`~pip_accel.caches.CacheManager` records every operation on a
+cache backend in a :class:`CacheMetrics` object:
+
+- The number of operations per backend, operation and outcome (for example
+  ``get`` operations can be a ``hit``, ``miss`` or ``error``, backends
+  that are disabled are counted as ``disable`` operations and backends that
+  are temporarily skipped are counted as ``circuit`` operations).
+
+- The number of bytes transferred per backend and operation.
+
+- A histogram of the duration of the operations per backend and operation
+  (using the buckets in :data:`DURATION_BUCKETS`).
+
+At the end of a run pip-accel logs a JSON summary of the metrics (see
+:func:`CacheMetrics.summary()`) and when the configuration option
+:attr:`~.Config.prometheus_textfile` is set the metrics are also written to a
+file in the format expected by the `textfile collector`_ of the Prometheus
+node exporter. Note that the values always describe a single run of
+pip-accel (the file is overwritten by each run).
+
+The metrics of each run (including the availability of distribution archives
+in the remote cache backends, see :func:`CacheMetrics.record_availability()`)
+are also used to update the persistent :class:`BackendStatistics` which enable
+the :class:`~pip_accel.caches.CacheManager` to adapt the order in which cache
+backends are consulted to the measured performance of the backends on the
+current host.
+
+.. _textfile collector: https://github.com/prometheus/node_exporter#textfile-collector
+"""
+
+# Standard library modules.
+import json
+import logging
+import os
+import threading
+
+# Modules included in our package.
+from pip_accel.utils import AtomicReplace, makedirs
+
+# Initialize a logger for this module.
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300)
+"""The upper bounds (in seconds) of the buckets of the duration histograms (a tuple of numbers)."""
+
+SMOOTHING_FACTOR = 0.3
+"""The weight of the most recent run in the :class:`BackendStatistics` moving averages (a float)."""
+
+MIN_SAMPLES = 10
+"""The number of samples per backend required before backends are ordered adaptively (an integer)."""
+
+TRANSFER_SIZE = 1024 * 1024
+"""The size (in bytes) of the archive used to compare the transfer rates of backends (an integer)."""
+
+
+class CacheMetrics(object):
+
+    """Thread safe counters and histograms of cache backend operations."""
+
+    def __init__(self):
+        """Initialize a :class:`CacheMetrics` object."""
+        self.lock = threading.Lock()
+        self.operations = {}
+        self.bytes = {}
+        self.durations = {}
+        self.totals = {}
+        self.availability = {}
+
+    def record(self, backend, operation, outcome, duration=None, num_bytes=0):
+        """
+        Record a single operation on a cache backend.
+
+        :param backend: The cache backend (its :func:`repr()` is used as the
+                        name of the backend).
+        :param operation: The name of the operation (a string like ``get``,
+                          ``put`` or ``lookup``).
+        :param outcome: The outcome of the operation (a string like ``hit``,
+                        ``miss``, ``ok`` or ``error``).
+        :param duration: The duration of the operation in seconds (a number
+                         or :data:`None`).
+        :param num_bytes: The number of bytes transferred (an integer).
+        """
+        name = repr(backend)
+        with self.lock:
+            key = (name, operation, outcome)
+            self.operations[key] = self.operations.get(key, 0) + 1
+            if num_bytes:
+                key = (name, operation)
+                self.bytes[key] = self.bytes.get(key, 0) + num_bytes
+            if duration is not None:
+                key = (name, operation)
+                if key not in self.durations:
+                    self.durations[key] = dict(buckets=[0] * len(DURATION_BUCKETS), count=0, sum=0.0)
+                histogram = self.durations[key]
+                for i, upper_bound in enumerate(DURATION_BUCKETS):
+                    if duration <= upper_bound:
+                        histogram['buckets'][i] += 1
+                histogram['count'] += 1
+                histogram['sum'] += duration
+                key = (name, operation, outcome, bool(num_bytes))
+                totals = self.totals.setdefault(key, [0, 0.0, 0])
+                totals[0] += 1
+                totals[1] += duration
+                totals[2] += num_bytes
+
+    def record_availability(self, backend, num_lookups, num_found, duration):
+        """
+        Record a bulk lookup in a remote cache backend.
+
+        :param backend: The cache backend (its :func:`repr()` is used as the
+                        name of the backend).
+        :param num_lookups: The number of distribution archives that were
+                            looked up (an integer).
+        :param num_found: The number of distribution archives that were found
+                          (an integer).
+        :param duration: The duration of the lookup in seconds (a number).
+
+        :func:`.CacheManager.plan()` asks every remote cache backend about the
+        same distribution archives, so (unlike the hit rate of ``get``
+        operations, which only see the misses of the backends consulted
+        before them) these numbers can be compared between backends.
+        """
+        with self.lock:
+            availability = self.availability.setdefault(repr(backend), [0, 0, 0.0])
+            availability[0] += num_lookups
+            availability[1] += num_found
+            availability[2] += duration
+
+    def summary(self):
+        """
+        Summarize the recorded metrics.
+
+        :returns: A dictionary with backend names as keys and dictionaries as
+                  values. The nested dictionaries have operation names as keys
+                  and dictionaries with the keys ``outcomes`` (a dictionary of
+                  counters), ``bytes`` (an integer), ``seconds`` (the total
+                  duration) and ``hit_rate`` (only for ``get`` operations) as
+                  values. This is intended to be serialized to JSON.
+        """
+        summary = {}
+        with self.lock:
+            for (name, operation, outcome), count in self.operations.items():
+                details = summary.setdefault(name, {}).setdefault(operation, dict(outcomes={}, bytes=0, seconds=0.0))
+                details['outcomes'][outcome] = count
+            for (name, operation), num_bytes in self.bytes.items():
+                summary[name][operation]['bytes'] = num_bytes
+            for (name, operation), histogram in self.durations.items():
+                summary[name][operation]['seconds'] = round(histogram['sum'], 3)
+        for operations in summary.values():
+            if 'get' in operations:
+                outcomes = operations['get']['outcomes']
+                lookups = outcomes.get('hit', 0) + outcomes.get('miss', 0)
+                if lookups:
+                    operations['get']['hit_rate'] = round(float(outcomes.get('hit', 0)) / lookups, 3)
+        return summary
+
+    def get_statistics(self):
+        """
+        Summarize the lookups and transfers per backend.
+
+        :returns: A dictionary with backend names as keys and dictionaries as
+                  values. The nested dictionaries contain the number of
+                  ``lookups`` (``get`` operations that missed or that didn't
+                  transfer any data yet, like streams, and the distribution
+                  archives looked up in bulk) and their total duration
+                  (``lookup_seconds``), the number of ``transfers`` (``get``
+                  operations that downloaded a distribution archive) and their
+                  total duration and size (``transfer_seconds`` and
+                  ``transfer_bytes``) and the number of distribution archives
+                  that were looked up in bulk and found in bulk
+                  (``candidates`` and ``found``).
+        """
+        statistics = {}
+
+        def get_entry(name):
+            return statistics.setdefault(name, dict(lookups=0, lookup_seconds=0.0,
+                                                    transfers=0, transfer_seconds=0.0, transfer_bytes=0,
+                                                    candidates=0, found=0))
+
+        with self.lock:
+            for (name, operation, outcome, transferred), (count, seconds, num_bytes) in self.totals.items():
+                if operation == 'get' and outcome == 'hit' and transferred:
+                    entry = get_entry(name)
+                    entry['transfers'] += count
+                    entry['transfer_seconds'] += seconds
+                    entry['transfer_bytes'] += num_bytes
+                elif operation == 'get' and outcome in ('hit', 'miss'):
+                    entry = get_entry(name)
+                    entry['lookups'] += count
+                    entry['lookup_seconds'] += seconds
+            for name, (num_lookups, num_found, seconds) in self.availability.items():
+                entry = get_entry(name)
+                entry['lookups'] += num_lookups
+                entry['lookup_seconds'] += seconds
+                entry['candidates'] += num_lookups
+                entry['found'] += num_found
+        return statistics
+
+    def render_prometheus(self):
+        """
+        Render the recorded metrics in the Prometheus text exposition format.
+
+        :returns: The rendered metrics (a string).
+        """
+        lines = []
+        with self.lock:
+            lines.append('# HELP pip_accel_cache_operations_total Cache backend operations by outcome.')
+            lines.append('# TYPE pip_accel_cache_operations_total counter')
+            for (name, operation, outcome), count in sorted(self.operations.items()):
+                lines.append('pip_accel_cache_operations_total{%s} %i' % (
+                    format_labels(backend=name, operation=operation, outcome=outcome), count))
+            lines.append('# HELP pip_accel_cache_bytes_total Bytes transferred by cache backend operations.')
+            lines.append('# TYPE pip_accel_cache_bytes_total counter')
+            for (name, operation), num_bytes in sorted(self.bytes.items()):
+                lines.append('pip_accel_cache_bytes_total{%s} %i' % (
+                    format_labels(backend=name, operation=operation), num_bytes))
+            lines.append('# HELP pip_accel_cache_operation_duration_seconds Duration of cache backend operations.')
+            lines.append('# TYPE pip_accel_cache_operation_duration_seconds histogram')
+            for (name, operation), histogram in sorted(self.durations.items()):
+                for upper_bound, count in zip(DURATION_BUCKETS, histogram['buckets']):
+                    lines.append('pip_accel_cache_operation_duration_seconds_bucket{%s} %i' % (
+                        format_labels(backend=name, operation=operation, le=str(upper_bound)), count))
+                labels = format_labels(backend=name, operation=operation)
+                lines.append('pip_accel_cache_operation_duration_seconds_bucket{%s,le="+Inf"} %i' % (
+                    labels, histogram['count']))
+                lines.append('pip_accel_cache_operation_duration_seconds_sum{%s} %f' % (labels, histogram['sum']))
+                lines.append('pip_accel_cache_operation_duration_seconds_count{%s} %i' % (labels, histogram['count']))
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, pathname):
+        """
+        Write the recorded metrics to a Prometheus textfile collector file.
+
+        :param pathname: The pathname of the file (a string). The file is
+                         replaced atomically so that the collector never reads
+                         a partially written file.
+        """
+        logger.debug("Writing cache metrics to %s ..", pathname)
+        makedirs(os.path.dirname(pathname))
+        with AtomicReplace(pathname) as temporary_file:
+            with open(temporary_file, 'w') as handle:
+                handle.write(self.render_prometheus())
+
+
+def format_labels(**labels):
+    """
+    Format Prometheus labels.
+
+    :param labels: The labels to format (keyword arguments with strings as
+                   values).
+    :returns: The formatted labels (a string like ``a="1",b="2"``).
+    """
+    return ','.join('%s="%s"' % (name, value.replace('\\', '\\\\').replace('"', '\\"'))
+                    for name, value in sorted(labels.items()))
+
+
+class BackendStatistics(object):
+
+    """
+    Persistent performance statistics of cache backends.
+
+    For each cache backend three numbers are tracked across runs of pip-accel
+    (as exponential moving averages, see :data:`SMOOTHING_FACTOR`) in the JSON
+    file :attr:`.Config.backend_statistics`:
+
+    - The average duration of a lookup (``latency``).
+    - The rate (in bytes per second) at which distribution archives are
+      downloaded (``transfer_rate``). This is kept separate from the latency
+      so that backends that happen to serve larger distribution archives
+      aren't penalized.
+    - The fraction of the distribution archives missing from the local cache
+      that the backend has (``availability``). This is measured by bulk
+      lookups in every remote backend (see
+      :func:`CacheMetrics.record_availability()`) instead of the hit rate of
+      ``get`` operations, because a backend that is consulted after another
+      backend only sees the misses of that backend (so its hit rate would
+      collapse and it would never move up again).
+
+    Based on these statistics :func:`order()` orders the remote backends so
+    that the remote backend with the lowest expected cost per distribution
+    archive is consulted first (see :func:`sort_key()`).
+
+    Local backends are always consulted first (in the order of their static
+    priority): They only see the misses of the backends consulted before
+    them, so once a remote backend with a high hit rate would be consulted
+    first the hit rate of the local backends would drop and they would never
+    move up again (while every local hit would pay for a network round trip
+    and :func:`.CacheManager.promote()` would stop filling the local cache).
+    """
+
+    def __init__(self, config):
+        """
+        Initialize a :class:`BackendStatistics` object.
+
+        :param config: The pip-accel configuration (a :class:`.Config`
+                       object).
+        """
+        self.config = config
+        self.backends = {}
+        try:
+            with open(config.backend_statistics) as handle:
+                self.backends = json.load(handle)
+        except (EnvironmentError, ValueError):
+            pass
+
+    def is_available(self, backends):
+        """
+        Check whether enough statistics are available to order the given backends.
+
+        :param backends: A list of :class:`.AbstractCacheBackend` objects.
+        :returns: :data:`True` when at least two of the backends have
+                  :data:`MIN_SAMPLES` samples, :data:`False` otherwise.
+        """
+        return sum(1 for b in backends if self.has_samples(b)) >= 2
+
+    def has_samples(self, backend):
+        """
+        Check whether enough statistics are available for the given backend.
+
+        :param backend: An :class:`.AbstractCacheBackend` object.
+        :returns: :data:`True` when the latency and availability of the
+                  backend are known and it has at least :data:`MIN_SAMPLES`
+                  samples, :data:`False` otherwise.
+        """
+        statistics = self.backends.get(repr(backend), {})
+        return ('latency' in statistics and 'availability' in statistics and
+                statistics.get('samples', 0) >= MIN_SAMPLES)
+
+    def order(self, backends):
+        """
+        Order cache backends by their measured performance.
+
+        :param backends: A list of :class:`.AbstractCacheBackend` objects
+                         (sorted by their static priority).
+        :returns: A new list with the local backends (in their original order)
+                  followed by the remote backends (see
+                  :attr:`.AbstractCacheBackend.REMOTE`), which are ordered
+                  using :func:`sort_key()` when at least two of them have
+                  enough statistics.
+        """
+        local_backends = [b for b in backends if not b.REMOTE]
+        remote_backends = [b for b in backends if b.REMOTE]
+        if self.is_available(remote_backends):
+            # Backends that haven't downloaded anything yet (e.g. because
+            # another backend was consulted before them) are assumed to be
+            # as fast as the fastest known backend, so they get a chance.
+            known_rates = [self.backends[repr(b)].get('transfer_rate') for b in remote_backends if self.has_samples(b)]
+            default_rate = max([r for r in known_rates if r] or [None])
+            remote_backends.sort(key=lambda b: self.sort_key(b, default_rate))
+        return local_backends + remote_backends
+
+    def sort_key(self, backend, default_rate=None):
+        """
+        Get the sort key of a cache backend.
+
+        :param backend: An :class:`.AbstractCacheBackend` object.
+        :param default_rate: The transfer rate to assume when the transfer
+                             rate of the backend is unknown (a number or
+                             :data:`None`).
+        :returns: A tuple with the expected cost per distribution archive (in
+                  seconds) and the static priority of the backend. The
+                  expected cost is the time needed to look up and download a
+                  distribution archive of :data:`TRANSFER_SIZE` bytes divided
+                  by the availability. Backends without enough statistics are
+                  sorted after the other backends.
+        """
+        if not self.has_samples(backend):
+            return (float('inf'), backend.PRIORITY)
+        statistics = self.backends[repr(backend)]
+        transfer_rate = statistics.get('transfer_rate') or default_rate
+        transfer_time = float(TRANSFER_SIZE) / transfer_rate if transfer_rate else 0
+        expected_cost = (statistics['latency'] + transfer_time) / max(statistics['availability'], 0.01)
+        return (expected_cost, backend.PRIORITY)
+
+    def update(self, metrics):
+        """
+        Update the statistics with the metrics of the current run and save them.
+
+        :param metrics: A :class:`CacheMetrics` object.
+        """
+        run_statistics = metrics.get_statistics()
+        if not run_statistics:
+            return
+        for name, run in run_statistics.items():
+            statistics = dict(self.backends.get(name, {}))
+            # Statistics saved by older versions of pip-accel are based on
+            # biased hit rates, so they're discarded.
+            statistics.pop('hit_rate', None)
+            if run['lookups']:
+                statistics['latency'] = smooth(statistics.get('latency'), run['lookup_seconds'] / run['lookups'])
+            if run['transfer_bytes'] and run['transfer_seconds']:
+                statistics['transfer_rate'] = smooth(statistics.get('transfer_rate'),
+                                                     run['transfer_bytes'] / run['transfer_seconds'])
+            if run['candidates']:
+                statistics['availability'] = smooth(statistics.get('availability'),
+                                                    float(run['found']) / run['candidates'])
+            statistics['samples'] = statistics.get('samples', 0) + run['lookups'] + run['transfers']
+            self.backends[name] = statistics
+        logger.debug("Saving cache backend statistics to %s ..", self.config.backend_statistics)
+        makedirs(os.path.dirname(self.config.backend_statistics))
+        with AtomicReplace(self.config.backend_statistics) as temporary_file:
+            with open(temporary_file, 'w') as handle:
+                json.dump(self.backends, handle, indent=2, sort_keys=True)
+
+
+def smooth(average, value):
+    """
+    Update an exponential moving average.
+
+    :param average: The previous average (a number or :data:`None`).
+    :param value: The new value (a number).
+    :returns: The new average (a number).
+    """
+    if average is None:
+        return value
+    return (1 - SMOOTHING_FACTOR) * average + SMOOTHING_FACTOR * value
@@ -0,0 +1,303 @@
+# Accelerator for pip, the Python package manager.
+#
+# Author: Peter Odding <peter.odding@paylogic.com>
+# Last Change: October 31, 2015
+# URL: https://github.com/paylogic/pip-accel
+
+"""
+Mirroring of the source index into the cache backends.
+
+By default the cache backends only store binary distribution archives, so a
+new host with an empty source index (see :attr:`~.Config.source_index`) has
+to download every source distribution archive from PyPI even though another
+host downloaded the same archives yesterday. When the configuration option
+:attr:`~.Config.source_mirroring` is enabled the :class:`SourceMirror` defined
+in this module uses the cache backends as a mirror of the source index:
+
+- After pip has downloaded missing archives (see
+  :func:`~pip_accel.PipAccelerator.download_source_dists()`) the newly
+  downloaded archives are stored in the cache backends under the ``sources/``
+  directory (see :func:`SourceMirror.upload()`).
+
+- When pip can't find a requirement in the local source index (see
+  :func:`~pip_accel.PipAccelerator.unpack_source_dists()`) the archives of
+  the project that match the version specifier of the requirement are fetched
+  from the cache backends and pip is asked to try again before pip-accel falls
+  back to PyPI (see :func:`SourceMirror.fetch()`).
+
+Because cache backends can't list their contents the archives of each project
+are recorded in a small JSON manifest (``sources/index/<project>.json``).
+Manifests are merged (the archives listed in the manifests of all cache
+backends are considered) and a manifest is only rewritten when new archives
+are mirrored, so concurrent uploads by multiple hosts can at worst cause an
+archive to be downloaded from PyPI once more. The manifests of all projects
+involved in an upload are fetched at once (see
+:func:`SourceMirror.get_manifests()`).
+"""
+
+# Standard library modules.
+import io
+import json
+import logging
+import os
+import shutil
+
+# Modules included in our package.
+from pip_accel.caches import SOURCE_FILENAME_PATTERN, SOURCE_MANIFEST_PATTERN, is_temporary_download, overrides
+from pip_accel.utils import AtomicReplace, run_concurrently
+
+# External dependencies.
+from humanfriendly import Timer, pluralize
+from pip._vendor.pkg_resources import safe_name
+from pip.index import egg_info_matches
+from pip.utils import SUPPORTED_EXTENSIONS, splitext
+from pip.wheel import InvalidWheelFilename, Wheel, wheel_ext
+
+# Initialize a logger for this module.
+logger = logging.getLogger(__name__)
+
+
+class SourceMirror(object):
+
+    """Mirror of the local source index in the cache backends."""
+
+    def __init__(self, config, cache):
+        """
+        Initialize a :class:`SourceMirror` object.
+
+        :param config: The pip-accel configuration (a :class:`.Config`
+                       object).
+        :param cache: The :class:`.CacheManager` whose cache backends are used
+                      as the mirror.
+        """
+        self.config = config
+        self.cache = cache
+        self.fetched_archives = set()
+        self.manifests = {}
+
+    @property
+    def enabled(self):
+        """:data:`True` if :attr:`.Config.source_mirroring` is enabled, :data:`False` otherwise."""
+        return self.config.source_mirroring
+
+    def fetch(self, project_name, requirement=None):
+        """
+        Fetch the mirrored archives of a project into the source index.
+
+        :param project_name: The name of the project (a string).
+        :param requirement: The :class:`pip.req.InstallRequirement` object
+                            that pip is looking for (optional). When given
+                            only the archives whose version matches the
+                            version specifier of the requirement are fetched.
+        :returns: The number of archives added to the source index (an
+                  integer).
+
+        The manifest of each project is fetched at most once per run.
+        Archives whose version can't be parsed from their filename are always
+        fetched (see :func:`matches_requirement()`).
+        """
+        if not self.enabled:
+            return 0
+        key = canonical_name(project_name)
+        if key not in self.manifests:
+            self.manifests[key] = self.get_manifest(key)
+        timer = Timer()
+        missing = [fn for fn in sorted(self.manifests[key])
+                   if matches_requirement(fn, key, requirement)
+                   and not os.path.isfile(os.path.join(self.config.source_index, fn))]
+        num_fetched = 0
+        for filename in missing:
+            pathname = self.cache.get_file(SOURCE_FILENAME_PATTERN % filename)
+            if pathname:
+                logger.debug("Copying mirrored source archive to source index: %s", filename)
+                with AtomicReplace(os.path.join(self.config.source_index, filename)) as temporary_file:
+                    shutil.copy(pathname, temporary_file)
+                self.fetched_archives.add(filename)
+                num_fetched += 1
+        if num_fetched:
+            logger.info("Fetched %s of %s from mirror in %s.",
+                        pluralize(num_fetched, "source archive"), project_name, timer)
+        return num_fetched
+
+    def upload(self, requirements, available_archives=None):
+        """
+        Store the newly downloaded archives of the given requirements in the cache backends.
+
+        :param requirements: A list of :class:`.Requirement` objects.
+        :param available_archives: A set with the filenames of the archives
+                                   that were in the source index before pip
+                                   was run (optional).
+
+        Archives listed in `available_archives`, archives fetched from the
+        mirror and archives that are already listed in the manifest of their
+        project aren't uploaded (again).
+        """
+        if not self.enabled:
+            return
+        timer = Timer()
+        existing_archives = set(available_archives or []) | self.fetched_archives
+        candidates = {}
+        for requirement in requirements:
+            if requirement.is_editable:
+                continue
+            filenames = set(os.path.basename(pathname) for pathname in get_archives(requirement))
+            filenames -= existing_archives
+            if filenames:
+                candidates.setdefault(canonical_name(requirement.name), set()).update(filenames)
+        if not candidates:
+            return
+        manifests = self.get_manifests(sorted(candidates))
+        num_uploaded = 0
+        for key in sorted(candidates):
+            manifest = manifests[key]
+            new_filenames = candidates[key] - manifest
+            if not new_filenames:
+                continue
+            # The archives and the updated manifest of each project are
+            # stored in a single call (the manifest comes last).
+            archives = []
+            try:
+                for filename in sorted(new_filenames):
+                    logger.debug("Mirroring source archive: %s", filename)
+                    handle = open(os.path.join(self.config.source_index, filename), 'rb')
+                    archives.append((SOURCE_FILENAME_PATTERN % filename, handle))
+                contents = json.dumps(sorted(manifest | new_filenames)).encode('utf-8')
+                archives.append((SOURCE_MANIFEST_PATTERN % key, io.BytesIO(contents)))
+                self.cache.put_many(archives)
+            finally:
+                for filename, handle in archives:
+                    handle.close()
+            num_uploaded += len(new_filenames)
+        if num_uploaded:
+            logger.info("Mirrored %s in %s.", pluralize(num_uploaded, "source archive"), timer)
+
+    def get_manifest(self, key):
+        """
+        Get the filenames of the mirrored archives of a project.
+
+        :param key: The canonical name of the project (a string).
+        :returns: A set of filenames (strings).
+
+        Refer to :func:`get_manifests()` for details.
+        """
+        return self.get_manifests([key])[key]
+
+    def get_manifests(self, keys):
+        """
+        Get the filenames of the mirrored archives of multiple projects.
+
+        :param keys: A list with the canonical names of projects (strings).
+        :returns: A dictionary that maps each of the given names to a set of
+                  filenames (strings).
+
+        The manifests in all cache backends are merged. Backends that
+        implement batch downloads (see
+        :func:`.AbstractCacheBackend.get_many()`) are asked for all manifests
+        at once, other backends are asked for each manifest concurrently (see
+        :attr:`.Config.prefetch_threads`). Manifests can change at any time so
+        they bypass the negative cache and aren't promoted (unlike
+        distribution archives, see :func:`.CacheManager.get_file()`).
+        Manifests downloaded from remote cache backends are removed after
+        they've been read (see
+        :func:`.AbstractCacheBackend.get_download_pathname()`).
+        """
+        manifests = dict((key, set()) for key in keys)
+        manifest_filenames = dict((SOURCE_MANIFEST_PATTERN % key, key) for key in keys)
+        tasks = []
+        for backend in list(self.cache.backends):
+            if overrides(backend, 'get_many'):
+                tasks.append((backend, sorted(manifest_filenames)))
+            else:
+                tasks.extend((backend, [fn]) for fn in sorted(manifest_filenames))
+
+        def fetch_manifests(task):
+            backend, filenames = task
+            success, found = self.cache.call_backend(backend, 'get', lambda: backend.get_many(filenames))
+            return found or {}
+
+        num_threads = max(1, min(self.config.prefetch_threads, len(tasks)))
+        for (backend, filenames), found, exception in run_concurrently(fetch_manifests, tasks, num_threads):
+            for manifest_filename, pathname in sorted((found or {}).items()):
+                try:
+                    with open(pathname) as handle:
+                        manifests[manifest_filenames[manifest_filename]].update(
+                            fn for fn in json.load(handle) if is_safe_filename(fn))
+                except (AttributeError, EnvironmentError, KeyError, TypeError, ValueError):
+                    logger.warning("Ignoring invalid source mirror manifest in %s: %s", backend, manifest_filename)
+                if is_temporary_download(pathname):
+                    os.unlink(pathname)
+        return manifests
+
+
+def canonical_name(project_name):
+    """
+    Normalize the name of a project the same way pip does.
+
+    :param project_name: The name of the project (a string).
+    :returns: The normalized name (a string).
+    """
+    return safe_name(project_name).lower()
+
+
+def matches_requirement(filename, project_name, requirement=None):
+    """
+    Check whether the version of a source archive matches a requirement.
+
+    :param filename: The filename of the archive (a string).
+    :param project_name: The canonical name of the project (a string).
+    :param requirement: A :class:`pip.req.InstallRequirement` object (or
+                        :data:`None`).
+    :returns: :data:`False` if the version parsed from the filename doesn't
+              match the version specifier of the requirement, :data:`True`
+              otherwise (also when the version can't be parsed).
+    """
+    specifier = getattr(getattr(requirement, 'req', None), 'specifier', None)
+    if not specifier:
+        return True
+    version = parse_archive_version(filename, project_name)
+    if version is None:
+        return True
+    return specifier.contains(version, prereleases=True)
+
+
+def parse_archive_version(filename, project_name):
+    """
+    Parse the version of a project from the filename of an archive the same way pip does.
+
+    :param filename: The filename of the archive (a string).
+    :param project_name: The canonical name of the project (a string).
+    :returns: The version (a string) or :data:`None` when the filename can't
+              be parsed.
+    """
+    base, extension = splitext(filename)
+    if extension == wheel_ext:
+        try:
+            return Wheel(filename).version
+        except InvalidWheelFilename:
+            return None
+    if extension.lower() in SUPPORTED_EXTENSIONS:
+        return egg_info_matches(base, project_name, filename)
+    return None
+
+
+def get_archives(requirement):
+    """
+    Find the archives of a requirement in the source index.
+
+    :param requirement: A :class:`.Requirement` object.
+    :returns: A list of pathnames (strings).
+    """
+    if requirement.is_wheel:
+        return [requirement.wheel_archive] if requirement.wheel_archive else []
+    return requirement.related_archives
+
+
+def is_safe_filename(filename):
+    """
+    Check whether a filename from a manifest can be used in the source index.
+
+    :param filename: The filename (a string).
+    :returns: :data:`True` if the filename is a plain filename, :data:`False`
+              otherwise (e.g. when it contains a directory separator).
+    """
+    return bool(filename) and filename == os.path.basename(filename) and filename not in ('.', '..')
@@ -176,6 +176,27 @@ class Requirement(object):
                 like a wheel distribution, I'm confused!
             """, **variables)
 
+    @cached_property
+    def wheel_archive(self):
+        """
+        The pathname of the downloaded wheel distribution archive (a string or :data:`None`).
+
+        Wheel distribution archives downloaded by pip are stored in the local
+        source index (:attr:`.Config.source_index`). This property is
+        :data:`None` for source distributions and when the wheel distribution
+        archive can't be found.
+        """
+        if self.is_wheel:
+            link = self.pip_requirement.link
+            if link and link.filename.endswith('.whl'):
+                pathname = os.path.join(self.config.source_index, link.filename)
+                if os.path.isfile(pathname):
+                    return pathname
+            pattern = re.compile('^%s-%s-.+\\.whl$' % (escape_name(self.name), re.escape(self.version)), re.IGNORECASE)
+            matches = sorted(fn for fn in os.listdir(self.config.source_index) if pattern.match(fn))
+            if len(matches) == 1:
+                return os.path.join(self.config.source_index, matches[0])
+
     @cached_property
     def is_transitive(self):
         """
@@ -0,0 +1,269 @@
+# Accelerator for pip, the Python package manager.
+#
+# Author: Peter Odding <peter.odding@paylogic.com>
+# Last Change: October 31, 2015
+# URL: https://github.com/paylogic/pip-accel
+
+"""
+Serve the local binary cache to other hosts.
+
+The command ``pip-accel serve-cache`` starts a web server that exposes the
+local binary cache (see :attr:`~.Config.binary_cache`) to other hosts, which
+turns any host with a warm binary cache into a cache for the other hosts on
+the same network. The web server serves the directory layout of the
+:class:`~pip_accel.caches.local.LocalCacheBackend` as is, so other hosts can
+use it by pointing the HTTP cache backend at it (see
+:mod:`pip_accel.caches.http`):
+
+.. code-block:: sh
+
+   # On the host with the warm binary cache:
+   $ pip-accel serve-cache --port=8080
+
+   # On the other hosts:
+   $ export PIP_ACCEL_HTTP_URL=http://build-server:8080/
+   $ pip-accel install -r requirements.txt
+
+The web server handles each request in a separate thread, supports
+persistent (keep-alive) connections, byte range requests and conditional
+requests (using the ``ETag`` and ``Last-Modified`` headers). When the
+``--sources`` option is given the source index (see
+:attr:`~.Config.source_index`) is served below the ``/sources/`` path as well,
+which matches the layout used by :mod:`pip_accel.mirror` (so hosts using the
+HTTP cache backend can fetch source archives from the web server).
+Directory listings are not supported and the temporary files created while
+distribution archives are being written are never served.
+"""
+
+# Standard library modules.
+import email.utils
+import logging
+import os
+
+# Modules included in our package.
+from pip_accel import __version__
+from pip_accel.caches.local import EVICTION_INDEX_FILE, EVICTION_LOCK_FILE
+from pip_accel.compat import BaseHTTPRequestHandler, HTTPServer, ThreadingMixIn, unquote, urlparse
+
+# Initialize a logger for this module.
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 8080
+"""The port number that :class:`CacheServer` listens on by default (an integer)."""
+
+SOURCES_PREFIX = 'sources'
+"""The first path component of URLs that refer to the source index (a string)."""
+
+CHUNK_SIZE = 1024 * 64
+"""The number of bytes sent to the client at a time (an integer)."""
+
+
+class CacheServer(ThreadingMixIn, HTTPServer):
+
+    """Multi threaded web server that serves the local binary cache."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, config, address=('', DEFAULT_PORT), include_sources=False):
+        """
+        Initialize a :class:`CacheServer` object.
+
+        :param config: The pip-accel configuration (a :class:`.Config`
+                       object).
+        :param address: A tuple with two values: The host name or IP address
+                        to listen on (a string, the empty string means all
+                        interfaces) and the port number (an integer).
+        :param include_sources: :data:`True` to serve the source index as
+                                well, :data:`False` otherwise.
+        """
+        self.config = config
+        self.include_sources = include_sources
+        HTTPServer.__init__(self, address, CacheRequestHandler)
+
+    @property
+    def url(self):
+        """The base URL of the binary cache served by the web server (a string)."""
+        host, port = self.server_address[:2]
+        return 'http://%s:%i/' % (host if host not in ('', '0.0.0.0') else 'localhost', port)
+
+    def find_file(self, path):
+        """
+        Map the path of a request to a file.
+
+        :param path: The path of the request (a string).
+        :returns: The absolute pathname of an existing file (a string) or
+                  :data:`None` when the path doesn't refer to a file that may
+                  be served.
+        """
+        components = [c for c in unquote(urlparse(path).path).split('/') if c and c not in ('.', '..')]
+        # Don't serve temporary files created by AtomicReplace and TeeReader.
+        if not components or any('.tmp-' in c or os.sep in c for c in components):
+            return None
+        # Don't serve the bookkeeping files of the local cache (see pip_accel.caches.local).
+        if len(components) == 1 and components[0].startswith((EVICTION_INDEX_FILE, EVICTION_LOCK_FILE)):
+            return None
+        candidates = []
+        if self.include_sources and components[0] == SOURCES_PREFIX and len(components) > 1:
+            candidates.append(os.path.join(self.config.source_index, *components[1:]))
+        # Source archives mirrored into the binary cache (see pip_accel.mirror)
+        # are served from the binary cache.
+        candidates.append(os.path.join(self.config.binary_cache, *components))
+        for pathname in candidates:
+            if os.path.isfile(pathname):
+                return pathname
+
+
+class CacheRequestHandler(BaseHTTPRequestHandler):
+
+    """Request handler for :class:`CacheServer`."""
+
+    protocol_version = 'HTTP/1.1'
+    server_version = 'pip-accel/%s' % __version__
+
+    def do_GET(self):
+        """Handle a ``GET`` request."""
+        self.respond(include_body=True)
+
+    def do_HEAD(self):
+        """Handle a ``HEAD`` request."""
+        self.respond(include_body=False)
+
+    def respond(self, include_body):
+        """
+        Respond to a ``GET`` or ``HEAD`` request.
+
+        :param include_body: :data:`True` to send the contents of the file,
+                             :data:`False` to send the headers only.
+        """
+        pathname = self.server.find_file(self.path)
+        if not pathname:
+            self.send_error(404, "Not Found")
+            return
+        try:
+            handle = open(pathname, 'rb')
+        except EnvironmentError:
+            self.send_error(404, "Not Found")
+            return
+        with handle:
+            stat = os.fstat(handle.fileno())
+            etag = '"%x-%x"' % (int(stat.st_mtime), stat.st_size)
+            last_modified = self.date_time_string(stat.st_mtime)
+            if self.is_not_modified(etag, stat.st_mtime):
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Last-Modified', last_modified)
+                self.end_headers()
+                return
+            try:
+                byte_range = parse_range(self.headers.get('Range'), stat.st_size)
+            except ValueError:
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */%i' % stat.st_size)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            if byte_range:
+                start, end = byte_range
+                self.send_response(206)
+                self.send_header('Content-Range', 'bytes %i-%i/%i' % (start, end, stat.st_size))
+            else:
+                start, end = 0, stat.st_size - 1
+                self.send_response(200)
+            length = end - start + 1
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(length))
+            self.send_header('Accept-Ranges', 'bytes')
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', last_modified)
+            self.end_headers()
+            if include_body:
+                handle.seek(start)
+                copy_bytes(handle, self.wfile, length)
+
+    def is_not_modified(self, etag, mtime):
+        """
+        Check whether the client's copy of a file is up to date.
+
+        :param etag: The current ``ETag`` of the file (a string).
+        :param mtime: The last modified time of the file (a number).
+        :returns: :data:`True` if a ``304 Not Modified`` response should be
+                  sent, :data:`False` otherwise.
+        """
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match:
+            return etag in [t.strip() for t in if_none_match.split(',')] or if_none_match.strip() == '*'
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since:
+            parsed = email.utils.parsedate_tz(if_modified_since)
+            if parsed is not None:
+                return int(mtime) <= email.utils.mktime_tz(parsed)
+        return False
+
+    def log_message(self, format, *args):
+        """Log requests using the :mod:`logging` module instead of writing to standard error."""
+        # Avoid address_string() because it performs a reverse DNS lookup.
+        logger.info("%s - %s", self.client_address[0], format % args)
+
+
+def parse_range(value, size):
+    """
+    Parse the value of a ``Range`` header.
+
+    :param value: The value of the header (a string or :data:`None`).
+    :param size: The size of the file in bytes (an integer).
+    :returns: A tuple with the offsets of the first and last byte to send (two
+              integers) or :data:`None` when the whole file should be sent (no
+              header or an unsupported header, for example multiple ranges).
+    :raises: :exc:`~exceptions.ValueError` when the range can't be satisfied.
+    """
+    if not value or not value.startswith('bytes=') or ',' in value:
+        return None
+    first, _, last = value[len('bytes='):].strip().partition('-')
+    try:
+        if not first:
+            # A suffix range (the last N bytes).
+            start, end = max(0, size - int(last)), size - 1
+        else:
+            start, end = int(first), min(int(last), size - 1) if last else size - 1
+    except ValueError:
+        return None
+    if start > end or start >= size:
+        raise ValueError("Unsatisfiable byte range!")
+    return start, end
+
+
+def copy_bytes(source, target, length):
+    """
+    Copy a number of bytes from one file-like object to another.
+
+    :param source: The file-like object to read from.
+    :param target: The file-like object to write to.
+    :param length: The number of bytes to copy (an integer).
+    """
+    while length > 0:
+        data = source.read(min(CHUNK_SIZE, length))
+        if not data:
+            break
+        target.write(data)
+        length -= len(data)
+
+
+def serve_cache(config, address=('', DEFAULT_PORT), include_sources=False):
+    """
+    Serve the local binary cache until interrupted.
+
+    :param config: The pip-accel configuration (a :class:`.Config` object).
+    :param address: Refer to :class:`CacheServer`.
+    :param include_sources: Refer to :class:`CacheServer`.
+    """
+    server = CacheServer(config, address, include_sources)
+    logger.info("Serving %s on %s ..", config.binary_cache, server.url)
+    if include_sources:
+        logger.info("Serving %s on %s%s/ ..", config.source_index, server.url, SOURCES_PREFIX)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Interrupted, shutting down ..")
+    finally:
+        server.server_close()
@@ -24,6 +24,8 @@ have to do so retroactively.
 
 # Standard library modules.
 import glob
+import io
+import json
 import logging
 import operator
 import os
@@ -35,8 +37,21 @@ import signal
 import stat
 import subprocess
 import sys
+import tarfile
 import tempfile
+import textwrap
+import threading
+import time
 import unittest
+from distutils.spawn import find_executable
+
+try:
+    # Python 3.
+    from http.server import HTTPServer, SimpleHTTPRequestHandler
+except ImportError:
+    # Python 2.
+    from BaseHTTPServer import HTTPServer
+    from SimpleHTTPServer import SimpleHTTPRequestHandler
 
 # External dependencies.
 import coloredlogs
@@ -44,16 +59,29 @@ from cached_property import cached_property
 from humanfriendly import coerce_boolean, compact
 from pip.commands.install import InstallCommand
 from pip.exceptions import DistributionNotFound
+from pip.req import InstallRequirement
 
 # Modules included in our package.
+import pip_accel.caches
+import pip_accel.caches.s3
+import pip_accel.workers
 from pip_accel import PatchedAttribute, PipAccelerator
+from pip_accel.bdist import BuildTree
+from pip_accel.caches import (SOURCE_FILENAME_PATTERN, SOURCE_MANIFEST_PATTERN, AbstractCacheBackend,
+                              NegativeCache, get_download_directory, is_temporary_download, registered_backends)
+from pip_accel.caches.http import HTTPCacheBackend
+from pip_accel.caches.s3 import S3CacheBackend, split_parts
+from pip_accel.caches.sqlite import SQLiteCacheBackend
 from pip_accel.cli import main
 from pip_accel.compat import WINDOWS, StringIO
 from pip_accel.config import Config
 from pip_accel.deps import DependencyInstallationRefused, SystemPackageManager
-from pip_accel.exceptions import EnvironmentMismatchError
+from pip_accel.exceptions import BuildFailed, BuildTimeout, EnvironmentMismatchError
+from pip_accel.metrics import MIN_SAMPLES, BackendStatistics
 from pip_accel.req import escape_name
-from pip_accel.utils import find_installed_version, uninstall
+from pip_accel.server import CacheServer, parse_range
+from pip_accel.uploads import UploadQueue
+from pip_accel.utils import TeeReader, find_installed_version, uninstall
 
 # Initialize a logger for this module.
 logger = logging.getLogger(__name__)
@@ -332,7 +360,8 @@ class PipAccelTestCase(unittest.TestCase):
 
                      1. **First the FakeS3 root directory is made read only**
                         to force an error when uploading to S3. This is to test
-                        the automatic fall back to a read only S3 bucket.
+                        that failing uploads are reported to the cache manager
+                        (so they're retried and the backend is skipped).
 
                      2. **Then FakeS3 is terminated** to force a failure in the
                         S3 cache backend. This verifies that pip-accel handles
@@ -370,12 +399,730 @@ class PipAccelTestCase(unittest.TestCase):
             # if the S3 backend is active (this is why we first check the
             # $PIP_ACCEL_S3_BUCKET environment variable).
             if os.environ.get('PIP_ACCEL_S3_BUCKET'):
-                if i < 3:
-                    assert not accelerator.config.s3_cache_readonly, \
-                        "S3 cache backend is unexpectedly in read only state!"
-                else:
-                    assert accelerator.config.s3_cache_readonly, \
-                        "S3 cache backend is unexpectedly not in read only state!"
+                assert not accelerator.config.s3_cache_readonly, \
+                    "S3 cache backend unexpectedly switched to read only mode!"
+                if i >= 3:
+                    outcomes = accelerator.bdists.cache.metrics.summary()['S3CacheBackend']['put']['outcomes']
+                    assert outcomes.get('error'), "S3 cache backend didn't report the failing upload!"
+
+    def test_cache_planning(self):
+        """
+        Verify the bulk lookups performed by :func:`~pip_accel.caches.CacheManager.plan()`.
+
+        This checks the bulk lookups of the local cache backend and (if the
+        environment variable ``$PIP_ACCEL_S3_BUCKET`` is set) those of the
+        Amazon S3 cache backend.
+        """
+        accelerator = self.initialize_pip_accel(load_environment_variables=True)
+        cache = accelerator.bdists.cache
+        cache.put_file('v0/cached:1.0:test.tar.gz', io.BytesIO(b'dummy'))
+        available = cache.plan(['v0/cached:1.0:test.tar.gz', 'v0/missing:1.0:test.tar.gz'])
+        assert list(available.keys()) == ['v0/cached:1.0:test.tar.gz'], \
+            "Bulk lookup reported unexpected distribution archives!"
+        assert repr(available['v0/cached:1.0:test.tar.gz']) == 'LocalCacheBackend', \
+            "Expected the local cache backend to have priority!"
+        if os.environ.get('PIP_ACCEL_S3_BUCKET'):
+            s3_backend = [b for b in cache.backends if repr(b) == 'S3CacheBackend'][0]
+            assert s3_backend.exists_many(['v0/cached:1.0:test.tar.gz', 'v0/missing:1.0:test.tar.gz']) == \
+                set(['v0/cached:1.0:test.tar.gz']), "Amazon S3 bulk lookup reported unexpected archives!"
+            assert s3_backend.get('v0/missing:1.0:test.tar.gz') is None
+            assert s3_backend.get('v0/cached:1.0:test.tar.gz') is not None
+
+    def test_s3_bulk_lookups(self):
+        """Verify that :func:`~pip_accel.caches.s3.S3CacheBackend.exists_many()` lists each directory separately."""
+        if not is_boto_installed():
+            return self.skipTest("Skipping S3 bulk lookup test because Boto isn't installed.")
+        accelerator = self.initialize_pip_accel()
+        backend = FakeS3Backend(accelerator.config)
+        bucket = backend.bucket
+        for name in ('v7/a:1.0:py2.7.tar.gz', 'v7/z:1.0:py2.7.tar.gz', 'v7/wheels/w-1.0-py2-none-any.whl'):
+            bucket.contents[name] = b'archive'
+        for i in range(10):
+            bucket.contents['v7/m%i:1.0:py3.4.tar.gz' % i] = b'other'
+            bucket.contents['v7/wheels/other-%i.whl' % i] = b'other'
+        filenames = ['v7/a:1.0:py2.7.tar.gz', 'v7/b:1.0:py2.7.tar.gz', 'v7/z:1.0:py2.7.tar.gz',
+                     'v7/wheels/w-1.0-py2-none-any.whl']
+        assert backend.exists_many(filenames) == set(['v7/a:1.0:py2.7.tar.gz', 'v7/z:1.0:py2.7.tar.gz',
+                                                      'v7/wheels/w-1.0-py2-none-any.whl'])
+        assert ('list', 'v7/') in bucket.requests
+        assert ('list', 'v7/wheels/w-1.0-py2-none-any.whl') in bucket.requests
+        assert not any(n.startswith('v7/wheels/other') for n in bucket.listed), \
+            "Listing of archives descended into the wheels directory!"
+        assert not any(r[0] == 'head' for r in bucket.requests), "Unexpected HEAD requests!"
+        # Listings that are larger than the key set fall back to HEAD requests.
+        bucket.requests = []
+        with PatchedAttribute(pip_accel.caches.s3, 'LIST_PAGE_SIZE', 1):
+            assert backend.exists_many(filenames[:3]) == set(['v7/a:1.0:py2.7.tar.gz', 'v7/z:1.0:py2.7.tar.gz'])
+        assert ('head', 'v7/z:1.0:py2.7.tar.gz') in bucket.requests, "Expected fall back to HEAD requests!"
+        assert backend.known_keys['v7/b:1.0:py2.7.tar.gz'] is False
+
+    def test_cache_prefetching(self):
+        """Verify that :func:`~pip_accel.caches.CacheManager.prefetch()` downloads archives concurrently."""
+        accelerator = self.initialize_pip_accel(prefetch_threads=4)
+        cache = accelerator.bdists.cache
+        backend = DummyRemoteBackend(accelerator.config)
+        filenames = ['v0/remote-%i:1.0:test.tar.gz' % i for i in range(8)]
+        timer = time.time()
+        cache.prefetch(dict((fn, backend) for fn in filenames))
+        assert time.time() - timer < 1.5, "Prefetching didn't run concurrently!"
+        for filename in filenames:
+            assert os.path.isfile(os.path.join(accelerator.config.binary_cache, filename))
+            assert cache.get_file(filename) == os.path.join(accelerator.config.binary_cache, filename)
+        assert len(backend.threads) > 1, "Prefetching didn't use multiple threads!"
+
+    def test_batch_operations(self):
+        """Verify that backends can implement batch operations."""
+        accelerator = self.initialize_pip_accel()
+        cache = accelerator.bdists.cache
+        # The default implementations are sequential.
+        backend = DummyRemoteBackend(accelerator.config)
+        backend.put_many([('v0/a:1.0:test.tar.gz', io.BytesIO(b'a')), ('v0/b:1.0:test.tar.gz', io.BytesIO(b'b'))])
+        assert backend.uploads == {'v0/a:1.0:test.tar.gz': b'a', 'v0/b:1.0:test.tar.gz': b'b'}
+        assert sorted(backend.get_many(['v0/a:1.0:test.tar.gz'])) == ['v0/a:1.0:test.tar.gz']
+        # Backends that implement get_many() are asked for all archives at once.
+        backend = BatchBackend(accelerator.config)
+        filenames = ['v0/batch-%i:1.0:test.tar.gz' % i for i in range(4)] + ['v0/missing:1.0:test.tar.gz']
+        cache.prefetch(dict((fn, backend) for fn in filenames))
+        assert backend.batches == [sorted(filenames)]
+        assert sorted(cache.prefetched) == filenames[:4]
+        assert cache.metrics.summary()['BatchBackend']['get']['outcomes'] == dict(hit=4, miss=1)
+        # The cache manager stores (and promotes) multiple archives in a single call.
+        cache.put_many([(fn, io.BytesIO(b'batch')) for fn in filenames[:2]], [backend])
+        source = MirrorBackend(accelerator.config)
+        cache.backends = [backend, source]
+        cache.promote_many(dict((fn, source.get(fn)) for fn in filenames[2:4]), source, [backend])
+        assert backend.put_batches == [filenames[:2], filenames[2:4]]
+        assert sorted(backend.uploads) == filenames[:4]
+        assert cache.metrics.summary()['BatchBackend']['promote']['outcomes'] == dict(ok=2)
+        # Test doubles aren't registered (CacheManager shouldn't instantiate them).
+        assert not registered_backends & set([BatchBackend, DummyRemoteBackend, FakeS3Backend])
+
+    def test_background_uploads(self):
+        """Verify that uploads to remote cache backends can be performed in the background."""
+        accelerator = self.initialize_pip_accel(background_uploads=True)
+        cache = accelerator.bdists.cache
+        backend = DummyRemoteBackend(accelerator.config)
+        cache.backends.append(backend)
+        timer = time.time()
+        cache.put_file('v0/upload:1.0:test.tar.gz', io.BytesIO(b'upload'))
+        assert time.time() - timer < 0.5, "Upload wasn't performed in the background!"
+        assert cache.get_file('v0/upload:1.0:test.tar.gz'), "Local cache wasn't updated synchronously!"
+        spool_file = os.path.join(accelerator.config.upload_spool, 'DummyRemoteBackend', 'v0/upload:1.0:test.tar.gz')
+        assert os.path.isfile(spool_file), "Upload wasn't spooled!"
+        assert cache.wait_for_uploads(), "Background upload didn't finish!"
+        assert backend.uploads == {'v0/upload:1.0:test.tar.gz': b'upload'}
+        assert not os.path.exists(spool_file), "Spool file wasn't removed after upload!"
+        # Simulate an upload that was interrupted by a previous run.
+        with open(spool_file, 'wb') as handle:
+            handle.write(b'resumed')
+        uploads = UploadQueue(accelerator.config)
+        uploads.resume([backend])
+        assert not uploads.join(0), "Expected background upload to still be busy!"
+        assert uploads.join(10), "Resumed background upload didn't finish!"
+        assert backend.uploads['v0/upload:1.0:test.tar.gz'] == b'resumed'
+
+    def test_background_upload_failures(self):
+        """Verify that background uploads that fail stay in the spool directory."""
+        if not is_boto_installed():
+            return self.skipTest("Skipping background upload failure test because Boto isn't installed.")
+        accelerator = self.initialize_pip_accel(background_uploads=True, s3_cache_multipart_threshold=0)
+        cache = accelerator.bdists.cache
+        backend = FakeS3Backend(accelerator.config)
+        cache.backends.append(backend)
+        filenames = ['v0/failed-%i:1.0:test.tar.gz' % i for i in range(2)]
+        for filename in filenames:
+            cache.put_file(filename, io.BytesIO(b'failed'))
+        assert cache.wait_for_uploads(), "Background uploads didn't finish!"
+        assert [r for r in backend.bucket.requests if r[0] == 'upload'] == [('upload', filenames[0])], \
+            "Expected the remaining uploads to be skipped after the first failure!"
+        for filename in filenames:
+            assert os.path.isfile(os.path.join(accelerator.config.upload_spool, 'FakeS3Backend', filename)), \
+                "Failed upload was removed from the spool directory!"
+        assert cache.metrics.summary()['FakeS3Backend']['put']['outcomes'] == dict(error=1)
+
+    def test_s3_upload_failures(self):
+        """Verify that only uploads that are denied access switch the S3 cache backend to read only mode."""
+        if not is_boto_installed():
+            return self.skipTest("Skipping S3 upload failure test because Boto isn't installed.")
+        from boto.exception import S3ResponseError
+        accelerator = self.initialize_pip_accel(s3_cache_multipart_threshold=0, cache_retries=1)
+        cache = accelerator.bdists.cache
+        backend = FakeS3Backend(accelerator.config)
+        # Transient failures are retried and reported to the cache manager.
+        with PatchedAttribute(pip_accel.caches, 'RETRY_DELAY', 0.01):
+            success, result = cache.call_backend(backend, 'put', lambda: backend.put('v0/transient:1.0:test.tar.gz',
+                                                                                     io.BytesIO(b'transient')))
+        assert not success, "Expected the failing upload to be reported!"
+        assert len([r for r in backend.bucket.requests if r[0] == 'upload']) == 2, "Expected the upload to be retried!"
+        assert not accelerator.config.s3_cache_readonly, "Transient failure switched to read only mode!"
+        assert cache.metrics.summary()['FakeS3Backend']['put']['outcomes'] == dict(error=2)
+        # Uploads that are denied access switch the backend to read only mode.
+        backend.bucket.upload_error = S3ResponseError(403, 'Forbidden')
+        backend.put('v0/denied:1.0:test.tar.gz', io.BytesIO(b'denied'))
+        assert accelerator.config.s3_cache_readonly, "Access denied didn't switch to read only mode!"
+        assert not backend.WRITABLE
+
+    def test_streaming_installs(self):
+        """Verify that binary distributions can be extracted from (non-seekable) streams."""
+        accelerator = self.initialize_pip_accel(streaming_installs=True)
+        buffer = io.BytesIO()
+        archive = tarfile.open(fileobj=buffer, mode='w:gz')
+        try:
+            for name in ('lib/streamed/__init__.py', 'lib/streamed/module.py'):
+                member = tarfile.TarInfo(name)
+                member.size = len(name)
+                archive.addfile(member, io.BytesIO(name.encode('ascii')))
+        finally:
+            archive.close()
+        contents = buffer.getvalue()
+        cache_file = os.path.join(accelerator.config.binary_cache, 'v0/streamed:1.0:test.tar.gz')
+        stream = TeeReader(NonSeekableStream(contents), cache_file)
+        members = [(m.name, h.read()) for m, h in accelerator.bdists.extract_stream(stream)]
+        assert members == [('lib/streamed/__init__.py', b'lib/streamed/__init__.py'),
+                           ('lib/streamed/module.py', b'lib/streamed/module.py')]
+        with open(cache_file, 'rb') as handle:
+            assert handle.read() == contents, "Stream wasn't copied to the local cache!"
+        # Interrupted streams don't leave partial files behind.
+        partial_file = os.path.join(accelerator.config.binary_cache, 'v0/partial:1.0:test.tar.gz')
+        stream = TeeReader(NonSeekableStream(contents), partial_file)
+        stream.read(10)
+        stream.close()
+        assert os.listdir(os.path.dirname(partial_file)) == ['streamed:1.0:test.tar.gz'], \
+            "Interrupted stream left a (temporary) file behind!"
+
+    def test_local_cache_eviction(self):
+        """Verify that the least recently used archives are evicted from the local cache."""
+        accelerator = self.initialize_pip_accel(binary_cache_max_size=3000)
+        backend = [b for b in accelerator.bdists.cache.backends if repr(b) == 'LocalCacheBackend'][0]
+        # Manifests of mirrored source archives are never evicted.
+        manifest = os.path.join(accelerator.config.binary_cache, SOURCE_MANIFEST_PATTERN % 'evict')
+        os.makedirs(os.path.dirname(manifest))
+        with open(manifest, 'w') as handle:
+            handle.write('[]' + ' ' * 5000)
+        filenames = ['v0/evict-%i:1.0:test.tar.gz' % i for i in range(4)]
+        for filename in filenames[:3]:
+            backend.put(filename, io.BytesIO(b'x' * 1000))
+        assert backend.index.get_total_size() == 3000, "Manifest was included in the size of the local cache!"
+        # Pretend that the archives were used long ago by other processes,
+        # one of which is still running while the other one isn't.
+        finished_process = subprocess.Popen([sys.executable, '-c', 'pass'])
+        finished_process.wait()
+        long_ago = time.time() - 60 * 60
+        with backend.index.connection as connection:
+            connection.execute('delete from leases')
+            for i, filename in enumerate(filenames[:3]):
+                connection.execute('update archives set last_used = ? where filename = ?', (long_ago + i, filename))
+            connection.execute('insert into leases (filename, pid, created) values (?, ?, ?)',
+                               (filenames[0], os.getppid(), time.time()))
+            connection.execute('insert into leases (filename, pid, created) values (?, ?, ?)',
+                               (filenames[1], finished_process.pid, time.time()))
+        backend.put(filenames[3], io.BytesIO(b'x' * 1000))
+        assert backend.get(filenames[0]), "Archive in use by a running process was evicted!"
+        assert not backend.get(filenames[1]), "Least recently used archive wasn't evicted!"
+        assert not backend.get(filenames[2]), "Local cache wasn't reduced to its low watermark!"
+        assert backend.get(filenames[3]), "New archive was evicted!"
+        assert os.path.isfile(manifest), "Manifest of mirrored source archives was evicted!"
+        assert backend.index.get_total_size() == 2000
+        # Using an archive doesn't change its last modified time.
+        pathname = os.path.join(accelerator.config.binary_cache, filenames[3])
+        os.utime(pathname, (1, 1))
+        assert backend.get(filenames[3])
+        assert os.path.getmtime(pathname) == 1, "Using an archive changed its last modified time!"
+
+    def test_shared_binary_caches(self):
+        """Verify that read only binary caches can be shared between users."""
+        shared_caches = [create_temporary_directory(), create_temporary_directory()]
+        config = Config(load_configuration_files=False, load_environment_variables=False)
+        config.configuration['shared-binary-caches'] = os.pathsep.join(shared_caches)
+        assert config.shared_binary_caches == shared_caches
+        accelerator = self.initialize_pip_accel(shared_binary_caches=shared_caches)
+        cache = accelerator.bdists.cache
+        backend = [b for b in cache.backends if repr(b) == 'LocalCacheBackend'][0]
+        filename = 'v0/shared:1.0:test.tar.gz'
+        shared_archive = os.path.join(shared_caches[1], filename)
+        os.makedirs(os.path.dirname(shared_archive))
+        with open(shared_archive, 'wb') as handle:
+            handle.write(b'shared')
+        assert backend.get(filename) == shared_archive
+        assert backend.exists_many([filename, 'v0/missing:1.0:test.tar.gz']) == set([filename])
+        # Newly built archives are only stored in the user's own cache.
+        cache.put_file('v0/private:1.0:test.tar.gz', io.BytesIO(b'private'))
+        assert backend.get('v0/private:1.0:test.tar.gz') == os.path.join(accelerator.config.binary_cache,
+                                                                         'v0/private:1.0:test.tar.gz')
+        assert not any(os.path.exists(os.path.join(d, 'v0/private:1.0:test.tar.gz')) for d in shared_caches)
+
+    def test_source_mirroring(self):
+        """Verify that source archives are mirrored into the cache backends (see :mod:`pip_accel.mirror`)."""
+        config = Config(load_configuration_files=False, load_environment_variables=False)
+        config.configuration['source-mirroring'] = 'yes'
+        assert config.source_mirroring is True
+        uploader = self.initialize_pip_accel(source_mirroring=True)
+        requirement = DummyRequirement(create_temporary_directory(), name='pip-accel-mirror-test')
+        requirement.create_setup_script("""
+            from setuptools import setup
+            setup(name='pip-accel-mirror-test', version='1.0', py_modules=[])
+        """)
+        subprocess.check_call([sys.executable, 'setup.py', '-q', 'sdist',
+                               '--dist-dir=%s' % uploader.config.source_index],
+                              cwd=requirement.source_directory)
+        arguments = ['--ignore-installed', 'pip-accel-mirror-test==1.0']
+        requirements = uploader.unpack_source_dists(arguments)
+        binary_cache = uploader.config.binary_cache
+        # Only newly downloaded archives are mirrored.
+        uploader.source_mirror.upload(requirements, set(os.listdir(uploader.config.source_index)))
+        assert not os.path.exists(os.path.join(binary_cache, 'sources'))
+        uploader.source_mirror.upload(requirements)
+        uploader.cleanup_temporary_directories()
+        assert os.path.isfile(os.path.join(binary_cache, 'sources', 'pip-accel-mirror-test-1.0.tar.gz'))
+        assert os.path.isfile(os.path.join(binary_cache, 'sources', 'index', 'pip-accel-mirror-test.json'))
+        # A host with an empty source index resolves the requirement from the
+        # mirror (here the shared binary cache of the other host) without
+        # connecting to PyPI.
+        downloader = self.initialize_pip_accel(source_mirroring=True, shared_binary_caches=[binary_cache])
+        requirements = downloader.unpack_source_dists(arguments)
+        assert [(r.name, r.version) for r in requirements] == [('pip-accel-mirror-test', '1.0')]
+        assert os.path.isfile(os.path.join(downloader.config.source_index, 'pip-accel-mirror-test-1.0.tar.gz'))
+        downloader.cleanup_temporary_directories()
+        # Without source mirroring the mirror isn't consulted.
+        isolated = self.initialize_pip_accel(shared_binary_caches=[binary_cache])
+        self.assertRaises(DistributionNotFound, isolated.unpack_source_dists, arguments)
+
+    def test_source_mirror_manifests(self):
+        """Verify that the manifests of remote cache backends don't overwrite the manifests in the local cache."""
+        with StaticWebServer() as server:
+            server.create_file(SOURCE_MANIFEST_PATTERN % 'project', b'["project-2.0.tar.gz"]')
+            accelerator = self.initialize_pip_accel(source_mirroring=True, http_cache_url=server.url)
+            local_manifest = os.path.join(accelerator.config.binary_cache, SOURCE_MANIFEST_PATTERN % 'project')
+            os.makedirs(os.path.dirname(local_manifest))
+            with open(local_manifest, 'w') as handle:
+                handle.write('["project-1.0.tar.gz"]')
+            for i in range(2):
+                manifests = accelerator.source_mirror.get_manifests(['other', 'project'])
+                assert manifests == dict(other=set(), project=set(['project-1.0.tar.gz', 'project-2.0.tar.gz']))
+            with open(local_manifest) as handle:
+                assert handle.read() == '["project-1.0.tar.gz"]', "Local manifest was overwritten!"
+            assert 304 not in server.responses, "Remote manifest was revalidated against the local manifest!"
+            assert not os.listdir(os.path.join(get_download_directory(), 'HTTPCacheBackend', 'sources', 'index')), \
+                "Downloaded manifests weren't removed!"
+
+    def test_source_mirror_specifiers(self):
+        """Verify that only the mirrored archives matching the version specifier of a requirement are fetched."""
+        accelerator = self.initialize_pip_accel(source_mirroring=True)
+        filenames = ['pip-accel-mirror-spec-1.0.tar.gz',
+                     'pip_accel_mirror_spec-2.0.zip',
+                     'pip-accel-mirror-spec.tar.gz']
+        for filename in filenames:
+            accelerator.bdists.cache.put_file(SOURCE_FILENAME_PATTERN % filename, io.BytesIO(b'source'))
+        contents = json.dumps(filenames).encode('utf-8')
+        accelerator.bdists.cache.put_file(SOURCE_MANIFEST_PATTERN % 'pip-accel-mirror-spec', io.BytesIO(contents))
+        requirement = InstallRequirement.from_line('pip_accel_mirror_spec>=2.0')
+        # Archives whose version can't be parsed are fetched anyway.
+        assert accelerator.source_mirror.fetch(requirement.name, requirement) == 2
+        assert sorted(os.listdir(accelerator.config.source_index)) == sorted(filenames[1:])
+        # Other versions of the same project can still be fetched later.
+        assert accelerator.source_mirror.fetch(requirement.name) == 1
+        assert sorted(os.listdir(accelerator.config.source_index)) == sorted(filenames)
+
+    def test_concurrent_downloads(self):
+        """Verify that missing source archives are downloaded concurrently (see :mod:`pip_accel.downloads`)."""
+        with StaticWebServer() as server:
+            # Publish two dummy packages (one depending on the other) on a
+            # package index served by a local web server.
+            for name, dependencies in (('pip-accel-download-a', ['pip-accel-download-b']),
+                                       ('pip-accel-download-b', [])):
+                requirement = DummyRequirement(create_temporary_directory(), name=name)
+                requirement.create_setup_script("""
+                    from setuptools import setup
+                    setup(name=%r, version='1.0', py_modules=[], install_requires=%r)
+                """ % (name, dependencies))
+                subprocess.check_call([sys.executable, 'setup.py', '-q', 'sdist',
+                                       '--dist-dir=%s' % os.path.join(server.directory, 'simple', name)],
+                                      cwd=requirement.source_directory)
+            accelerator = self.initialize_pip_accel(download_threads=2)
+            requirements = accelerator.download_source_dists(['--index-url=%ssimple/' % server.url,
+                                                              '--ignore-installed', 'pip-accel-download-a'])
+            assert sorted(r.name for r in requirements) == ['pip-accel-download-a', 'pip-accel-download-b']
+            # Both archives (including the dependency discovered by pip) were
+            # downloaded by the background threads.
+            assert sorted(os.path.basename(p) for p in accelerator.downloader.downloaded) == \
+                ['pip-accel-download-a-1.0.tar.gz', 'pip-accel-download-b-1.0.tar.gz']
+            assert all(os.path.isfile(p) for p in accelerator.downloader.downloaded)
+            accelerator.cleanup_temporary_directories()
+
+    def test_partial_resolution(self):
+        """Verify that only the requirements missing from the source index are looked up online."""
+        with StaticWebServer() as server:
+            for name, dependencies in (('pip-accel-partial-a', ['pip-accel-partial-b']),
+                                       ('pip-accel-partial-b', [])):
+                requirement = DummyRequirement(create_temporary_directory(), name=name)
+                requirement.create_setup_script("""
+                    from setuptools import setup
+                    setup(name=%r, version='1.0', py_modules=[], install_requires=%r)
+                """ % (name, dependencies))
+                subprocess.check_call([sys.executable, 'setup.py', '-q', 'sdist',
+                                       '--dist-dir=%s' % os.path.join(server.directory, 'simple', name)],
+                                      cwd=requirement.source_directory)
+            accelerator = self.initialize_pip_accel()
+            assert accelerator.config.partial_resolution is True
+            # Only the first package is available in the local source index.
+            archive = os.path.join(server.directory, 'simple', 'pip-accel-partial-a', 'pip-accel-partial-a-1.0.tar.gz')
+            shutil.copy(archive, accelerator.config.source_index)
+            requirements = accelerator.get_requirements(['--index-url=%ssimple/' % server.url,
+                                                         '--ignore-installed', 'pip-accel-partial-a'])
+            assert sorted(r.name for r in requirements) == ['pip-accel-partial-a', 'pip-accel-partial-b']
+            assert os.path.isfile(os.path.join(accelerator.config.source_index, 'pip-accel-partial-b-1.0.tar.gz'))
+            assert not any('pip-accel-partial-a' in path for path in server.paths), \
+                "Requirement available in the source index was looked up online!"
+            assert any('pip-accel-partial-b' in path for path in server.paths)
+            accelerator.cleanup_temporary_directories()
+
+    def test_egg_info_caching(self):
+        """Verify that the metadata generated by ``setup.py egg_info`` is cached (see :mod:`pip_accel.egg_info`)."""
+        accelerator = self.initialize_pip_accel()
+        assert accelerator.config.egg_info_caching is True
+        # Create a source distribution whose setup.py script records every time it runs.
+        marker_file = os.path.join(create_temporary_directory(), 'setup-py-runs')
+        requirement = DummyRequirement(create_temporary_directory(), name='pip-accel-egg-info-test')
+        requirement.create_setup_script("""
+            import sys
+            from setuptools import setup
+            if 'egg_info' in sys.argv:
+                with open(%r, 'a') as handle:
+                    handle.write('egg_info\\n')
+            setup(name='pip-accel-egg-info-test', version='1.0', py_modules=[], install_requires=['coloredlogs'])
+        """ % marker_file)
+        subprocess.check_call([sys.executable, 'setup.py', '-q', 'sdist',
+                               '--dist-dir=%s' % accelerator.config.source_index],
+                              cwd=requirement.source_directory)
+
+        def count_runs():
+            with open(marker_file) as handle:
+                return len(handle.readlines())
+
+        arguments = ['--ignore-installed', '--no-deps', 'pip-accel-egg-info-test==1.0']
+        for i in range(2):
+            requirements = accelerator.unpack_source_dists(arguments)
+            assert [(r.name, r.version) for r in requirements] == [('pip-accel-egg-info-test', '1.0')]
+            assert requirements[0].sdist_metadata['Name'] == 'pip-accel-egg-info-test'
+            accelerator.cleanup_temporary_directories()
+        assert count_runs() == 1, "Expected setup.py egg_info to run only once!"
+        # Without caching setup.py is executed again.
+        accelerator.config.egg_info_caching = False
+        accelerator.unpack_source_dists(arguments)
+        accelerator.cleanup_temporary_directories()
+        assert count_runs() == 2
+
+    def test_cache_metrics(self):
+        """Verify that cache backend operations are instrumented."""
+        prometheus_textfile = os.path.join(create_temporary_directory(), 'pip-accel.prom')
+        accelerator = self.initialize_pip_accel(prometheus_textfile=prometheus_textfile)
+        cache = accelerator.bdists.cache
+        cache.backends = [b for b in cache.backends if repr(b) == 'LocalCacheBackend']
+        cache.put_file('v0/metrics:1.0:test.tar.gz', io.BytesIO(b'metrics'))
+        assert cache.get_file('v0/metrics:1.0:test.tar.gz')
+        assert not cache.get_file('v0/missing:1.0:test.tar.gz')
+        summary = cache.metrics.summary()['LocalCacheBackend']
+        assert summary['get']['outcomes'] == dict(hit=1, miss=1)
+        assert summary['get']['hit_rate'] == 0.5
+        assert summary['put']['outcomes'] == dict(ok=1)
+        assert summary['put']['bytes'] == len(b'metrics')
+        cache.report_metrics()
+        with open(prometheus_textfile) as handle:
+            contents = handle.read()
+        assert ('pip_accel_cache_operations_total'
+                '{backend="LocalCacheBackend",operation="get",outcome="hit"} 1') in contents
+        assert ('pip_accel_cache_operation_duration_seconds_count'
+                '{backend="LocalCacheBackend",operation="put"} 1') in contents
+
+    def test_adaptive_backend_order(self):
+        """Verify that remote cache backends are ordered by their measured performance."""
+        accelerator = self.initialize_pip_accel()
+        cache = accelerator.bdists.cache
+        local_backend = [b for b in cache.backends if repr(b) == 'LocalCacheBackend'][0]
+        # Two remote backends with the same contents, the one with the lower
+        # static priority is faster.
+        slow_backend = ListingBackend(accelerator.config, name='SlowBackend', priority=20, delay=0.05)
+        fast_backend = ListingBackend(accelerator.config, name='FastBackend', priority=30, delay=0)
+        cache.backends = [local_backend, slow_backend, fast_backend]
+        # Without statistics the static priorities are used.
+        statistics = BackendStatistics(accelerator.config)
+        assert not statistics.is_available([slow_backend, fast_backend])
+        assert statistics.order(cache.backends) == [local_backend, slow_backend, fast_backend]
+        # Simulate a run where the slow backend serves every distribution
+        # archive (because it's consulted first). The fast backend is never
+        # asked for a distribution archive but its availability is measured
+        # by the bulk lookups.
+        filenames = ['v0/adaptive-%i:1.0:test.tar.gz' % i for i in range(MIN_SAMPLES)]
+        available = cache.plan(filenames)
+        assert all(available[fn] is slow_backend for fn in filenames)
+        for filename in filenames:
+            assert cache.get_file(filename)
+        assert not fast_backend.requests, "Fast backend was unexpectedly asked for a distribution archive!"
+        cache.report_metrics()
+        statistics = BackendStatistics(accelerator.config)
+        assert statistics.is_available([slow_backend, fast_backend])
+        # The fast backend moves ahead of the slow backend (while the local
+        # cache is still consulted first).
+        assert statistics.order(cache.backends) == [local_backend, fast_backend, slow_backend]
+        # The local cache isn't moved behind the remote backends (it would
+        # never recover from its low hit rate), not even by the cache backends
+        # initialized by the cache manager.
+        for i in range(MIN_SAMPLES):
+            cache.metrics.record(local_backend, 'get', 'miss', duration=1)
+            for backend in [b for b in PipAccelerator(accelerator.config).bdists.cache.backends if b.REMOTE]:
+                cache.metrics.record_availability(backend, 1, 1, 0.01)
+        cache.report_metrics()
+        backends = PipAccelerator(accelerator.config).bdists.cache.backends
+        assert [b.REMOTE for b in backends] == sorted(b.REMOTE for b in backends), \
+            "Expected the local cache backends to be consulted before the remote cache backends!"
+
+    def test_circuit_breaker(self):
+        """Verify that failing cache backends are retried and temporarily skipped."""
+        accelerator = self.initialize_pip_accel(cache_retries=1)
+        cache = accelerator.bdists.cache
+        backend = FlakyBackend(accelerator.config)
+        cache.backends = [backend]
+        with PatchedAttribute(pip_accel.caches, 'RETRY_DELAY', 0.01):
+            # A single failure is hidden by retrying the operation.
+            backend.failures = 1
+            assert cache.get_file('v0/flaky:1.0:test.tar.gz')
+            assert backend.calls == 2
+            # Persistent failures open the circuit breaker.
+            backend.failures = 10
+            assert not cache.get_file('v0/flaky:1.0:test.tar.gz')
+            assert backend.calls == 4
+            # While the circuit breaker is open the backend is skipped.
+            assert not cache.get_file('v0/flaky:1.0:test.tar.gz')
+            assert backend.calls == 4
+            assert cache.backends == [backend], "Failing backend was permanently disabled!"
+            # After the circuit breaker's timeout a single probe is allowed.
+            breaker = cache.get_circuit_breaker(backend)
+            breaker.open_until = 0
+            backend.failures = 0
+            assert cache.get_file('v0/flaky:1.0:test.tar.gz')
+            assert breaker.failures == 0, "Circuit breaker didn't close after a successful probe!"
+        assert cache.metrics.summary()['FlakyBackend']['circuit']['outcomes'] == dict(open=1)
+
+    def test_retry_budget(self):
+        """Verify that the cache backends consulted during a lookup share a single retry budget."""
+        accelerator = self.initialize_pip_accel(cache_retries=5, cache_retry_budget=0.15)
+        cache = accelerator.bdists.cache
+        first_backend = FlakyBackend(accelerator.config)
+        second_backend = FlakyBackend(accelerator.config)
+        cache.backends = [first_backend, second_backend]
+        first_backend.failures = second_backend.failures = 10
+        with PatchedAttribute(pip_accel.caches, 'RETRY_DELAY', 0.1):
+            assert not cache.get_file('v0/budget:1.0:test.tar.gz')
+        # The first backend used up the budget with a single retry, so the
+        # second backend isn't retried.
+        assert first_backend.calls == 2
+        assert second_backend.calls == 1
+
+    def test_negative_cache(self):
+        """Verify that misses of remote cache backends are remembered across runs."""
+        data_directory = create_temporary_directory()
+        filename = 'v0/negative:1.0:test.tar.gz'
+        for i in range(2):
+            cache = self.initialize_pip_accel(data_directory=data_directory).bdists.cache
+            backend = MissingBackend(cache.config)
+            cache.backends = [backend]
+            assert not cache.get_file(filename)
+            cache.save_state()
+            # The second run doesn't consult the backend.
+            assert backend.lookups == (1 if i == 0 else 0)
+        assert cache.metrics.summary()['MissingBackend']['get']['outcomes'] == dict(skip=1)
+        # Expired entries are looked up again.
+        cache.negative_cache.entries['MissingBackend'][filename] -= cache.config.negative_cache_ttl
+        assert not cache.negative_cache.contains(backend, filename)
+        # Storing the archive removes it from the negative cache.
+        cache.negative_cache.add(backend, filename)
+        cache.put_file(filename, io.BytesIO(b'negative'))
+        assert not cache.negative_cache.contains(backend, filename)
+        # Backends with the same name in another location don't share misses.
+        elsewhere = MissingBackend(cache.config)
+        elsewhere.location = 'https://elsewhere.example.com'
+        cache.negative_cache.add(elsewhere, filename)
+        assert cache.negative_cache.contains(elsewhere, filename)
+        assert not cache.negative_cache.contains(backend, filename)
+        # Concurrent processes merge their entries instead of overwriting them.
+        other_process = NegativeCache(cache.config)
+        other_process.add(backend, 'v0/concurrent:1.0:test.tar.gz')
+        other_process.save()
+        cache.save_state()
+        merged = NegativeCache(cache.config)
+        assert merged.contains(backend, 'v0/concurrent:1.0:test.tar.gz')
+        assert merged.contains(elsewhere, filename)
+        assert not merged.contains(backend, filename), "Discarded entry was resurrected!"
+
+    def test_cache_promotion(self):
+        """Verify that cache hits are copied to faster writable cache backends."""
+        accelerator = self.initialize_pip_accel()
+        cache = accelerator.bdists.cache
+        local_backend = [b for b in cache.backends if repr(b) == 'LocalCacheBackend'][0]
+        readonly_backend = MissingBackend(accelerator.config)
+        readonly_backend.WRITABLE = False
+        mirror_backend = MirrorBackend(accelerator.config)
+        cache.backends = [local_backend, readonly_backend, mirror_backend]
+        filename = 'v0/promote:1.0:test.tar.gz'
+        pathname = cache.get_file(filename)
+        assert pathname.startswith(mirror_backend.directory)
+        with open(local_backend.get(filename), 'rb') as handle:
+            assert handle.read() == b'mirror', "Cache hit wasn't promoted to the local cache!"
+        assert not readonly_backend.uploads, "Cache hit was promoted to a read only backend!"
+        assert cache.metrics.summary()['LocalCacheBackend']['promote']['outcomes'] == dict(ok=1)
+
+    def test_cache_promotion_outcomes(self):
+        """Verify that promotions are recorded per backend and don't repeat for backends without bulk lookups."""
+        filename = 'v0/outcomes:1.0:test.tar.gz'
+        for background_uploads in (False, True):
+            accelerator = self.initialize_pip_accel(background_uploads=background_uploads, cache_retries=0)
+            cache = accelerator.bdists.cache
+            missing_backend = MissingBackend(accelerator.config)
+            mirror_backend = MirrorBackend(accelerator.config)
+            cache.backends = [missing_backend, mirror_backend]
+            # A confirmed cache miss is promoted to.
+            pathname = cache.get_file(filename)
+            assert cache.wait_for_uploads(), "Background promotion didn't finish!"
+            assert missing_backend.uploads == {filename: b'mirror'}
+            # Without a confirmed miss or bulk lookups the archive isn't stored again.
+            cache.promote(filename, pathname, mirror_backend)
+            assert cache.wait_for_uploads()
+            assert len(missing_backend.uploads) == 1 and missing_backend.puts == 1
+            # Failed uploads are recorded as failed promotions.
+            missing_backend.broken = True
+            cache.promote(filename, pathname, mirror_backend, [missing_backend])
+            assert cache.wait_for_uploads()
+            assert cache.metrics.summary()['MissingBackend']['promote']['outcomes'] == dict(ok=1, error=1)
+
+    def test_s3_multipart_transfers(self):
+        """Verify that large archives are transferred to and from Amazon S3 in parts."""
+        assert split_parts(10, 4) == [(1, 0, 4), (2, 4, 4), (3, 8, 2)]
+        if not os.environ.get('PIP_ACCEL_S3_BUCKET'):
+            return self.skipTest("Skipping multipart transfers test because $PIP_ACCEL_S3_BUCKET isn't set.")
+        contents = os.urandom(1024 * 1024 * 11)
+        filename = 'v0/multipart:1.0:test.tar.gz'
+        for i in range(2):
+            # The second iteration uses a fresh cache manager (and local cache).
+            accelerator = self.initialize_pip_accel(load_environment_variables=True,
+                                                    s3_cache_multipart_threshold='1 MB',
+                                                    s3_cache_part_size='5 MB')
+            s3_backend = [b for b in accelerator.bdists.cache.backends if repr(b) == 'S3CacheBackend'][0]
+            if i == 0:
+                s3_backend.put(filename, io.BytesIO(contents))
+                assert not accelerator.config.s3_cache_readonly, "Multipart upload failed!"
+            else:
+                s3_backend.exists_many([filename])
+                with open(s3_backend.get(filename), 'rb') as handle:
+                    assert handle.read() == contents, "Ranged download returned unexpected contents!"
+
+    def test_sqlite_cache_backend(self):
+        """Verify that distribution archives can be stored in a single SQLite database."""
+        accelerator = self.initialize_pip_accel(local_cache_backend='sqlite')
+        cache = accelerator.bdists.cache
+        filename = 'v0/sqlite:1.0:test.tar.gz'
+        cache.put_file(filename, io.BytesIO(b'sqlite'))
+        assert 'LocalCacheBackend' not in map(repr, cache.backends), "File system backend wasn't disabled!"
+        assert not os.path.exists(os.path.join(accelerator.config.binary_cache, filename))
+        with open(cache.get_file(filename), 'rb') as handle:
+            assert handle.read() == b'sqlite'
+        assert cache.get_file_stream(filename).read() == b'sqlite'
+        assert not cache.get_file('v0/missing:1.0:test.tar.gz')
+        assert list(cache.plan([filename, 'v0/missing:1.0:test.tar.gz'])) == [filename]
+        # Another connection (e.g. another process) sees the same archives.
+        backend = SQLiteCacheBackend(accelerator.config)
+        assert backend.connection.execute('pragma journal_mode').fetchone()[0] == 'wal'
+        filenames = ['v0/sqlite-%i:1.0:test.tar.gz' % i for i in range(5)]
+        backend.put_many([(fn, io.BytesIO(b'sqlite')) for fn in filenames[:3]])
+        assert SQLiteCacheBackend(accelerator.config).exists_many(filenames) == set(filenames[:3])
+
+    def test_http_cache_backend(self):
+        """Verify that distribution archives can be downloaded from a web server."""
+        filename = 'v0/http:1.0:test.tar.gz'
+        with StaticWebServer() as server:
+            server.create_file(filename, b'http')
+            server.create_file('v0/stream:1.0:test.tar.gz', b'stream')
+            accelerator = self.initialize_pip_accel(http_cache_url=server.url)
+            backend = HTTPCacheBackend(accelerator.config)
+            assert backend.exists_many([filename, 'v0/missing:1.0:test.tar.gz']) == set([filename])
+            num_requests = len(server.requests)
+            assert backend.get('v0/missing:1.0:test.tar.gz') is None
+            assert len(server.requests) == num_requests, "Known miss wasn't remembered!"
+            pathname = backend.get(filename)
+            assert pathname == os.path.join(accelerator.config.binary_cache, filename)
+            with open(pathname, 'rb') as handle:
+                assert handle.read() == b'http'
+            # Archives in the local cache are revalidated using conditional
+            # requests (the validators are remembered across runs).
+            backend = HTTPCacheBackend(accelerator.config)
+            assert backend.get(filename) == pathname
+            assert server.requests[-1].get('If-None-Match') == StaticWebServer.ETAG
+            assert server.responses[-1] == 304
+            # Archives can be streamed into the local cache.
+            stream = backend.get_stream('v0/stream:1.0:test.tar.gz')
+            assert stream.read() == b'stream'
+            stream.close()
+            assert os.path.isfile(os.path.join(accelerator.config.binary_cache, 'v0/stream:1.0:test.tar.gz'))
+            # The raw response body is streamed so it mustn't be compressed.
+            assert server.requests[-1].get('Accept-Encoding') == 'identity'
+
+    def test_remote_downloads_with_sqlite_cache(self):
+        """Verify that remote cache backends don't download into the binary cache when it's stored in SQLite."""
+        filenames = ['v0/download:1.0:test.tar.gz', 'v0/stream:1.0:test.tar.gz']
+        with StaticWebServer() as server:
+            for filename in filenames:
+                server.create_file(filename, filename.encode('ascii'))
+            accelerator = self.initialize_pip_accel(http_cache_url=server.url, local_cache_backend='sqlite')
+            cache = accelerator.bdists.cache
+            pathname = cache.get_file(filenames[0])
+            assert is_temporary_download(pathname), "Download wasn't stored in a temporary file!"
+            with open(pathname, 'rb') as handle:
+                assert handle.read() == filenames[0].encode('ascii')
+            stream = cache.get_file_stream(filenames[1])
+            assert stream.read() == filenames[1].encode('ascii')
+            stream.close()
+            assert not os.path.exists(os.path.join(get_download_directory(), 'HTTPCacheBackend', filenames[1])), \
+                "Streamed download wasn't removed after promotion!"
+        # The downloads were promoted to the SQLite cache (not the binary cache).
+        assert SQLiteCacheBackend(accelerator.config).exists_many(filenames) == set(filenames)
+        assert not os.path.exists(os.path.join(accelerator.config.binary_cache, 'v0')), \
+            "Remote cache backend downloaded into the binary cache!"
+
+    def test_cache_server(self):
+        """Verify that the local binary cache can be served to other hosts."""
+        assert parse_range('bytes=2-5', 10) == (2, 5)
+        assert parse_range('bytes=8-', 10) == (8, 9)
+        assert parse_range('bytes=-3', 10) == (7, 9)
+        assert parse_range('bytes=0-1,4-5', 10) is None
+        self.assertRaises(ValueError, parse_range, 'bytes=10-', 10)
+        server_accelerator = self.initialize_pip_accel()
+        filename = 'v0/served:1.0:test.tar.gz'
+        server_accelerator.bdists.cache.put_file(filename, io.BytesIO(b'0123456789'))
+        with open(os.path.join(server_accelerator.config.source_index, 'served-1.0.tar.gz'), 'wb') as handle:
+            handle.write(b'source')
+        server = CacheServer(server_accelerator.config, ('127.0.0.1', 0), include_sources=True)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        try:
+            # Another host uses the server through the HTTP cache backend.
+            client_accelerator = self.initialize_pip_accel(http_cache_url=server.url)
+            backend = HTTPCacheBackend(client_accelerator.config)
+            assert backend.exists_many([filename, 'v0/missing:1.0:test.tar.gz']) == set([filename])
+            with open(backend.get(filename), 'rb') as handle:
+                assert handle.read() == b'0123456789'
+            # Range requests, conditional requests and the source index.
+            from pip._vendor import requests
+            response = requests.get(server.url + 'v0/served%3A1.0%3Atest.tar.gz', headers={'Range': 'bytes=2-5'})
+            assert response.status_code == 206 and response.content == b'2345'
+            response = requests.get(server.url + 'v0/served%3A1.0%3Atest.tar.gz',
+                                    headers={'If-None-Match': response.headers['ETag']})
+            assert response.status_code == 304
+            assert requests.get(server.url + 'sources/served-1.0.tar.gz').content == b'source'
+            assert requests.get(server.url + 'v0/../../sources/served-1.0.tar.gz').status_code == 404
+            assert requests.get(server.url + 'v0/').status_code == 404
+        finally:
+            server.shutdown()
+            server.server_close()
 
     def test_wheel_install(self):
         """
@@ -383,7 +1130,8 @@ class PipAccelTestCase(unittest.TestCase):
 
         This test installs Paver 1.2.4 (a random package without dependencies
         that I noticed is available as a Python 2.x and Python 3.x compatible
-        wheel archive on PyPI).
+        wheel archive on PyPI) and makes sure the wheel distribution archive
+        was added to the binary cache.
         """
         accelerator = self.initialize_pip_accel()
         wheels_already_supported = accelerator.setuptools_supports_wheels()
@@ -398,6 +1146,9 @@ class PipAccelTestCase(unittest.TestCase):
             assert num_installed == 2, "Expected pip-accel to install exactly two packages!"
         # Make sure the Paver program works after installation.
         try_program('paver')
+        # Make sure the wheel distribution archive was cached.
+        assert any(fn.endswith('.whl') for fn in find_files(accelerator.config.binary_cache, 'paver')), \
+            "Expected the wheel distribution archive to be cached!"
 
     def test_bdist_fallback(self):
         """
@@ -420,6 +1171,211 @@ class PipAccelTestCase(unittest.TestCase):
         # Make sure the Paver program works after installation.
         try_program('paver')
 
+    def test_warm_build_workers(self):
+        """
+        Verify that binary distributions can be built by warm build workers.
+
+        This test builds and installs pep8 1.6.2 using a warm build worker
+        (see :mod:`pip_accel.workers`) and makes sure the worker was actually
+        used for the build.
+        """
+        if WINDOWS:
+            return self.skipTest("Skipping warm build workers test (not supported on Windows).")
+        accelerator = self.initialize_pip_accel(build_workers=1)
+        num_installed = accelerator.install_from_arguments([
+            '--ignore-installed', '--no-binary=:all:', 'pep8==1.6.2',
+        ])
+        assert num_installed == 1, "Expected pip-accel to install exactly one package!"
+        workers = accelerator.bdists.build_workers.workers
+        assert len(workers) == 1 and workers[0].current_build is not None, \
+            "Expected the binary distribution to be built by a warm build worker!"
+        assert workers[0].current_build.returncode == 0, \
+            "Warm build worker reported unexpected exit code!"
+        accelerator.bdists.build_workers.shutdown()
+
+    def test_unresponsive_build_workers(self):
+        """Verify that warm build workers that don't report that they're ready are given up on."""
+        if WINDOWS:
+            return self.skipTest("Skipping warm build workers test (not supported on Windows).")
+        hanging_python = os.path.join(create_temporary_directory(), 'python')
+        with open(hanging_python, 'w') as handle:
+            handle.write('#!/bin/sh\nexec sleep 60\n')
+        os.chmod(hanging_python, 0o755)
+        accelerator = self.initialize_pip_accel(build_workers=1, python_executable=hanging_python)
+        pool = accelerator.bdists.build_workers
+        timer = time.time()
+        with PatchedAttribute(pip_accel.workers, 'RESPONSE_TIMEOUT', 0.5):
+            # No warm build worker means a build in a new Python process.
+            assert pool.start_build('setup.py', ['bdist_dumb'], create_temporary_directory(), os.devnull) is None
+        assert time.time() - timer < 10, "Waited too long for unresponsive worker!"
+        assert not pool.enabled and not pool.workers
+
+    def test_build_supervision(self):
+        """
+        Verify the handling of failing and runaway builds.
+
+        This tests the :func:`~pip_accel.bdist.BinaryDistributionManager.supervise_build()`
+        method and the :class:`~pip_accel.bdist.BuildOutput` class using a
+        dummy source distribution whose ``setup.py`` script either fails after
+        printing lots of output or hangs. Builds in a new Python process and
+        builds in warm build workers are both tested.
+        """
+        for build_workers in ([0] if WINDOWS else [0, 1]):
+            accelerator = self.initialize_pip_accel(build_timeout=2, build_workers=build_workers)
+            requirement = DummyRequirement(create_temporary_directory())
+            # Make sure failed builds report the tail of their output.
+            requirement.create_setup_script("""
+                import sys
+                for i in range(5000):
+                    print('Line %i of build output' % i)
+                sys.exit(1)
+            """)
+            try:
+                accelerator.bdists.build_binary_dist_helper(requirement, ['bdist_dumb'])
+                assert False, "Expected build_binary_dist_helper() to raise BuildFailed!"
+            except BuildFailed as e:
+                assert 'Line 4999 of build output' in str(e), "Build output missing from exception!"
+                assert 'Line 0 of build output' not in str(e), "Build output isn't bounded!"
+            # Make sure runaway builds are killed.
+            requirement.create_setup_script("""
+                import time
+                time.sleep(60)
+            """)
+            self.assertRaises(BuildTimeout, accelerator.bdists.build_binary_dist_helper, requirement, ['bdist_dumb'])
+            accelerator.bdists.build_workers.shutdown()
+
+    def test_wheel_builds(self):
+        """
+        Verify that source distributions can be converted to wheels.
+
+        This test installs pep8 1.6.2 with :attr:`~.Config.build_wheels`
+        enabled, makes sure a wheel was cached, that the ``pep8`` program
+        works and that pip knows how to uninstall the package (based on the
+        ``RECORD`` file written by :mod:`pip_accel.wheels`). The installation
+        is repeated to test installation from the cache.
+        """
+        accelerator = self.initialize_pip_accel(build_wheels=True)
+        if not accelerator.bdists.wheels_enabled:
+            return self.skipTest("Skipping wheel builds test because the `wheel' package isn't installed.")
+        for i in range(2):
+            num_installed = accelerator.install_from_arguments([
+                '--ignore-installed', '--no-binary=:all:', 'pep8==1.6.2',
+            ])
+            assert num_installed == 1, "Expected pip-accel to install exactly one package!"
+            assert any(fn.endswith('.whl') for fn in find_files(accelerator.config.binary_cache, 'pep8')), \
+                "Expected a wheel distribution archive to be cached!"
+            try_program('pep8')
+            uninstall_through_subprocess('pep8')
+            assert not os.path.exists(find_python_program('pep8')), \
+                "Expected pip to uninstall the pep8 program installed from a wheel!"
+
+    def test_incremental_builds(self):
+        """
+        Verify that builds in persistent build trees work as expected.
+
+        This tests the :class:`~pip_accel.bdist.BuildTree` class using a dummy
+        source distribution that's built twice (as two different versions):
+        Unchanged files in the build tree should keep their last modified
+        time, object files should be retained and modules, scripts and
+        extension modules that are removed from the source distribution
+        shouldn't end up in the second binary distribution archive.
+        """
+        accelerator = self.initialize_pip_accel(incremental_builds=True)
+        requirement = DummyRequirement(create_temporary_directory())
+        requirement.create_file('stable.py', "value = 1\n")
+        requirement.create_file('obsolete.py', "value = 2\n")
+        requirement.create_file('old-script', "#!/usr/bin/env python\n")
+        requirement.create_setup_script("""
+            from setuptools import setup
+            setup(name='dummy', version='1.0', py_modules=['stable', 'obsolete'], scripts=['old-script'])
+        """)
+        archive = accelerator.bdists.build_binary_dist_helper(requirement, ['bdist_dumb', '--format=tar'])
+        assert archive.startswith(requirement.source_directory), \
+            "Expected the binary distribution archive in the unpacked source distribution!"
+        assert 'old-script' in get_archive_names(archive), "Expected script to be included in binary distribution!"
+        build_tree = BuildTree(accelerator.config, requirement)
+        stable_module = os.path.join(build_tree.directory, 'stable.py')
+        assert os.path.isfile(stable_module), "Expected the source distribution to be copied to the build tree!"
+        # Make the last modified time of the copy recognizable.
+        os.utime(stable_module, (0, 0))
+        # Simulate an extension module that's dropped by the next version and
+        # an object file that should be reused by the next build.
+        lib_directories = glob.glob(os.path.join(build_tree.directory, 'build', 'lib*'))
+        assert lib_directories, "Expected build products in the build tree!"
+        with open(os.path.join(lib_directories[0], 'dropped.so'), 'wb') as handle:
+            handle.write(b'dropped')
+        object_file = os.path.join(build_tree.directory, 'build', 'temp.test', 'module.o')
+        os.makedirs(os.path.dirname(object_file))
+        with open(object_file, 'wb') as handle:
+            handle.write(b'object')
+        os.unlink(os.path.join(requirement.source_directory, 'obsolete.py'))
+        os.unlink(os.path.join(requirement.source_directory, 'old-script'))
+        requirement.version = '2.0'
+        requirement.create_file('new-script', "#!/usr/bin/env python\n")
+        requirement.create_setup_script("""
+            from setuptools import setup
+            setup(name='dummy', version='2.0', py_modules=['stable'], scripts=['new-script'])
+        """)
+        archive = accelerator.bdists.build_binary_dist_helper(requirement, ['bdist_dumb', '--format=tar'])
+        assert os.path.getmtime(stable_module) == 0, "Expected unchanged file in build tree to be left alone!"
+        assert os.path.isfile(object_file), "Expected object file in build tree to be retained!"
+        names = get_archive_names(archive)
+        assert 'stable.py' in names, "Expected module to be included in binary distribution!"
+        assert 'new-script' in names, "Expected new script to be included in binary distribution!"
+        assert 'obsolete.py' not in names, "Expected removed module to be excluded from binary distribution!"
+        assert 'old-script' not in names, "Expected removed script to be excluded from binary distribution!"
+        assert 'dropped.so' not in names, "Expected dropped extension module to be excluded from binary distribution!"
+
+    def test_incremental_extension_builds(self):
+        """
+        Verify that unchanged extension modules aren't recompiled in persistent build trees.
+
+        This builds a dummy source distribution with two C extension modules
+        twice (as two different versions, the second of which drops one of the
+        extension modules) and checks that the extension module that didn't
+        change isn't compiled again and that the dropped extension module
+        doesn't end up in the second binary distribution archive.
+        """
+        if not find_executable('cc'):
+            return self.skipTest("Skipping incremental extension build test because no C compiler is available.")
+        accelerator = self.initialize_pip_accel(incremental_builds=True)
+        requirement = DummyRequirement(create_temporary_directory())
+        for name in ('fast', 'dropped'):
+            requirement.create_file('%s.c' % name, """
+                #include <Python.h>
+                #if PY_MAJOR_VERSION >= 3
+                static struct PyModuleDef module = {PyModuleDef_HEAD_INIT, "%s", NULL, -1, NULL};
+                PyMODINIT_FUNC PyInit_%s(void) { return PyModule_Create(&module); }
+                #else
+                PyMODINIT_FUNC init%s(void) { Py_InitModule("%s", NULL); }
+                #endif
+            """ % (name, name, name, name))
+        requirement.create_setup_script("""
+            from setuptools import Extension, setup
+            setup(name='dummy', version='1.0', ext_modules=[Extension('fast', ['fast.c']),
+                                                           Extension('dropped', ['dropped.c'])])
+        """)
+        archive = accelerator.bdists.build_binary_dist_helper(requirement, ['bdist_dumb', '--format=tar'])
+        names = get_archive_names(archive)
+        assert any(n.startswith('fast') for n in names), "Expected extension module in binary distribution!"
+        assert any(n.startswith('dropped') for n in names), "Expected extension module in binary distribution!"
+        build_tree = BuildTree(accelerator.config, requirement)
+        extension_modules = glob.glob(os.path.join(build_tree.directory, 'build', 'lib*', 'fast*'))
+        assert len(extension_modules) == 1, "Expected compiled extension module in the build tree!"
+        last_modified = os.path.getmtime(extension_modules[0])
+        os.unlink(os.path.join(requirement.source_directory, 'dropped.c'))
+        requirement.version = '2.0'
+        requirement.create_setup_script("""
+            from setuptools import Extension, setup
+            setup(name='dummy', version='2.0', ext_modules=[Extension('fast', ['fast.c'])])
+        """)
+        archive = accelerator.bdists.build_binary_dist_helper(requirement, ['bdist_dumb', '--format=tar'])
+        assert os.path.getmtime(extension_modules[0]) == last_modified, "Unchanged extension module was recompiled!"
+        names = get_archive_names(archive)
+        assert any(n.startswith('fast') for n in names), "Expected extension module in binary distribution!"
+        assert not any(n.startswith('dropped') for n in names), \
+            "Expected dropped extension module to be excluded from binary distribution!"
+
     def test_installed_files_tracking(self):
         """
         Verify that tracking of installed files works correctly.
@@ -783,6 +1739,395 @@ class PipAccelTestCase(unittest.TestCase):
             return None
 
 
+class DummyRemoteBackend(AbstractCacheBackend):
+
+    """Slow cache backend used to test prefetching and background uploads."""
+
+    REGISTER = False
+
+    REMOTE = True
+
+    def __init__(self, config):
+        """Initialize a :class:`DummyRemoteBackend` object."""
+        super(DummyRemoteBackend, self).__init__(config)
+        self.threads = set()
+        self.uploads = {}
+
+    def put(self, filename, handle):
+        """Simulate a slow upload."""
+        time.sleep(0.5)
+        self.uploads[filename] = handle.read()
+
+    def get(self, filename):
+        """Simulate a slow download into the local cache."""
+        self.threads.add(threading.current_thread().name)
+        time.sleep(0.5)
+        pathname = os.path.join(self.config.binary_cache, filename)
+        if not os.path.isdir(os.path.dirname(pathname)):
+            os.makedirs(os.path.dirname(pathname))
+        with open(pathname, 'wb') as handle:
+            handle.write(b'dummy')
+        return pathname
+
+
+class FlakyBackend(DummyRemoteBackend):
+
+    """Cache backend that fails a configurable number of times (used to test the circuit breaker)."""
+
+    REGISTER = False
+
+    def __init__(self, config):
+        """Initialize a :class:`FlakyBackend` object."""
+        super(FlakyBackend, self).__init__(config)
+        self.failures = 0
+        self.calls = 0
+
+    def get(self, filename):
+        """Simulate a download that fails while :attr:`failures` is positive."""
+        self.calls += 1
+        if self.failures > 0:
+            self.failures -= 1
+            raise IOError("Simulated network failure!")
+        pathname = os.path.join(self.config.binary_cache, filename)
+        if not os.path.isdir(os.path.dirname(pathname)):
+            os.makedirs(os.path.dirname(pathname))
+        with open(pathname, 'wb') as handle:
+            handle.write(b'flaky')
+        return pathname
+
+
+class MissingBackend(DummyRemoteBackend):
+
+    """Remote cache backend that never contains distribution archives (used to test the negative cache)."""
+
+    REGISTER = False
+
+    location = None
+
+    def __init__(self, config):
+        """Initialize a :class:`MissingBackend` object."""
+        super(MissingBackend, self).__init__(config)
+        self.broken = False
+        self.lookups = 0
+        self.puts = 0
+
+    def get(self, filename):
+        """Simulate a cache miss."""
+        self.lookups += 1
+        return None
+
+    def put(self, filename, handle):
+        """Simulate an upload (that fails when :attr:`broken` is :data:`True`)."""
+        self.puts += 1
+        if self.broken:
+            raise IOError("Simulated upload failure!")
+        self.uploads[filename] = handle.read()
+
+
+class MirrorBackend(DummyRemoteBackend):
+
+    """Cache backend that contains every distribution archive in its own directory (used to test promotion)."""
+
+    REGISTER = False
+
+    def __init__(self, config):
+        """Initialize a :class:`MirrorBackend` object."""
+        super(MirrorBackend, self).__init__(config)
+        self.directory = create_temporary_directory()
+
+    def get(self, filename):
+        """Simulate a cache hit outside of the local cache."""
+        pathname = os.path.join(self.directory, filename)
+        if not os.path.isdir(os.path.dirname(pathname)):
+            os.makedirs(os.path.dirname(pathname))
+        with open(pathname, 'wb') as handle:
+            handle.write(b'mirror')
+        return pathname
+
+
+class ListingBackend(MirrorBackend):
+
+    """Cache backend that contains every distribution archive and implements bulk lookups (used to test ordering)."""
+
+    REGISTER = False
+
+    def __init__(self, config, name, priority, delay):
+        """Initialize a :class:`ListingBackend` object."""
+        super(ListingBackend, self).__init__(config)
+        self.name = name
+        self.PRIORITY = priority
+        self.delay = delay
+        self.requests = []
+
+    def exists_many(self, filenames):
+        """Simulate a bulk lookup that takes :attr:`delay` seconds."""
+        time.sleep(self.delay)
+        return set(filenames)
+
+    def get(self, filename):
+        """Simulate a cache hit outside of the local cache."""
+        self.requests.append(filename)
+        return super(ListingBackend, self).get(filename)
+
+    def __repr__(self):
+        """Use the name of the backend as its textual representation."""
+        return self.name
+
+
+class BatchBackend(DummyRemoteBackend):
+
+    """Cache backend that implements batch downloads and uploads (used to test prefetching)."""
+
+    REGISTER = False
+
+    def __init__(self, config):
+        """Initialize a :class:`BatchBackend` object."""
+        super(BatchBackend, self).__init__(config)
+        self.batches = []
+        self.put_batches = []
+
+    def get_many(self, filenames):
+        """Simulate a batch download that takes as long as a single download."""
+        self.batches.append(list(filenames))
+        time.sleep(0.5)
+        return dict((fn, self.config.binary_cache) for fn in filenames if 'missing' not in fn)
+
+    def put_many(self, archives):
+        """Simulate a batch upload that takes as long as a single upload."""
+        self.put_batches.append([fn for fn, handle in archives])
+        time.sleep(0.5)
+        self.uploads.update((fn, handle.read()) for fn, handle in archives)
+
+
+class FakeS3Bucket(object):
+
+    """In memory stand-in for :class:`boto.s3.bucket.Bucket` objects (used to test the S3 cache backend)."""
+
+    def __init__(self):
+        """Initialize a :class:`FakeS3Bucket` object."""
+        self.contents = {}
+        self.listed = []
+        self.requests = []
+        self.upload_error = None
+
+    def list(self, prefix='', delimiter=''):
+        """Simulate a (sorted) listing of the keys with the given prefix."""
+        self.requests.append(('list', prefix))
+        directories = set()
+        for name in sorted(self.contents):
+            if name.startswith(prefix):
+                directory, separator, rest = name[len(prefix):].partition(delimiter or '\0')
+                if separator:
+                    if directory not in directories:
+                        directories.add(directory)
+                        yield FakeS3Key(prefix + directory + separator)
+                else:
+                    self.listed.append(name)
+                    yield FakeS3Key(name, len(self.contents[name]))
+
+    def get_key(self, name):
+        """Simulate a ``HEAD`` request."""
+        self.requests.append(('head', name))
+        if name in self.contents:
+            return FakeS3Key(name, len(self.contents[name]))
+
+    def initiate_multipart_upload(self, name):
+        """Simulate a failing upload (when :attr:`upload_error` is set)."""
+        self.requests.append(('upload', name))
+        raise self.upload_error or IOError("Simulated upload failure!")
+
+
+class FakeS3Key(object):
+
+    """In memory stand-in for :class:`boto.s3.key.Key` objects (used to test the S3 cache backend)."""
+
+    def __init__(self, name, size=None):
+        """Initialize a :class:`FakeS3Key` object."""
+        self.name = name
+        self.size = size
+
+
+class FakeS3Backend(S3CacheBackend):
+
+    """Amazon S3 cache backend that uses a :class:`FakeS3Bucket` instead of connecting to Amazon S3."""
+
+    REGISTER = False
+
+    def __init__(self, config):
+        """Initialize a :class:`FakeS3Backend` object."""
+        super(FakeS3Backend, self).__init__(config)
+        self.bucket = FakeS3Bucket()
+
+    @property
+    def s3_bucket(self):
+        """The :class:`FakeS3Bucket` used instead of an Amazon S3 bucket."""
+        return self.bucket
+
+    def check_prerequisites(self):
+        """Enable the backend without configuring an Amazon S3 bucket."""
+
+
+class StaticWebServer(object):
+
+    """Context manager that serves a temporary directory over HTTP on localhost."""
+
+    ETAG = '"pip-accel"'
+    """The ``ETag`` header returned for every file (a string)."""
+
+    def __init__(self):
+        """Initialize a :class:`StaticWebServer` object."""
+        self.directory = create_temporary_directory()
+        self.paths = []
+        self.requests = []
+        self.responses = []
+        self.server = None
+
+    @property
+    def url(self):
+        """The base URL of the web server (a string)."""
+        return 'http://127.0.0.1:%i/' % self.server.server_address[1]
+
+    def create_file(self, filename, contents):
+        """
+        Create a file that's served by the web server.
+
+        :param filename: The relative pathname of the file (a string).
+        :param contents: The contents of the file (a byte string).
+        """
+        pathname = os.path.join(self.directory, filename)
+        if not os.path.isdir(os.path.dirname(pathname)):
+            os.makedirs(os.path.dirname(pathname))
+        with open(pathname, 'wb') as handle:
+            handle.write(contents)
+
+    def __enter__(self):
+        """Start the web server in a background thread."""
+        context = self
+
+        class RequestHandler(SimpleHTTPRequestHandler):
+
+            def translate_path(self, path):
+                pathname = SimpleHTTPRequestHandler.translate_path(self, path)
+                return os.path.join(context.directory, os.path.relpath(pathname, os.getcwd()))
+
+            def send_head(self):
+                context.paths.append(self.path)
+                context.requests.append(self.headers)
+                if self.headers.get('If-None-Match') == context.ETAG:
+                    self.send_response(304)
+                    self.end_headers()
+                    return None
+                return SimpleHTTPRequestHandler.send_head(self)
+
+            def send_response(self, code, *args):
+                context.responses.append(code)
+                SimpleHTTPRequestHandler.send_response(self, code, *args)
+
+            def end_headers(self):
+                self.send_header('ETag', context.ETAG)
+                SimpleHTTPRequestHandler.end_headers(self)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = HTTPServer(('127.0.0.1', 0), RequestHandler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def __exit__(self, exc_type=None, exc_value=None, traceback=None):
+        """Stop the web server."""
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class NonSeekableStream(object):
+
+    """Readable stream that doesn't support seeking (like an HTTP response)."""
+
+    def __init__(self, contents):
+        """Initialize a :class:`NonSeekableStream` object."""
+        self.buffer = io.BytesIO(contents)
+
+    def read(self, size=-1):
+        """Read from the stream."""
+        return self.buffer.read(size)
+
+    def close(self):
+        """Close the stream."""
+        self.buffer.close()
+
+
+class DummyRequirement(object):
+
+    """Minimal stand-in for :class:`pip_accel.req.Requirement` objects used to test builds."""
+
+    def __init__(self, source_directory, name='dummy', version='1.0'):
+        """
+        Initialize a :class:`DummyRequirement` object.
+
+        :param source_directory: The pathname of the directory where the
+                                 ``setup.py`` script is created (a string).
+        :param name: The name of the dummy package (a string).
+        :param version: The version of the dummy package (a string).
+        """
+        self.source_directory = source_directory
+        self.name = name
+        self.version = version
+
+    def create_setup_script(self, source):
+        """
+        Create (or replace) the ``setup.py`` script of the dummy package.
+
+        :param source: The Python source code of the script (a string, which
+                       is dedented before being written to disk).
+        """
+        self.create_file('setup.py', source)
+
+    def create_file(self, filename, source):
+        """
+        Create (or replace) a file in the source directory of the dummy package.
+
+        :param filename: The name of the file (a string).
+        :param source: The contents of the file (a string, which is dedented
+                       before being written to disk).
+        """
+        with open(os.path.join(self.source_directory, filename), 'w') as handle:
+            handle.write(textwrap.dedent(source))
+
+    def __str__(self):
+        """Render a human friendly string describing the requirement."""
+        return "%s (%s)" % (self.name, self.version)
+
+
+def get_archive_names(pathname):
+    """
+    Get the base names of the members of a tar archive.
+
+    :param pathname: The pathname of the archive (a string).
+    :returns: A list of strings.
+    """
+    handle = tarfile.open(pathname)
+    try:
+        return [os.path.basename(n) for n in handle.getnames()]
+    finally:
+        handle.close()
+
+
+def is_boto_installed():
+    """
+    Check whether Boto (required by the Amazon S3 cache backend) is installed.
+
+    :returns: :data:`True` if Boto can be imported, :data:`False` otherwise.
+    """
+    try:
+        __import__('boto')
+        return True
+    except ImportError:
+        return False
+
+
 def wipe_directory(pathname):
     """
     Delete and recreate a directory.
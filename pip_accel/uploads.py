@@ -0,0 +1,239 @@
+# Accelerator for pip, the Python package manager.
+#
+# Author: Peter Odding <peter.odding@paylogic.com>
+# Last Change: October 31, 2015
+# URL: https://github.com/paylogic/pip-accel
+
+"""
+Background uploads to remote cache backends.
+
+Storing a newly built distribution archive in a remote cache backend (like
+Amazon S3) can take a long time on a slow uplink and by default the
+installation of the next requirement waits for the upload to finish. When the
+configuration option :attr:`~.Config.background_uploads` is enabled the
+:class:`~pip_accel.caches.CacheManager` hands uploads to remote cache backends
+to the :class:`UploadQueue` defined in this module instead:
+
+1. The distribution archive is copied to the spool directory
+   :attr:`~.Config.upload_spool` (in a subdirectory named after the cache
+   backend) so that the upload doesn't depend on files that may disappear.
+
+2. A background thread uploads the spooled files one at a time while the
+   installation continues. Successfully uploaded files are removed from the
+   spool directory.
+
+3. Before pip-accel exits it waits for the remaining uploads, but not longer
+   than :attr:`~.Config.background_upload_timeout` seconds. Files that weren't
+   uploaded remain in the spool directory and are picked up again by the next
+   run of pip-accel.
+
+When a cache backend fails during a background upload (or turns out to be
+read only) its remaining uploads are skipped and left in the spool directory
+for the next run, similar to how :class:`~pip_accel.caches.CacheManager` skips
+failing cache backends. Spooled files are only removed after an upload
+succeeded.
+"""
+
+# Standard library modules.
+import logging
+import os
+import shutil
+import threading
+import time
+
+# Modules included in our package.
+from pip_accel.utils import AtomicReplace, makedirs
+
+# External dependencies.
+from humanfriendly import Timer, pluralize
+
+# Initialize a logger for this module.
+logger = logging.getLogger(__name__)
+
+
+class UploadQueue(object):
+
+    """Queue of distribution archives to be uploaded to cache backends by a background thread."""
+
+    def __init__(self, config, metrics=None):
+        """
+        Initialize an upload queue.
+
+        :param config: The pip-accel configuration (a :class:`.Config`
+                       object).
+        :param metrics: A :class:`.CacheMetrics` object to record uploads in
+                        (optional).
+        """
+        self.config = config
+        self.metrics = metrics
+        self.pending = []
+        self.failed_backends = set()
+        self.condition = threading.Condition()
+        self.thread = None
+        self.busy = False
+
+    def submit(self, backend, filename, handle, promotion=False):
+        """
+        Spool a distribution archive and queue it for uploading.
+
+        :param backend: The cache backend to upload to (an
+                        :class:`.AbstractCacheBackend` object).
+        :param filename: The filename of the distribution archive in the cache
+                         (a string).
+        :param handle: A file-like object that provides access to the
+                       distribution archive.
+        :param promotion: :data:`True` if the upload promotes a distribution
+                          archive found in a slower cache backend (see
+                          :func:`.CacheManager.promote()`), in which case the
+                          outcome of the upload is also recorded as a
+                          ``promote`` operation.
+        """
+        spool_file = os.path.join(self.config.upload_spool, repr(backend), filename)
+        logger.debug("Spooling upload to %s: %s", backend, spool_file)
+        makedirs(os.path.dirname(spool_file))
+        with AtomicReplace(spool_file) as temporary_file:
+            with open(temporary_file, 'wb') as temporary_file_handle:
+                shutil.copyfileobj(handle, temporary_file_handle)
+        self.enqueue(backend, filename, spool_file, promotion)
+
+    def resume(self, backends):
+        """
+        Queue the uploads left in the spool directory by a previous run.
+
+        :param backends: A list of :class:`.AbstractCacheBackend` objects.
+        """
+        num_resumed = 0
+        for backend in backends:
+            directory = os.path.join(self.config.upload_spool, repr(backend))
+            for root, dirs, files in os.walk(directory):
+                for name in sorted(files):
+                    spool_file = os.path.join(root, name)
+                    # Skip temporary files created by AtomicReplace.
+                    if '.tmp-' not in name:
+                        filename = os.path.relpath(spool_file, directory)
+                        self.enqueue(backend, filename, spool_file)
+                        num_resumed += 1
+        if num_resumed > 0:
+            logger.info("Resuming %s left behind by a previous run ..",
+                        pluralize(num_resumed, "background upload"))
+
+    def enqueue(self, backend, filename, spool_file, promotion=False):
+        """
+        Add an upload to the queue (starting the background thread if necessary).
+
+        :param backend: The cache backend to upload to.
+        :param filename: The filename of the distribution archive in the cache.
+        :param spool_file: The pathname of the spooled distribution archive.
+        :param promotion: Refer to :func:`submit()`.
+        """
+        with self.condition:
+            self.pending.append((backend, filename, spool_file, promotion))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run)
+                self.thread.daemon = True
+                self.thread.start()
+            self.condition.notify_all()
+
+    def run(self):
+        """Upload spooled distribution archives (runs in the background thread)."""
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                backend, filename, spool_file, promotion = self.pending.pop(0)
+                self.busy = True
+            try:
+                success = False
+                if backend not in self.failed_backends:
+                    success = self.upload(backend, filename, spool_file)
+                if promotion and success is not None and self.metrics:
+                    self.metrics.record(backend, 'promote', 'ok' if success else 'error')
+            finally:
+                with self.condition:
+                    self.busy = False
+                    self.condition.notify_all()
+
+    def upload(self, backend, filename, spool_file):
+        """
+        Upload a single spooled distribution archive.
+
+        :param backend: The cache backend to upload to.
+        :param filename: The filename of the distribution archive in the cache.
+        :param spool_file: The pathname of the spooled distribution archive.
+        :returns: :data:`True` when the upload succeeded, :data:`False` when
+                  it failed and :data:`None` when the spool file disappeared
+                  (because a concurrent pip-accel process uploaded it).
+
+        The spool file is only removed when the upload really succeeded: When
+        the backend raises an exception, is read only or switched itself to
+        read only mode during the upload (like the Amazon S3 cache backend
+        does when it's denied access) the spool file is kept for the next run
+        and the remaining uploads to the backend are skipped.
+        """
+        timer = Timer()
+        if not backend.WRITABLE:
+            self.skip_backend(backend, "it's read only")
+            return False
+        try:
+            handle = open(spool_file, 'rb')
+        except EnvironmentError as e:
+            # The file may have been uploaded by a concurrent pip-accel process.
+            if os.path.isfile(spool_file):
+                logger.warning("Failed to read spooled upload %s: %s", spool_file, e)
+                return False
+            return None
+        try:
+            with handle:
+                size = os.fstat(handle.fileno()).st_size
+                backend.put(filename, handle)
+        except Exception as e:
+            self.skip_backend(backend, "it failed: %s" % e)
+            return False
+        if not backend.WRITABLE:
+            # The backend swallowed the failure and switched to read only mode.
+            self.skip_backend(backend, "it switched to read only mode")
+            return False
+        logger.debug("Finished background upload to %s in %s: %s", backend, timer, filename)
+        if self.metrics:
+            self.metrics.record(backend, 'put', 'ok', timer.elapsed_time, size)
+        try:
+            os.unlink(spool_file)
+        except EnvironmentError:
+            pass
+        return True
+
+    def skip_backend(self, backend, reason):
+        """
+        Skip the remaining background uploads to a cache backend (they stay in the spool directory).
+
+        :param backend: The cache backend.
+        :param reason: The reason why the backend is skipped (a string).
+        """
+        logger.warning("Skipping background uploads to %s because %s (leaving them in %s).",
+                       backend, reason, self.config.upload_spool)
+        self.failed_backends.add(backend)
+        if self.metrics:
+            self.metrics.record(backend, 'put', 'error')
+
+    def join(self, timeout):
+        """
+        Wait for the queued uploads to finish.
+
+        :param timeout: The maximum number of seconds to wait (a number).
+        :returns: :data:`True` when all uploads finished, :data:`False` when
+                  the timeout expired (the remaining uploads stay in the
+                  spool directory).
+        """
+        deadline = time.time() + timeout
+        with self.condition:
+            if self.pending or self.busy:
+                logger.info("Waiting for %s to finish ..",
+                            pluralize(len(self.pending) + int(self.busy), "background upload"))
+            while self.pending or self.busy:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    logger.warning("Giving up on %s (they will be resumed by the next run).",
+                                   pluralize(len(self.pending) + int(self.busy), "background upload"))
+                    return False
+                self.condition.wait(remaining)
+        return True
@@ -14,10 +14,13 @@ with any single module.
 
 # Standard library modules.
 import errno
+import filecmp
 import logging
 import os
 import platform
+import shutil
 import sys
+import threading
 
 # Modules included in our package.
 from pip_accel.compat import WINDOWS
@@ -224,6 +227,218 @@ class AtomicReplace(object):
             replace_file(self.temporary_file, self.filename)
 
 
+class TeeReader(object):
+
+    """
+    File-like object that copies the data read from a stream to a file.
+
+    The file is created using the same temporary file naming as
+    :class:`AtomicReplace` and it's only moved into place when the stream was
+    read completely (until end of file) before :func:`close()` is called, so
+    interrupted reads never leave a partial file behind.
+    """
+
+    def __init__(self, stream, filename, callback=None):
+        """
+        Initialize a :class:`TeeReader` object.
+
+        :param stream: The file-like object to read from.
+        :param filename: The pathname of the file to create (a string).
+        :param callback: A callable that's called with the pathname of the
+                         file after it has been moved into place (optional).
+        """
+        self.stream = stream
+        self.filename = filename
+        self.callback = callback
+        self.temporary_file = '%s.tmp-%i' % (filename, os.getpid())
+        makedirs(os.path.dirname(filename))
+        self.handle = open(self.temporary_file, 'wb')
+        self.finished = False
+
+    def read(self, size=-1):
+        """
+        Read data from the stream and copy it to the file.
+
+        :param size: The maximum number of bytes to read (an integer, defaults
+                     to reading until the end of the stream).
+        :returns: The data that was read (a byte string).
+        """
+        if self.finished:
+            # Some streams (e.g. Boto keys) start over when read after the end.
+            return b''
+        data = self.stream.read(size) if size >= 0 else self.stream.read()
+        if data:
+            self.handle.write(data)
+        if size < 0 or not data:
+            self.finished = True
+        return data
+
+    def close(self):
+        """Close the stream and move the file into place (if the stream was read completely)."""
+        if self.handle is not None:
+            self.handle.close()
+            self.handle = None
+            self.stream.close()
+            if self.finished:
+                logger.debug("Moving temporary file into place: %s", self.filename)
+                replace_file(self.temporary_file, self.filename)
+                if self.callback is not None:
+                    self.callback(self.filename)
+            else:
+                logger.debug("Discarding incomplete temporary file: %s", self.temporary_file)
+                os.unlink(self.temporary_file)
+
+
+class FileLock(object):
+
+    """
+    Context manager for exclusive advisory locks on a lock file.
+
+    The lock is implemented using :func:`fcntl.flock()`. On platforms where
+    :mod:`fcntl` isn't available (Windows) locking is a no-op.
+    """
+
+    def __init__(self, filename):
+        """
+        Initialize a :class:`FileLock` object.
+
+        :param filename: The pathname of the lock file (a string). The file
+                         is created when it doesn't exist yet.
+        """
+        self.filename = filename
+        self.handle = None
+
+    def acquire(self):
+        """Acquire the lock, waiting for other processes to release it."""
+        if self.handle is None:
+            makedirs(os.path.dirname(self.filename))
+            self.handle = open(self.filename, 'a')
+            try:
+                import fcntl
+            except ImportError:
+                return
+            logger.debug("Acquiring lock: %s", self.filename)
+            fcntl.flock(self.handle.fileno(), fcntl.LOCK_EX)
+
+    def release(self):
+        """Release the lock (closing the lock file releases the lock)."""
+        if self.handle is not None:
+            logger.debug("Releasing lock: %s", self.filename)
+            self.handle.close()
+            self.handle = None
+
+    def __enter__(self):
+        """Acquire the lock."""
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type=None, exc_value=None, traceback=None):
+        """Release the lock."""
+        self.release()
+
+
+def synchronize_directories(source, target, preserve=()):
+    """
+    Make the contents of one directory identical to another directory.
+
+    :param source: The pathname of the source directory (a string).
+    :param target: The pathname of the target directory (a string).
+    :param preserve: An iterable of strings with the names of top level
+                     entries in the target directory that are left alone.
+    :returns: The number of files that were created or updated (an integer).
+
+    Files in the target directory whose contents are identical to the
+    corresponding file in the source directory are left untouched (which
+    preserves their last modified time), other files are copied. Files and
+    directories that don't exist in the source directory are removed from the
+    target directory.
+    """
+    num_updated = 0
+    preserve = set(preserve)
+    for root, dirs, files in os.walk(source):
+        relative_root = os.path.relpath(root, source)
+        if relative_root == os.curdir:
+            # Never copy an entry that would overwrite a preserved entry.
+            dirs[:] = [d for d in dirs if d not in preserve]
+            files = [f for f in files if f not in preserve]
+        target_root = os.path.normpath(os.path.join(target, relative_root))
+        for name in dirs:
+            pathname = os.path.join(target_root, name)
+            if os.path.islink(pathname) or os.path.isfile(pathname):
+                os.unlink(pathname)
+            makedirs(pathname)
+        for name in files:
+            source_file = os.path.join(root, name)
+            target_file = os.path.join(target_root, name)
+            if os.path.isdir(target_file) and not os.path.islink(target_file):
+                shutil.rmtree(target_file)
+            if not (os.path.isfile(target_file) and filecmp.cmp(source_file, target_file, shallow=False)):
+                # We don't preserve the last modified time because the copy
+                # needs to be considered newer than any build products.
+                shutil.copyfile(source_file, target_file)
+                shutil.copymode(source_file, target_file)
+                num_updated += 1
+    for root, dirs, files in os.walk(target):
+        relative_root = os.path.relpath(root, target)
+        if relative_root == os.curdir:
+            dirs[:] = [d for d in dirs if d not in preserve]
+            files = [f for f in files if f not in preserve]
+        source_root = os.path.normpath(os.path.join(source, relative_root))
+        for name in list(dirs):
+            pathname = os.path.join(root, name)
+            if os.path.islink(pathname):
+                os.unlink(pathname)
+                dirs.remove(name)
+            elif not os.path.isdir(os.path.join(source_root, name)):
+                shutil.rmtree(pathname)
+                dirs.remove(name)
+        for name in files:
+            if not os.path.isfile(os.path.join(source_root, name)):
+                os.unlink(os.path.join(root, name))
+    return num_updated
+
+
+def run_concurrently(function, items, num_threads):
+    """
+    Call a function for each of the given items using a pool of threads.
+
+    :param function: The function to call (a callable that takes a single
+                     argument).
+    :param items: An iterable of arguments for the function.
+    :param num_threads: The maximum number of threads to use (an integer).
+    :returns: A list of tuples with three values each: The item, the value
+              returned by the function (:data:`None` if the function raised
+              an exception) and the exception raised by the function
+              (:data:`None` if the function returned normally). The tuples
+              are in the same order as the items.
+
+    Exceptions raised by the function don't affect the processing of the
+    other items, it's up to the caller to decide how to handle them.
+    """
+    pending = list(enumerate(items))
+    results = [None] * len(pending)
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                if not pending:
+                    return
+                index, item = pending.pop(0)
+            try:
+                results[index] = (item, function(item), None)
+            except Exception as e:
+                results[index] = (item, None, e)
+
+    threads = [threading.Thread(target=worker) for i in range(min(num_threads, len(pending)))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
 def is_installed(package_name):
     """
     Check whether a package is installed in the current environment.
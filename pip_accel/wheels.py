@@ -0,0 +1,314 @@
+# Accelerator for pip, the Python package manager.
+#
+# Author: Peter Odding <peter.odding@paylogic.com>
+# Last Change: October 31, 2015
+# URL: https://github.com/paylogic/pip-accel
+
+"""
+Fast installation of wheel distributions.
+
+When :attr:`.Config.build_wheels` is enabled pip-accel converts source
+distributions to wheels instead of "dumb binary distributions". This module
+installs those wheels without unpacking them to a temporary directory first:
+Files are written straight from the archive to their final location.
+
+Compared to the installation of dumb binary distributions the big advantage of
+wheels is that they contain an exact manifest of the files they install (the
+``RECORD`` file). After installation a new ``RECORD`` file is written which
+lists the installed files, so ``pip uninstall`` knows exactly what to remove.
+
+Just like the installation of dumb binary distributions (and unlike pip) the
+installed modules are not byte compiled.
+"""
+
+# Standard library modules.
+import base64
+import csv
+import email.parser
+import hashlib
+import logging
+import os
+import os.path
+import re
+import stat
+import sys
+import zipfile
+
+# Modules included in our package.
+from pip_accel.compat import StringIO
+from pip_accel.exceptions import InvalidWheelDistribution
+from pip_accel.utils import makedirs
+
+# External dependencies.
+from pip._vendor.distlib.scripts import ScriptMaker
+from pkg_resources import EntryPoint
+
+# Initialize a logger for this module.
+logger = logging.getLogger(__name__)
+
+SUPPORTED_WHEEL_VERSION = (1, 0)
+"""The version of the wheel format implemented by this module (a tuple of integers)."""
+
+
+def install_wheel(pathname, prefix, python, virtualenv_compatible=True):
+    """
+    Install a wheel distribution archive.
+
+    :param pathname: The pathname of the wheel distribution archive (a string).
+    :param prefix: The "prefix" under which the wheel should be installed.
+                   This will be a pathname like ``/usr``, ``/usr/local`` or
+                   the pathname of a virtual environment.
+    :param python: The pathname of the Python executable to use in the
+                   hashbang line of executable scripts (a string).
+    :param virtualenv_compatible: Whether to install C header files in the
+                                  same location as pip does in virtual
+                                  environments (defaults to :data:`True`).
+    :returns: A list of strings with the absolute pathnames of the installed
+              files (including the generated ``RECORD`` file).
+    :raises: :exc:`.InvalidWheelDistribution` when the archive isn't a valid
+             wheel distribution archive.
+    """
+    logger.debug("Installing wheel distribution: %s", pathname)
+    archive = zipfile.ZipFile(pathname)
+    try:
+        dist_info = find_dist_info(archive, pathname)
+        metadata = email.parser.Parser().parsestr(archive.read(dist_info + '/WHEEL').decode('utf-8'))
+        check_wheel_version(metadata.get('Wheel-Version', ''), pathname)
+        basename = dist_info[:-len('.dist-info')]
+        scheme = get_install_scheme(basename.split('-')[0], prefix, virtualenv_compatible)
+        if metadata.get('Root-Is-Purelib', '').strip().lower() == 'true':
+            library_directory = scheme['purelib']
+        else:
+            library_directory = scheme['platlib']
+        entry_points = get_entry_points(archive, dist_info)
+        installed_files = []
+        for member in archive.infolist():
+            components = member.filename.split('/')
+            if member.filename.endswith('/') or member.filename == dist_info + '/RECORD':
+                continue
+            if member.filename.startswith('/') or '..' in components:
+                raise InvalidWheelDistribution("Wheel distribution {filename} contains unsafe pathname {member}!",
+                                               filename=pathname, member=member.filename)
+            contents = archive.read(member)
+            mode = 0o755 if (member.external_attr >> 16) & stat.S_IXUSR else 0o644
+            if components[0] == basename + '.data':
+                if len(components) < 3 or components[1] not in scheme:
+                    raise InvalidWheelDistribution("Wheel distribution {filename} contains unknown data file {member}!",
+                                                   filename=pathname, member=member.filename)
+                category = components[1]
+                target = os.path.join(scheme[category], *components[2:])
+                if category == 'scripts':
+                    if is_entry_point_wrapper(components[-1], entry_points):
+                        # Wrappers generated by setuptools are replaced by
+                        # the wrappers that we generate ourselves below.
+                        continue
+                    if contents.startswith(b'#!python'):
+                        contents = fix_script_hashbang(contents, python)
+                        mode = 0o755
+            else:
+                target = os.path.join(library_directory, *components)
+            installed_files.append(write_file(target, contents, mode))
+        for script in generate_scripts(entry_points, scheme['scripts'], python):
+            with open(script, 'rb') as handle:
+                installed_files.append((script, hash_contents(handle.read()), os.path.getsize(script)))
+        record_file = os.path.join(library_directory, dist_info, 'RECORD')
+        write_record(record_file, installed_files, library_directory)
+        return [fn for fn, digest, size in installed_files] + [record_file]
+    finally:
+        archive.close()
+
+
+def find_dist_info(archive, pathname):
+    """
+    Find the ``*.dist-info`` directory in a wheel distribution archive.
+
+    :param archive: A :class:`zipfile.ZipFile` object.
+    :param pathname: The pathname of the archive (a string, used in error messages).
+    :returns: The name of the ``*.dist-info`` directory (a string).
+    :raises: :exc:`.InvalidWheelDistribution` when the archive doesn't contain
+             exactly one ``*.dist-info`` directory.
+    """
+    matches = set()
+    for filename in archive.namelist():
+        match = re.match(r'^([^/]+\.dist-info)/WHEEL$', filename)
+        if match:
+            matches.add(match.group(1))
+    if len(matches) != 1:
+        raise InvalidWheelDistribution("""
+            Wheel distribution {filename} doesn't contain exactly one
+            *.dist-info directory!
+        """, filename=pathname)
+    return matches.pop()
+
+
+def check_wheel_version(value, pathname):
+    """
+    Make sure the version of the wheel format is supported.
+
+    :param value: The value of the ``Wheel-Version`` field (a string).
+    :param pathname: The pathname of the archive (a string, used in error messages).
+    :raises: :exc:`.InvalidWheelDistribution` when the major version of the
+             wheel format isn't supported.
+    """
+    try:
+        version = tuple(int(n) for n in value.strip().split('.'))
+    except ValueError:
+        version = ()
+    if not version or version[0] != SUPPORTED_WHEEL_VERSION[0]:
+        raise InvalidWheelDistribution("Wheel distribution {filename} uses unsupported format version {version}!",
+                                       filename=pathname, version=repr(value))
+    if version > SUPPORTED_WHEEL_VERSION:
+        logger.warning("Installing wheel distribution %s with newer format version %s ..", pathname, value)
+
+
+def get_install_scheme(name, prefix, virtualenv_compatible=True):
+    """
+    Find the installation directories for a distribution.
+
+    :param name: The name of the distribution (a string).
+    :param prefix: The installation prefix (a string).
+    :param virtualenv_compatible: Whether to install C header files in the
+                                  same location as pip does in virtual
+                                  environments (a boolean).
+    :returns: A dictionary with the keys ``purelib``, ``platlib``,
+              ``headers``, ``scripts`` and ``data``.
+
+    This function asks :mod:`distutils` for its installation directories (like
+    pip does) so that e.g. Debian's ``dist-packages`` convention is respected.
+    """
+    # Late import because setuptools replaces distutils.dist.Distribution.
+    from distutils.dist import Distribution
+    command = Distribution(dict(name=name)).get_command_obj('install', create=True)
+    command.prefix = prefix
+    command.finalize_options()
+    scheme = dict((key, getattr(command, 'install_' + key))
+                  for key in ('purelib', 'platlib', 'headers', 'scripts', 'data'))
+    if virtualenv_compatible:
+        # The include/pythonX.Y/ directory in a virtual environment is a
+        # symbolic link to a system wide directory, so we implement the same
+        # workaround that pip uses to avoid installing C header files there.
+        scheme['headers'] = os.path.join(prefix, 'include', 'site', 'python%i.%i' % sys.version_info[:2], name)
+    return scheme
+
+
+def get_entry_points(archive, dist_info):
+    """
+    Get the entry points for which wrapper scripts should be generated.
+
+    :param archive: A :class:`zipfile.ZipFile` object.
+    :param dist_info: The name of the ``*.dist-info`` directory (a string).
+    :returns: A dictionary with the keys ``console_scripts`` and
+              ``gui_scripts``, the values are dictionaries that map script
+              names to :class:`pkg_resources.EntryPoint` objects.
+    """
+    entry_points = dict(console_scripts={}, gui_scripts={})
+    filename = dist_info + '/entry_points.txt'
+    if filename in archive.namelist():
+        for group, mapping in EntryPoint.parse_map(archive.read(filename).decode('utf-8')).items():
+            if group in entry_points:
+                entry_points[group].update(mapping)
+    return entry_points
+
+
+def is_entry_point_wrapper(filename, entry_points):
+    """
+    Check whether a script was generated by setuptools for an entry point.
+
+    :param filename: The base name of the script (a string).
+    :param entry_points: The result of :func:`get_entry_points()`.
+    :returns: :data:`True` if the script is a wrapper for an entry point,
+              :data:`False` otherwise.
+    """
+    name = re.sub(r'(?i)(\.exe|-script\.pyw?|\.pya)$', '', filename)
+    return any(name in mapping for mapping in entry_points.values())
+
+
+def fix_script_hashbang(contents, python):
+    """
+    Rewrite the ``#!python`` hashbang of a script included in a wheel.
+
+    :param contents: The contents of the script (a byte string).
+    :param python: The absolute pathname of the Python executable (a string).
+    :returns: The modified contents of the script (a byte string).
+    """
+    first_line, _, remainder = contents.partition(b'\n')
+    return b'#!' + python.encode(sys.getfilesystemencoding() or 'utf-8') + b'\n' + remainder
+
+
+def generate_scripts(entry_points, directory, python):
+    """
+    Generate wrapper scripts for ``console_scripts`` and ``gui_scripts`` entry points.
+
+    :param entry_points: The result of :func:`get_entry_points()`.
+    :param directory: The directory where scripts are installed (a string).
+    :param python: The absolute pathname of the Python executable (a string).
+    :returns: A list of strings with the pathnames of the generated scripts.
+    """
+    generated_scripts = []
+    for group, options in (('console_scripts', None), ('gui_scripts', dict(gui=True))):
+        specifications = ['%s = %s:%s' % (name, entry_point.module_name, '.'.join(entry_point.attrs))
+                          for name, entry_point in sorted(entry_points[group].items())]
+        if specifications:
+            makedirs(directory)
+            maker = ScriptMaker(None, directory)
+            maker.clobber = True
+            maker.variants = set(('',))
+            maker.set_mode = True
+            maker.executable = python
+            generated_scripts.extend(maker.make_multiple(specifications, options))
+    return generated_scripts
+
+
+def write_file(pathname, contents, mode):
+    """
+    Create a file with the given contents and permissions.
+
+    :param pathname: The pathname of the file (a string).
+    :param contents: The contents of the file (a byte string).
+    :param mode: The permissions of the file (an integer).
+    :returns: A tuple with the pathname of the file, its hash and its size
+              (in the format used in ``RECORD`` files).
+    """
+    directory = os.path.dirname(pathname)
+    if not os.path.isdir(directory):
+        logger.debug("Creating directory: %s ..", directory)
+        makedirs(directory)
+    logger.debug("Creating file: %s ..", pathname)
+    with open(pathname, 'wb') as handle:
+        handle.write(contents)
+    os.chmod(pathname, mode)
+    return pathname, hash_contents(contents), len(contents)
+
+
+def hash_contents(contents):
+    """
+    Calculate the hash of a file in the format used in ``RECORD`` files.
+
+    :param contents: The contents of the file (a byte string).
+    :returns: A string like ``sha256=...``.
+    """
+    digest = base64.urlsafe_b64encode(hashlib.sha256(contents).digest()).rstrip(b'=')
+    return 'sha256=' + digest.decode('ascii')
+
+
+def write_record(pathname, installed_files, library_directory):
+    """
+    Create the ``RECORD`` file of an installed wheel.
+
+    :param pathname: The pathname of the ``RECORD`` file (a string).
+    :param installed_files: A list of tuples in the format returned by
+                            :func:`write_file()`.
+    :param library_directory: The directory relative to which the pathnames
+                              in the ``RECORD`` file are expressed (a string).
+    """
+    def relative(filename):
+        return os.path.relpath(filename, library_directory).replace(os.sep, '/')
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    for filename, digest, size in installed_files:
+        writer.writerow((relative(filename), digest, size))
+    writer.writerow((relative(pathname), '', ''))
+    logger.debug("Recording installed files in %s ..", pathname)
+    data = buffer.getvalue()
+    with open(pathname, 'wb') as handle:
+        handle.write(data if isinstance(data, bytes) else data.encode('utf-8'))
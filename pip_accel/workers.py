@@ -0,0 +1,354 @@
+# Accelerator for pip, the Python package manager.
+#
+# Author: Peter Odding <peter.odding@paylogic.com>
+# Last Change: October 31, 2015
+# URL: https://github.com/paylogic/pip-accel
+
+"""
+Warm build worker processes.
+
+Before this module existed every binary distribution build started a fresh
+Python interpreter which imported setuptools and then evaluated the ``setup.py``
+script of the package being built. For small pure Python packages the startup
+of the interpreter and the import of setuptools take more time than the actual
+build, which adds up quickly for requirement sets with hundreds of packages.
+
+This module implements a pool of "warm" build workers in the style of the
+`forkserver` start method of the :mod:`multiprocessing` module: Each worker is
+a long running Python process that has already imported setuptools. For every
+build it forks a child process that changes to the source directory, redirects
+its output and evaluates the ``setup.py`` script. Because the child process
+starts from a pristine copy of the worker's state, builds can't influence each
+other.
+
+Warm build workers are disabled by default, to enable them set the
+configuration option :attr:`~.Config.build_workers`. They depend on
+:func:`os.fork()` so they're not available on Windows. Whenever a worker can't
+be used :class:`~pip_accel.bdist.BinaryDistributionManager` silently falls
+back to starting a new Python process for the build.
+"""
+
+# Standard library modules.
+import atexit
+import errno
+import json
+import logging
+import os
+import select
+import signal
+import subprocess
+import time
+
+# Modules included in our package.
+from pip_accel.compat import WINDOWS
+
+# External dependencies.
+from humanfriendly import format_timespan
+
+# Initialize a logger for this module.
+logger = logging.getLogger(__name__)
+
+# The number of seconds to wait for a worker to report that it's ready (or that
+# it started a build) before falling back to a new Python process.
+RESPONSE_TIMEOUT = 30
+
+WORKER_SCRIPT = r'''
+import json, os, sys, traceback, types
+# Keep a private copy of the standard output stream for the protocol and make
+# sure that anything printed by imported modules doesn't corrupt it.
+channel = os.fdopen(os.dup(1), 'w')
+os.dup2(2, 1)
+import setuptools
+# Keep a reference to this module because Python 2 clears the globals of
+# modules that are garbage collected (sys.modules['__main__'] is replaced).
+worker = sys.modules['__main__']
+def encode(value):
+    if isinstance(value, dict):
+        return dict((encode(k), encode(v)) for k, v in value.items())
+    elif isinstance(value, list):
+        return [encode(v) for v in value]
+    elif isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+def run(request):
+    if sys.version_info[0] == 2:
+        request = encode(request)
+    os.chdir(request['directory'])
+    output = os.open(request['output'], os.O_WRONLY | os.O_APPEND)
+    os.dup2(output, 1)
+    os.dup2(output, 2)
+    os.dup2(os.open(os.devnull, os.O_RDONLY), 0)
+    os.environ.clear()
+    os.environ.update(request['environment'])
+    sys.argv = ['-c'] + request['arguments']
+    sys.path_importer_cache.clear()
+    main = types.ModuleType('__main__')
+    main.__dict__.update(__file__=request['setup_script'], setuptools=setuptools)
+    sys.modules['__main__'] = main
+    with open(request['setup_script']) as handle:
+        source = handle.read().replace('\r\n', '\n')
+    exec(compile(source, request['setup_script'], 'exec'), main.__dict__)
+channel.write('ready\n')
+channel.flush()
+for line in iter(sys.stdin.readline, ''):
+    request = json.loads(line)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid == 0:
+        status = 0
+        try:
+            run(request)
+        except SystemExit as e:
+            if e.code is None or isinstance(e.code, int):
+                status = e.code or 0
+            else:
+                sys.stderr.write('%s\n' % e.code)
+                status = 1
+        except BaseException:
+            traceback.print_exc()
+            status = 1
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(status)
+    channel.write('started %i\n' % pid)
+    channel.flush()
+    pid, status = os.waitpid(pid, 0)
+    if os.WIFSIGNALED(status):
+        status = -os.WTERMSIG(status)
+    else:
+        status = os.WEXITSTATUS(status)
+    channel.write('exited %i\n' % status)
+    channel.flush()
+'''
+"""The Python code executed by warm build workers (a string)."""
+
+
+class BuildWorkerPool(object):
+
+    """Pool of warm build workers that run ``setup.py`` scripts in forked child processes."""
+
+    def __init__(self, config):
+        """
+        Initialize a build worker pool.
+
+        :param config: The pip-accel configuration (a :class:`.Config`
+                       object).
+        """
+        self.config = config
+        self.workers = []
+        self.disabled = False
+        atexit.register(self.shutdown)
+
+    @property
+    def enabled(self):
+        """:data:`True` if warm build workers can be used, :data:`False` otherwise."""
+        return self.config.build_workers > 0 and not (WINDOWS or self.disabled)
+
+    def start_build(self, setup_script, arguments, directory, output):
+        """
+        Start a build using a warm build worker.
+
+        :param setup_script: The pathname of the ``setup.py`` script (a string).
+        :param arguments: A list of strings with the arguments to ``setup.py``.
+        :param directory: The working directory for the build (a string).
+        :param output: The pathname of an existing file or named pipe to which
+                       the output of the build should be written (a string).
+        :returns: A :class:`WorkerBuild` object or :data:`None` when no warm
+                  build worker is available.
+        """
+        if self.enabled:
+            worker = self.find_idle_worker()
+            if worker:
+                try:
+                    return worker.start_build(setup_script, arguments, directory, output)
+                except Exception as e:
+                    logger.warning("Failed to start build using %s, falling back to new process: %s", worker, e)
+                    worker.terminate()
+
+    def find_idle_worker(self):
+        """
+        Find or create an idle warm build worker.
+
+        :returns: A :class:`BuildWorker` object or :data:`None` when all
+                  workers are busy (or a new worker failed to start).
+        """
+        self.workers = [w for w in self.workers if w.is_alive]
+        for worker in self.workers:
+            if not worker.is_busy:
+                return worker
+        if len(self.workers) < self.config.build_workers:
+            try:
+                worker = BuildWorker(self.config.python_executable)
+                self.workers.append(worker)
+                return worker
+            except Exception as e:
+                logger.warning("Disabling warm build workers because worker failed to start: %s", e)
+                self.disabled = True
+
+    def shutdown(self):
+        """Shut down all warm build workers."""
+        while self.workers:
+            self.workers.pop().terminate()
+
+
+class BuildWorker(object):
+
+    """A single warm build worker process."""
+
+    def __init__(self, python_executable):
+        """
+        Start a warm build worker.
+
+        :param python_executable: The pathname of the Python executable used
+                                  to run the worker (a string).
+        :raises: :exc:`~exceptions.Exception` when the worker fails to start
+                 or doesn't report that it's ready within
+                 :data:`RESPONSE_TIMEOUT` seconds.
+        """
+        logger.debug("Starting warm build worker using %s ..", python_executable)
+        self.current_build = None
+        self.buffer = b''
+        self.process = subprocess.Popen([python_executable, '-c', WORKER_SCRIPT],
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        close_fds=True)
+        if self.read_line(RESPONSE_TIMEOUT) != 'ready':
+            self.terminate()
+            raise Exception("Warm build worker didn't report that it's ready within %s!" %
+                            format_timespan(RESPONSE_TIMEOUT))
+        logger.debug("Started %s.", self)
+
+    @property
+    def is_alive(self):
+        """:data:`True` if the worker process is still running, :data:`False` otherwise."""
+        return self.process.poll() is None
+
+    @property
+    def is_busy(self):
+        """:data:`True` if the worker is running a build, :data:`False` otherwise."""
+        return self.current_build is not None and self.current_build.returncode is None
+
+    def start_build(self, setup_script, arguments, directory, output):
+        """
+        Start a build in a forked child process of the worker.
+
+        Refer to :func:`BuildWorkerPool.start_build()` for details about the
+        parameters.
+
+        :returns: A :class:`WorkerBuild` object.
+        """
+        request = dict(setup_script=setup_script,
+                       arguments=list(arguments),
+                       directory=directory,
+                       output=output,
+                       environment=dict(os.environ))
+        self.process.stdin.write((json.dumps(request) + '\n').encode('utf-8'))
+        self.process.stdin.flush()
+        tokens = (self.read_line(RESPONSE_TIMEOUT) or '').split()
+        if len(tokens) != 2 or tokens[0] != 'started':
+            raise Exception("Warm build worker didn't confirm the start of the build!")
+        self.current_build = WorkerBuild(self, int(tokens[1]))
+        return self.current_build
+
+    def read_line(self, timeout=None):
+        """
+        Read a line of output from the worker.
+
+        :param timeout: The number of seconds to wait for a line of output or
+                        :data:`None` to wait indefinitely.
+        :returns: The line of output without trailing newline (a string) or
+                  :data:`None` when the timeout expired or the worker exited.
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+        fd = self.process.stdout.fileno()
+        while b'\n' not in self.buffer:
+            remaining = max(0, deadline - time.time()) if deadline is not None else None
+            try:
+                readable, _, _ = select.select([fd], [], [], remaining)
+            except select.error as e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            if not readable:
+                return None
+            data = os.read(fd, 4096)
+            if not data:
+                # The worker closed its end of the pipe, which means it's exiting.
+                self.process.wait()
+                return None
+            self.buffer += data
+        line, _, self.buffer = self.buffer.partition(b'\n')
+        return line.decode('ascii')
+
+    def terminate(self):
+        """Terminate the worker process (if it's still running)."""
+        if self.is_alive:
+            logger.debug("Terminating %s ..", self)
+            try:
+                self.process.stdin.close()
+                self.process.terminate()
+            except Exception:
+                pass
+            self.process.wait()
+
+    def __repr__(self):
+        """Generate a textual representation of the worker."""
+        return "BuildWorker(pid=%i)" % self.process.pid
+
+
+class WorkerBuild(object):
+
+    """
+    A build running in a forked child process of a warm build worker.
+
+    This class implements the subset of the interface of
+    :class:`subprocess.Popen` that's used to supervise builds.
+    """
+
+    def __init__(self, worker, pid):
+        """
+        Initialize a :class:`WorkerBuild` object.
+
+        :param worker: The :class:`BuildWorker` running the build.
+        :param pid: The process id of the forked child process (an integer).
+        """
+        self.worker = worker
+        self.pid = pid
+        self.returncode = None
+
+    def poll(self):
+        """
+        Check whether the build has finished.
+
+        :returns: The exit code of the build (an integer) or :data:`None` if
+                  the build is still running.
+        """
+        return self.wait(timeout=0)
+
+    def wait(self, timeout=None):
+        """
+        Wait for the build to finish.
+
+        :param timeout: The number of seconds to wait or :data:`None` to wait
+                        until the build finishes.
+        :returns: The exit code of the build (an integer) or :data:`None` if
+                  the build is still running after the timeout expired.
+        """
+        if self.returncode is None:
+            line = self.worker.read_line(timeout)
+            if line is not None:
+                tokens = line.split()
+                if len(tokens) == 2 and tokens[0] == 'exited':
+                    self.returncode = int(tokens[1])
+            elif not self.worker.is_alive:
+                # Report worker crashes as failed builds.
+                self.returncode = 1
+        return self.returncode
+
+    def kill(self):
+        """Kill the build."""
+        try:
+            os.kill(self.pid, signal.SIGKILL)
+        except OSError as e:
+            if e.errno != errno.ESRCH:
+                raise
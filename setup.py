@@ -55,6 +55,10 @@ setup(name='pip-accel',
               'local = pip_accel.caches.local',
               # An optional cache backend that uses Amazon S3.
               's3 = pip_accel.caches.s3 [s3]',
+              # An optional read only cache backend that uses a web server.
+              'http = pip_accel.caches.http',
+              # An alternative to the local cache backend that uses SQLite.
+              'sqlite = pip_accel.caches.sqlite',
           ],
       },
       extras_require={'s3': 'boto >= 2.32'},